@@ -1,10 +1,17 @@
 import time
-import numpy as np
-from brainflow.board_shim import BoardShim, BrainFlowInputParams, BoardIds
-from scipy.signal import butter, lfilter, iirnotch
+from brainflow.board_shim import BoardShim, BoardIds
+from streaming_filter import StreamingFilter
+from ring_buffer import RingBuffer
+from online_normalizer import OnlineNormalizer
+from filter_bank import FilterBank
+from board_source import BrainFlowSource
+from shared_stream import StreamPublisher
 import platform
 import serial
 
+# Shared memory block the processed stream is published to
+STREAM_NAME = 'eeg_processed'
+
 def find_serial_port():
     """
     Automatically find the correct serial port for the device across different operating systems.
@@ -33,39 +40,68 @@ class EEGProcessor:
     Configured for interfacing with the synthetic board.
 
     To switch to the real board, comment and uncomment the lines specified below.
+    Any board source from board_source can be given instead, e.g. a PlaybackSource to replay a recorded session.
+    With calibration_sec, the z-score statistics are frozen after that many seconds of signal.
+    With bands, e.g. filter_bank.DEFAULT_BANDS, the filtered signal is also split into those sub-bands,
+    see get_recent_bands().
     """
-    def __init__(self):
-        # Initialize BrainFlow
-        BoardShim.enable_dev_board_logger()
-        params = BrainFlowInputParams()
-        # Comment out the next line for switching to Cyton Daisy
-        self.board_id = BoardIds.SYNTHETIC_BOARD.value
-        # Uncomment the next 3 lines for switching to Cyton Daisy
-        #serial_port = find_serial_port()
-        #params.serial_port = serial_port
-        #self.board_id = BoardIds.CYTON_DAISY_BOARD.value
-        self.board = BoardShim(self.board_id, params)
+    def __init__(self, source=None, calibration_sec=None, bands=None):
+        if source is None:
+            # Initialize BrainFlow
+            BoardShim.enable_dev_board_logger()
+            # Comment out the next line for switching to Cyton Daisy
+            source = BrainFlowSource(BoardIds.SYNTHETIC_BOARD.value)
+            # Uncomment the next 2 lines for switching to Cyton Daisy
+            #serial_port = find_serial_port()
+            #source = BrainFlowSource(BoardIds.CYTON_DAISY_BOARD.value, serial_port=serial_port)
+        # Checked before the board session is opened, so an invalid value doesn't leave it open
+        freeze_after = None if calibration_sec is None else int(calibration_sec * source.sampling_rate)
+        if freeze_after is not None and freeze_after < 1:
+            raise ValueError(f"calibration_sec has to last at least one sample, not {calibration_sec}")
+        self.board = source
+        self.board_id = source.board_id
         self.board.prepare_session()
         self.board.start_stream()
         print("BrainFlow streaming started...")
 
         # Sampling rate and window size
-        self.sampling_rate = BoardShim.get_sampling_rate(self.board_id)
+        self.sampling_rate = source.sampling_rate
         self.window_size_sec = 1.5  # seconds
         self.window_size_samples = int(self.window_size_sec * self.sampling_rate)
 
-        # we set raw window size to 10 seconds (why?)
+        # Length of the z-score statistics window (why 7 seconds?)
         self.window_size_raw = int(7 * self.sampling_rate)
         self.lowcut = 1.0
         self.highcut = 50.0
         self.notch = 60.0
 
         # Get EEG channels
-        self.eeg_channels = BoardShim.get_eeg_channels(self.board_id)
+        self.eeg_channels = source.eeg_channels
+        self.timestamp_channel = source.timestamp_channel
+
+        # Bandpass and notch filter, designed once and kept stateful between calls
+        self.filter = StreamingFilter(len(self.eeg_channels), self.sampling_rate,
+                                      self.lowcut, self.highcut, self.notch)
+
+        # Initialize preallocated circular buffers, the processed buffer holds two windows
+        self.processed_data_buffer = RingBuffer(len(self.eeg_channels), self.window_size_samples * 2)
 
-        # Initialize buffers
-        self.raw_data_buffer = np.empty((len(self.eeg_channels), 0))
-        self.processed_data_buffer = np.empty((len(self.eeg_channels), 0))
+        # Running z-score statistics of the filtered signal over the raw window length, frozen after the
+        # calibration period if there is one so every window is normalized the same way
+        self.normalizer = OnlineNormalizer(len(self.eeg_channels), lookback=self.window_size_raw,
+                                           freeze_after=freeze_after)
+
+        # Optional filter bank, its (bands, channels, samples) output is buffered as bands * channels rows
+        self.filter_bank = None
+        self.band_buffer = None
+        if bands is not None:
+            self.filter_bank = FilterBank(len(self.eeg_channels), self.sampling_rate, bands)
+            self.band_buffer = RingBuffer(len(bands) * len(self.eeg_channels), self.window_size_samples * 2)
+
+        # Set to a shared_stream.StreamPublisher to publish the processed samples to other processes,
+        # and to a stream_server.StreamServer to stream them to other machines
+        self.publisher = None
+        self.server = None
 
     def stop(self):
         # Stop the data stream and release the session
@@ -73,79 +109,68 @@ class EEGProcessor:
         self.board.release_session()
         print("BrainFlow streaming stopped.")
 
+    def update(self):
+        """
+        Drains all new samples from the board and processes them into the processed buffer.
+
+        Returns the number of new samples.
+        """
+        data = self.board.get_board_data() 
+        if data.shape[1] > 0:
+            eeg_data = data[self.eeg_channels, :]
+
+            # Filter only the new samples, the filter state carries over from the last call
+            filtered_data = self.filter.process(eeg_data)
+            if self.filter_bank is not None:
+                bands = self.filter_bank.process(filtered_data)
+                self.band_buffer.append(bands.reshape(-1, bands.shape[2]))
+
+            # Z-score the new samples, the statistics are updated with the new samples only
+            new_processed_data = self.normalizer.process(filtered_data)
+
+            self.processed_data_buffer.append(new_processed_data)
+            if self.publisher is not None:
+                self.publisher.publish(new_processed_data)
+            if self.server is not None:
+                self.server.publish(new_processed_data, data[self.timestamp_channel, 0])
+
+        return data.shape[1]
+
     def get_recent_data(self):
         """
         Returns the most recent 1.5 seconds of processed EEG data.
 
         The data is bandpass filtered, notch filtered, and z-scored.
-        Each data point is filtered only once.
+        Each data point is filtered only once, as it is drained from the board.
+        The returned array can be a view into the processed buffer, copy it to keep it past the next call.
         """
-        data = self.board.get_board_data() 
-        if data.shape[1] == 0:
-            # No new data
-            pass
-        else:
-            # Append new raw data to the raw_data_buffer
-            eeg_data = data[self.eeg_channels, :]
-            self.raw_data_buffer = np.hstack((self.raw_data_buffer, eeg_data))
-
-            # Process new data
-            new_processed_data = np.empty(self.raw_data_buffer.shape)
-            # It is important to process each channel separately (why?)
-            #before = time.time()
-            for i in range(len(self.eeg_channels)):
-
-                # it is important to use the whole buffer for filtering (why?)
-                # Get the channel data
-                # copying from raw prevents double processing 
-                channel_data = self.raw_data_buffer[i, :].copy() 
-
-                # Bandpass filter
-                b, a = butter(2, [self.lowcut, self.highcut], btype='band', fs=self.sampling_rate)
-                channel_data = lfilter(b, a, channel_data)
-                
-                
-                # Notch filter
-                b, a = iirnotch(self.notch, 30, fs=self.sampling_rate)
-                channel_data = lfilter(b, a, channel_data)
-
-                # Z-score
-                mean = np.mean(channel_data)
-                std = np.std(channel_data)
-                if std == 0:
-                    std = 1  
-                channel_data = (channel_data - mean) / std
-                # add channel dimension to channel_data
-                new_processed_data[i, :] =  channel_data
-
-            #delta = time.time() - before
-            #print("Time to process:",delta*1000, "ms")
-            self.processed_data_buffer = np.hstack((self.processed_data_buffer, new_processed_data))
-
-            max_buffer_size = self.window_size_samples * 2
-            if self.raw_data_buffer.shape[1] > self.window_size_raw:
-                self.raw_data_buffer = self.raw_data_buffer[:, -self.window_size_raw:]
-            if self.processed_data_buffer.shape[1] > max_buffer_size:
-                self.processed_data_buffer = self.processed_data_buffer[:, -max_buffer_size:]
-
-        if self.processed_data_buffer.shape[1] >= self.window_size_samples:
-            recent_data = self.processed_data_buffer[:, -self.window_size_samples:]
-        else:
-            recent_data = self.processed_data_buffer
-
-        return recent_data
-
-def main():
+        self.update()
+        # A view into the buffer when possible, otherwise one contiguous copy
+        return self.processed_data_buffer.latest(self.window_size_samples)
+
+    def get_recent_bands(self):
+        """
+        Returns the most recent 1.5 seconds of every sub-band of the filtered EEG data,
+        as a (n_bands, n_channels, n_samples) array. Requires bands to be given to the constructor.
+        """
+        self.update()
+        window = self.band_buffer.latest(self.window_size_samples)
+        return window.reshape(len(self.filter_bank.bands), len(self.eeg_channels), window.shape[1])
+
+def main(stream_name=STREAM_NAME):
     eeg_processor = EEGProcessor()
-    time.sleep(2) # wait until we can fill the buffer (why?)
 
     try:
+        # Consumers (classifiers, visualizers) read the processed stream from shared memory at their own rate,
+        # see shared_stream.StreamSubscriber
+        eeg_processor.publisher = StreamPublisher(stream_name, len(eeg_processor.eeg_channels),
+                                                  eeg_processor.processed_data_buffer.capacity,
+                                                  eeg_processor.sampling_rate)
+        time.sleep(2) # wait until we can fill the buffer (why?)
+
         while True:
             start_time = time.time()
-            recent_data = eeg_processor.get_recent_data()
-            print("Recent data shape:", recent_data.shape)
-            # Do something with recent_data
-            print("Recent data shape:", recent_data.shape)
+            eeg_processor.update()
             # We want to process data 10 times a second (why?)
             elapsed_time = time.time() - start_time
             sleep_time = max(0, 0.1 - elapsed_time)
@@ -154,6 +179,8 @@ def main():
         print("Stopping...")
     finally:
         eeg_processor.stop()
+        if eeg_processor.publisher is not None:
+            eeg_processor.publisher.close()
 
 if __name__ == "__main__":
     main()
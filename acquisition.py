@@ -0,0 +1,132 @@
+import collections
+import threading
+import time
+import numpy as np
+from session_recorder import EVENT_CODES
+
+
+class AcquisitionWorker(threading.Thread):
+    """
+    Background thread that owns an EEGProcessor (and through it the BoardShim).
+
+    The worker drains the board and filters the new samples every poll_interval seconds, then
+    publishes a copy of the most recent processed window. The render loop only reads the last
+    published window through get_recent_data(), so it never waits on the board or the filters.
+    """
+    def __init__(self, eeg_processor, poll_interval=0.02):
+        super().__init__(name="AcquisitionWorker", daemon=True)
+        self.eeg_processor = eeg_processor
+        self.poll_interval = poll_interval
+
+        # Held while the processor's buffers are being modified
+        self.lock = threading.Lock()
+
+        # Single-slot handoff, appending and reading a deque are atomic so readers never block
+        self._latest = collections.deque(maxlen=1)
+        self.windows_published = 0
+        self.error = None
+        self._stop_event = threading.Event()
+
+    def run(self):
+        next_poll = time.perf_counter()
+        try:
+            while not self._stop_event.is_set():
+                with self.lock:
+                    new_samples = self.eeg_processor.update()
+                    if new_samples > 0:
+                        window = self.eeg_processor.processed_data_buffer.latest(
+                            self.eeg_processor.window_size_samples).copy()
+                if new_samples > 0:
+                    self._latest.append(window)
+                    self.windows_published += 1
+
+                # Keep a fixed cadence, but don't try to catch up after falling behind
+                next_poll += self.poll_interval
+                delay = next_poll - time.perf_counter()
+                if delay > 0:
+                    self._stop_event.wait(delay)
+                else:
+                    next_poll = time.perf_counter()
+        except Exception as e:
+            self.error = e
+            print(f"Acquisition stopped due to an error: {e}")
+
+    def get_recent_data(self):
+        """
+        Returns the most recently published window of processed EEG data.
+
+        The array is never modified after it is published. Returns an empty array until the
+        first window has been published.
+        """
+        try:
+            return self._latest[-1]
+        except IndexError:
+            return np.empty((len(self.eeg_processor.eeg_channels), 0))
+
+    def get_sample_index(self, t):
+        """
+        Returns the absolute index of the first sample recorded at or after time t.
+        """
+        with self.lock:
+            return self.eeg_processor.get_sample_index(t)
+
+    def get_epoch(self, onset_time, n_samples):
+        """
+        Returns (epoch, onset_sample) for the n_samples processed samples starting at onset_time,
+        or None if they haven't all been received yet.
+        """
+        with self.lock:
+            return self.eeg_processor.get_epoch(onset_time, n_samples)
+
+    def get_quality(self):
+        """
+        Returns the signal_quality flags of every channel over the last quality window.
+        """
+        return self.eeg_processor.quality.flags
+
+    def get_trial_quality(self, start_sample, end_sample):
+        """
+        Returns the signal_quality flags of every channel seen between two absolute sample indices.
+        """
+        with self.lock:
+            return self.eeg_processor.quality.trial_flags(start_sample, end_sample)
+
+    def start_recording(self, recorder):
+        """
+        Starts appending every drained chunk to recorder (a SessionRecorder).
+        """
+        with self.lock:
+            self.eeg_processor.recorder = recorder
+
+    def stop_recording(self):
+        """
+        Drains the board one last time into the current recorder, then detaches and closes it.
+        """
+        with self.lock:
+            recorder = self.eeg_processor.recorder
+            if recorder is None:
+                return
+            self.eeg_processor.update()
+            self.eeg_processor.recorder = None
+        recorder.close()
+
+    def mark(self, event, t=None):
+        """
+        Records a stimulus event: inserts its code into the board's marker channel and adds it to
+        the event table of the current recording, at time t (defaults to now).
+        """
+        with self.lock:
+            recorder = self.eeg_processor.recorder
+            if recorder is None:
+                return
+            self.eeg_processor.board.insert_marker(EVENT_CODES[event])
+            recorder.mark(event, t)
+
+    def stop(self):
+        """
+        Stops the worker thread, then stops the stream and releases the board session.
+        """
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
+        self.eeg_processor.stop()
@@ -0,0 +1,228 @@
+"""
+Filters the trials of many recorded sessions offline and writes them to one consolidated session store.
+
+Session directories ({first}_{last}_Session{n}, session stores or pickle trials) are found under the
+given roots and spread over a pool of worker processes. The stored epochs were already filtered online,
+so they are not filtered again: the raw recording of the session (raw_data.bin, see session_recorder) is
+filtered in one vectorized call across channels, with a bandpass and notch filter like EEGProcessor's
+(forward and backward with --zero-phase), and the epochs are re-cut from it at the onset time of every
+trial. Sessions without a raw recording (pickle sessions, stores recorded before it existed) are skipped,
+unless --refilter is given: their stored epochs are then filtered a second time, in one call across trials
+and channels, which squares the magnitude response and doubles the phase delay. Such sessions are listed
+as 'refiltered' in the sources of the output's session.json.
+
+The result is a session store (see session_store.SessionStore) whose trials.csv has a Session column,
+so it can be opened like any session.
+
+Usage: python batch_preprocess.py DATA_DIR [DATA_DIR ...] --out OUT_DIR [--workers N] [--zero-phase] [--refilter]
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from session_recorder import EVENTS_FILE, RAW_DATA_FILE, RAW_INFO_FILE, load_recording
+from session_store import (EPOCHS_FILE, LABELS, SESSION_INFO_FILE, TRIAL_COLUMNS, TRIALS_FILE, SessionStore,
+                           find_sessions, is_session_store, load_pickle_session)
+from streaming_filter import StreamingFilter
+
+
+def has_raw_recording(directory):
+    return all(os.path.exists(os.path.join(directory, name)) for name in (RAW_DATA_FILE, RAW_INFO_FILE, EVENTS_FILE))
+
+
+def load_session(directory, default_sampling_rate=None):
+    """
+    Loads every trial of a session at once.
+
+    Returns (epochs, trials, sampling_rate): a (n_trials, n_channels, n_samples) float64 array, a
+    DataFrame with the TRIAL_COLUMNS of each trial and the session's sampling rate (default_sampling_rate
+    if the session doesn't record it). Pickle trials whose length differs from the most common one are skipped.
+    """
+    if is_session_store(directory):
+        store = SessionStore(directory)
+        epochs = np.array(store.epochs, dtype=np.float64)
+        return epochs, store.trials.reset_index(drop=True), store.sampling_rate or default_sampling_rate
+
+    loaded = load_pickle_session(directory)
+    lengths = [sig.shape[1] for _, _, sig, _ in loaded]
+    n_samples = max(set(lengths), key=lengths.count)
+    loaded = [trial for trial in loaded if trial[2].shape[1] == n_samples]
+    epochs = np.stack([sig for _, _, sig, _ in loaded]).astype(np.float64, copy=False)
+    trials = pd.DataFrame([{'Trial': trial_num, 'Direction': direction, 'Label': LABELS[direction]}
+                           for trial_num, direction, _, _ in loaded], columns=TRIAL_COLUMNS)
+    return epochs, trials, default_sampling_rate
+
+
+def recut_session(directory, filter_params, zero_phase=False):
+    """
+    Filters the raw recording of a session store and cuts the epochs of its trials out of it.
+
+    The EEG channels of the whole recording are filtered at once, so the epochs have no edge transient,
+    and every epoch starts at the first sample recorded at or after the trial's OnsetTime and has the
+    length of the stored ones. Trials without an onset time or running past the end of the recording
+    are left out.
+
+    Returns (epochs, trials, sampling_rate, timings) like process_session.
+    """
+    start = time.perf_counter()
+    store = SessionStore(directory)
+    n_samples = store.info['n_samples']
+    data, info, _ = load_recording(directory)
+    eeg = np.array(data[info['eeg_channels']], dtype=np.float64)
+    timestamps = np.array(data[info['timestamp_channel']], dtype=np.float64)
+    onset_times = pd.to_numeric(store.trials['OnsetTime'], errors='coerce').to_numpy(dtype=np.float64)
+    loaded = time.perf_counter()
+
+    sos_filter = StreamingFilter(eeg.shape[0], info['sampling_rate'], **filter_params)
+    filtered = sos_filter.process_epochs(eeg[np.newaxis], zero_phase)[0]
+    onsets = np.searchsorted(timestamps, onset_times)
+    keep = ~np.isnan(onset_times) & (onsets + n_samples <= eeg.shape[1])
+    # (n_channels, n_trials, n_samples) by fancy indexing, then trials first
+    windows = onsets[keep][:, np.newaxis] + np.arange(n_samples)
+    epochs = filtered[:, windows].transpose(1, 0, 2).astype(np.float32)
+    trials = store.trials[keep].reset_index(drop=True)
+    end = time.perf_counter()
+    return epochs, trials, info['sampling_rate'], {'load': loaded - start, 'filter': end - loaded}
+
+
+def process_session(directory, filter_params, default_sampling_rate=None, zero_phase=False, refilter=False):
+    """
+    Loads and filters one session, in a worker process: re-cut from its raw recording if it has one,
+    otherwise its stored epochs filtered again if refilter is set.
+
+    Returns (directory, epochs, trials, sampling_rate, timings, source), epochs being float32 and source
+    'raw' or 'refiltered', or the error message in place of epochs if the session couldn't be processed.
+    """
+    start = time.perf_counter()
+    try:
+        if is_session_store(directory) and has_raw_recording(directory):
+            epochs, trials, sampling_rate, timings = recut_session(directory, filter_params, zero_phase)
+            return directory, epochs, trials, sampling_rate, timings, 'raw'
+        if not refilter:
+            raise ValueError("no raw recording, the stored epochs were already filtered online, "
+                             "give --refilter to filter them a second time")
+        epochs, trials, sampling_rate = load_session(directory, default_sampling_rate)
+        if sampling_rate is None:
+            raise ValueError("the session doesn't record its sampling rate, give --sampling-rate")
+        loaded = time.perf_counter()
+        sos_filter = StreamingFilter(epochs.shape[1], sampling_rate, **filter_params)
+        filtered = sos_filter.process_epochs(epochs, zero_phase).astype(np.float32)
+    except Exception as e:
+        return directory, repr(e), None, None, None, None
+    end = time.perf_counter()
+    return directory, filtered, trials, sampling_rate, {'load': loaded - start, 'filter': end - loaded}, 'refiltered'
+
+
+def batch_preprocess(sessions, out_dir, workers=None, filter_params=None, default_sampling_rate=None,
+                     zero_phase=False, refilter=False):
+    """
+    Filters the trials of sessions over workers processes and writes them to the session store out_dir.
+
+    Sessions without a raw recording are skipped unless refilter is set, see process_session.
+    Sessions whose shape or sampling rate differs from the first one are skipped.
+    Returns a summary with the number of trials and sessions processed and the throughput.
+    """
+    filter_params = filter_params or {}
+    os.makedirs(out_dir, exist_ok=True)
+    epochs_path = os.path.join(out_dir, EPOCHS_FILE)
+    if os.path.exists(epochs_path):
+        raise FileExistsError(f"{out_dir} already contains a session store")
+
+    start = time.perf_counter()
+    shape = None
+    sampling_rate = None
+    trial_tables = []
+    skipped = {}
+    sources = {}
+    load_time = filter_time = 0.0
+    with ProcessPoolExecutor(workers) as executor, open(epochs_path, 'wb') as epochs_file:
+        # Results come back in session order, so the output is the same for any number of workers
+        results = executor.map(process_session, sessions, [filter_params] * len(sessions),
+                               [default_sampling_rate] * len(sessions), [zero_phase] * len(sessions),
+                               [refilter] * len(sessions))
+        for directory, epochs, trials, rate, timings, source in results:
+            if trials is None:
+                skipped[directory] = epochs
+                continue
+            if len(trials) == 0:
+                # A session quit before its first trial
+                skipped[directory] = "no trials"
+                continue
+            if shape is None:
+                shape, sampling_rate = epochs.shape[1:], rate
+            if epochs.shape[1:] != shape or rate != sampling_rate:
+                skipped[directory] = f"epochs of shape {epochs.shape[1:]} at {rate} Hz instead of {shape} at " \
+                                     f"{sampling_rate} Hz"
+                continue
+            epochs.tofile(epochs_file)
+            sources[os.path.basename(os.path.normpath(directory))] = source
+            trials.insert(0, 'Session', os.path.basename(os.path.normpath(directory)))
+            trial_tables.append(trials)
+            load_time += timings['load']
+            filter_time += timings['filter']
+
+    trials = pd.concat(trial_tables, ignore_index=True) if trial_tables else \
+        pd.DataFrame(columns=['Session'] + TRIAL_COLUMNS)
+    trials.to_csv(os.path.join(out_dir, TRIALS_FILE), index=False)
+    info = {
+        'n_channels': int(shape[0]) if shape else 0,
+        'n_samples': int(shape[1]) if shape else 0,
+        'dtype': 'float32',
+        'sampling_rate': sampling_rate,
+        'labels': LABELS,
+        'filter': {**filter_params, 'zero_phase': zero_phase},
+        'sessions': [table['Session'].iloc[0] for table in trial_tables],
+        # 'raw': re-cut from the raw recording, 'refiltered': stored epochs filtered a second time
+        'sources': sources,
+    }
+    with open(os.path.join(out_dir, SESSION_INFO_FILE), 'w') as f:
+        json.dump(info, f, indent=2)
+
+    elapsed = time.perf_counter() - start
+    return {
+        'sessions': len(trial_tables),
+        'trials': len(trials),
+        'skipped': skipped,
+        'refiltered': sum(source == 'refiltered' for source in sources.values()),
+        'seconds': elapsed,
+        'trials_per_second': len(trials) / elapsed if elapsed > 0 else None,
+        'load_seconds': load_time,
+        'filter_seconds': filter_time,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('roots', nargs='+', help="Directories to search for session directories")
+    parser.add_argument('--out', required=True, help="Directory of the consolidated session store")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (one per CPU by default)")
+    parser.add_argument('--lowcut', type=float, default=1.0)
+    parser.add_argument('--highcut', type=float, default=50.0)
+    parser.add_argument('--notch', type=float, default=60.0)
+    parser.add_argument('--sampling-rate', type=float, default=None,
+                        help="Sampling rate of the sessions that don't record it (pickle sessions)")
+    parser.add_argument('--zero-phase', action='store_true', help="Filter forward and backward")
+    parser.add_argument('--refilter', action='store_true',
+                        help="Filter the stored epochs of sessions without a raw recording a second time "
+                             "instead of skipping them")
+    args = parser.parse_args()
+
+    sessions = find_sessions(args.roots)
+    print(f"Found {len(sessions)} sessions")
+    summary = batch_preprocess(sessions, args.out, args.workers,
+                               {'lowcut': args.lowcut, 'highcut': args.highcut, 'notch': args.notch},
+                               args.sampling_rate, args.zero_phase, args.refilter)
+    for directory, reason in summary['skipped'].items():
+        print(f"Skipped {directory}: {reason}")
+    print(f"{summary['trials']} trials from {summary['sessions']} sessions in {summary['seconds']:.2f} s: "
+          f"{summary['trials_per_second']:.0f} trials/s (loading {summary['load_seconds']:.2f} s, "
+          f"filtering {summary['filter_seconds']:.2f} s of worker time)")
+    if summary['refiltered']:
+        print(f"{summary['refiltered']} sessions had no raw recording, their stored epochs were filtered twice")
+
+
+if __name__ == '__main__':
+    main()
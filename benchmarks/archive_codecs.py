@@ -0,0 +1,121 @@
+"""
+Compares the size and compression time of the session archive codecs on synthetic-board data.
+
+The synthetic board is streamed for a few seconds, then the recording is archived the way a session is:
+the raw stream (all board rows, float64) and the filtered EEG (float64, or float32 when downcast) are
+appended to growing files that are synced into a SessionArchive once per simulated trial.
+
+Usage: python benchmarks/archive_codecs.py [--seconds 20] [--json results.json]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+from brainflow.board_shim import BoardShim, BrainFlowInputParams, BoardIds
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from session_archive import SessionArchive
+from streaming_filter import StreamingFilter
+
+CONFIGS = [
+    ('store', None),
+    ('deflate', 1),
+    ('deflate', 6),
+    ('deflate', 9),
+    ('bzip2', 9),
+    ('lzma', None),
+]
+
+
+def record_synthetic(seconds):
+    board_id = BoardIds.SYNTHETIC_BOARD.value
+    board = BoardShim(board_id, BrainFlowInputParams())
+    board.prepare_session()
+    board.start_stream()
+    time.sleep(seconds)
+    data = board.get_board_data()
+    board.stop_stream()
+    board.release_session()
+    sampling_rate = BoardShim.get_sampling_rate(board_id)
+    eeg_channels = BoardShim.get_eeg_channels(board_id)
+    eeg = StreamingFilter(len(eeg_channels), sampling_rate).process(data[eeg_channels, :])
+    return data, eeg, sampling_rate
+
+
+def archive_once(directory, datasets, codec, level, chunk_samples):
+    """
+    Archives every dataset incrementally and returns (seconds spent compressing, archive size in bytes).
+    """
+    paths = {name: os.path.join(directory, name + '.bin') for name in datasets}
+    for path in paths.values():
+        open(path, 'wb').close()
+    zip_path = os.path.join(directory, f'{codec}_{level}.zip')
+    archive = SessionArchive(zip_path, codec=codec, level=level)
+    for path in paths.values():
+        archive.track(path)
+
+    n_samples = next(iter(datasets.values())).shape[1]
+    elapsed = 0.0
+    for start in range(0, n_samples, chunk_samples):
+        for name, array in datasets.items():
+            with open(paths[name], 'ab') as f:
+                np.ascontiguousarray(array[:, start:start + chunk_samples].T).tofile(f)
+        before = time.perf_counter()
+        archive.sync()
+        elapsed += time.perf_counter() - before
+    before = time.perf_counter()
+    archive.close()
+    elapsed += time.perf_counter() - before
+    return elapsed, os.path.getsize(zip_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=20, help="Seconds of synthetic data to record")
+    parser.add_argument('--trial-seconds', type=float, default=13, help="Data between two syncs")
+    parser.add_argument('--json', default=None, help="Write the results to this file")
+    args = parser.parse_args()
+
+    BoardShim.disable_board_logger()
+    raw, eeg, sampling_rate = record_synthetic(args.seconds)
+    chunk_samples = int(args.trial_seconds * sampling_rate)
+    variants = {
+        'float64': {'raw': raw, 'eeg': eeg},
+        'float32 eeg': {'raw': raw, 'eeg': eeg.astype(np.float32)},
+    }
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for variant, datasets in variants.items():
+            input_bytes = sum(array.nbytes for array in datasets.values())
+            for codec, level in CONFIGS:
+                elapsed, size = archive_once(directory, datasets, codec, level, chunk_samples)
+                results.append({
+                    'variant': variant,
+                    'codec': codec,
+                    'level': level,
+                    'input_bytes': input_bytes,
+                    'archive_bytes': size,
+                    'ratio': input_bytes / size,
+                    'seconds': elapsed,
+                    'mb_per_second': input_bytes / 1e6 / elapsed,
+                })
+
+    print(f"{raw.shape[1]} samples ({raw.shape[1] / sampling_rate:.1f} s) of synthetic board data")
+    print(f"{'variant':<12} {'codec':<8} {'level':>5} {'input MB':>9} {'archive MB':>11} {'ratio':>6} "
+          f"{'time ms':>8} {'MB/s':>7}")
+    for r in results:
+        print(f"{r['variant']:<12} {r['codec']:<8} {str(r['level']):>5} {r['input_bytes'] / 1e6:>9.2f} "
+              f"{r['archive_bytes'] / 1e6:>11.2f} {r['ratio']:>6.2f} {r['seconds'] * 1e3:>8.1f} "
+              f"{r['mb_per_second']:>7.1f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'sampling_rate': sampling_rate, 'samples': raw.shape[1], 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+"""
+Benchmarks the acquisition and preprocessing hot path: get_recent_data, save_data, zip_directory and track_user.
+
+get_recent_data runs on a NumPy synthetic board (board_source.SyntheticSource) read as fast as possible,
+each call draining sampling_rate / call_rate new samples, so the sweep over channel count, sampling rate,
+window length and call rate needs no hardware and doesn't wait for the stream. Every case reports
+per-call latency percentiles (timed without tracing) and the memory allocated per call (traced with
+tracemalloc in a separate pass).
+
+Results are written as JSON along with the git commit, and --compare prints the p50 latency of every
+case against a previous results file.
+
+Usage: python benchmarks/bench_hot_path.py [--quick] [--json results.json] [--compare baseline.json]
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from board_source import SyntheticSource
+from data_collection_gui import EEGProcessor, save_data, zip_directory, track_user
+from session_store import create_session_store, append_trial
+from user_registry import TABLE_COLUMNS
+
+FULL_SWEEP = {
+    'channels': [8, 16, 32],
+    'sampling_rates': [125, 250, 500, 1000],
+    'window_seconds': [2, 7],
+    'call_rates': [10, 50],
+    'users': [100, 1000, 10000],
+}
+
+QUICK_SWEEP = {
+    'channels': [8, 32],
+    'sampling_rates': [125, 1000],
+    'window_seconds': [7],
+    'call_rates': [50],
+    'users': [100, 10000],
+}
+
+
+def summarize(times):
+    times = np.asarray(times) * 1e6
+    return {
+        'mean_us': float(times.mean()),
+        'p50_us': float(np.percentile(times, 50)),
+        'p90_us': float(np.percentile(times, 90)),
+        'p99_us': float(np.percentile(times, 99)),
+        'max_us': float(times.max()),
+    }
+
+
+def measure(fn, calls, alloc_calls):
+    """
+    Times calls calls of fn, then traces alloc_calls more. Returns the latency summary and allocations.
+    """
+    times = np.empty(calls)
+    for i in range(calls):
+        before = time.perf_counter()
+        fn()
+        times[i] = time.perf_counter() - before
+
+    peaks = []
+    retained = []
+    tracemalloc.start()
+    for _ in range(alloc_calls):
+        tracemalloc.reset_peak()
+        start = tracemalloc.get_traced_memory()[0]
+        fn()
+        current, peak = tracemalloc.get_traced_memory()
+        peaks.append(peak - start)
+        retained.append(current - start)
+    tracemalloc.stop()
+
+    return {
+        'calls': calls,
+        'latency': summarize(times),
+        'peak_alloc_bytes': float(np.mean(peaks)),
+        'retained_bytes': float(np.mean(retained)),
+    }
+
+
+def quiet():
+    # EEGProcessor prints when the stream starts
+    return contextlib.redirect_stdout(io.StringIO())
+
+
+def bench_get_recent_data(channels, sampling_rate, window_seconds, call_rate, calls):
+    source = SyntheticSource(channels, sampling_rate, speed=None, duration=10,
+                             chunk_size=max(1, sampling_rate // call_rate))
+    with quiet():
+        processor = EEGProcessor(source, window_size_sec=window_seconds)
+    # Fill the buffers so every call returns a full window
+    for _ in range(int(2 * window_seconds * call_rate)):
+        processor.get_recent_data()
+    return measure(processor.get_recent_data, calls, min(calls, 50))
+
+
+def bench_save_data(directory, channels, sampling_rate, calls):
+    n_samples = 7 * sampling_rate
+    session_dir = tempfile.mkdtemp(dir=directory)
+    metadata = pd.DataFrame([{c: 0 for c in TABLE_COLUMNS}])
+    create_session_store(session_dir, channels, n_samples, sampling_rate, metadata)
+    sig = np.random.default_rng(0).standard_normal((channels, n_samples))
+    trial_info = {'OnsetTime': time.time(), 'OnsetSample': 0, 'OffsetSample': n_samples}
+    counter = itertools.count()
+    return measure(lambda: save_data(sig, metadata, 'left', next(counter), session_dir, trial_info),
+                   calls, min(calls, 10))
+
+
+def bench_zip_directory(directory, channels, sampling_rate, trials, calls):
+    n_samples = 7 * sampling_rate
+    session_dir = tempfile.mkdtemp(dir=directory)
+    rng = np.random.default_rng(0)
+    for trial in range(trials):
+        append_trial(session_dir, rng.standard_normal((channels, n_samples)), ('left', 'right')[trial % 2], trial)
+    zip_path = session_dir + '.zip'
+    result = measure(lambda: zip_directory(session_dir, zip_path), calls, 1)
+    result['zip_bytes'] = os.path.getsize(zip_path)
+    return result
+
+
+def make_user_table(n_users):
+    table = pd.DataFrame({
+        'ID': np.arange(1, n_users + 1),
+        'First': [f'first{i}' for i in range(n_users)],
+        'Last': [f'last{i}' for i in range(n_users)],
+        'EID': [f'eid{i}' for i in range(n_users)],
+        'LastTime': '2024-01-01 00:00:00.000000',
+        'SessionNum': 1,
+    }, columns=TABLE_COLUMNS)
+    # Survey answers are strings, like in the CSV stored in Box
+    return table.astype({c: object for c in TABLE_COLUMNS[4:12]})
+
+
+def bench_track_user(n_users, calls):
+    table = make_user_table(n_users)
+    rng = np.random.default_rng(0)
+    users = rng.integers(0, n_users, calls + 10)
+    counter = itertools.count()
+
+    def call():
+        i = users[next(counter)]
+        track_user(table, f'first{i}', f'last{i}', f'eid{i}', '0 mg', 'Light meal', 'none', 'no', 'N/A')
+
+    return measure(call, calls, 10)
+
+
+def run(sweep, calls):
+    results = []
+
+    def add(benchmark, params, result):
+        results.append({'benchmark': benchmark, 'params': params, **result})
+        latency = result['latency']
+        print(f"{benchmark:<16} {json.dumps(params):<75} p50 {latency['p50_us']:>10.1f} us  "
+              f"p99 {latency['p99_us']:>10.1f} us  peak alloc {result['peak_alloc_bytes'] / 1024:>9.1f} KiB")
+
+    for channels, rate, window, call_rate in itertools.product(sweep['channels'], sweep['sampling_rates'],
+                                                             sweep['window_seconds'], sweep['call_rates']):
+        params = {'channels': channels, 'sampling_rate': rate, 'window_seconds': window, 'call_rate': call_rate}
+        add('get_recent_data', params, bench_get_recent_data(channels, rate, window, call_rate, calls))
+
+    with tempfile.TemporaryDirectory() as directory:
+        for channels, rate in itertools.product(sweep['channels'], sweep['sampling_rates']):
+            params = {'channels': channels, 'sampling_rate': rate}
+            add('save_data', params, bench_save_data(directory, channels, rate, max(calls // 10, 10)))
+        for channels, rate in itertools.product(sweep['channels'], sweep['sampling_rates']):
+            params = {'channels': channels, 'sampling_rate': rate, 'trials': 20}
+            add('zip_directory', params, bench_zip_directory(directory, channels, rate, 20, 3))
+
+    for n_users in sweep['users']:
+        add('track_user', {'users': n_users}, bench_track_user(n_users, calls))
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    previous = {(r['benchmark'], json.dumps(r['params'], sort_keys=True)): r for r in baseline['results']}
+    print(f"\nCompared to {baseline_path} (commit {baseline.get('commit')}), p50 latency ratio (new / old):")
+    for r in results:
+        old = previous.get((r['benchmark'], json.dumps(r['params'], sort_keys=True)))
+        if old is None:
+            continue
+        ratio = r['latency']['p50_us'] / old['latency']['p50_us']
+        flag = '  <-- slower' if ratio > 1.2 else ''
+        print(f"{r['benchmark']:<16} {json.dumps(r['params']):<75} {ratio:>6.2f}x{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--quick', action='store_true', help="Run a reduced sweep")
+    parser.add_argument('--calls', type=int, default=200, help="Calls timed per case")
+    parser.add_argument('--json', default=None, help="Write the results to this file")
+    parser.add_argument('--compare', default=None, help="Compare with a results file from a previous run")
+    args = parser.parse_args()
+
+    sweep = QUICK_SWEEP if args.quick else FULL_SWEEP
+    results = run(sweep, args.calls)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'commit': git_commit(),
+                'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'platform': platform.platform(),
+                'sweep': sweep,
+                'results': results,
+            }, f, indent=2)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Compares the per-chunk latency of FilterBank with filtering the sub-bands one at a time.
+
+'naive' keeps one stateful sosfilt per band, like running a StreamingFilter per band, and stacks the
+outputs. 'stacked' is FilterBank.process, which filters every band and channel in one pass over
+batched matrices. Both produce the same (n_bands, n_channels, n_samples) output.
+
+Usage: python benchmarks/filter_bank.py [--channels 16] [--sampling-rate 250] [--chunks 1 5 25 125] [--json results.json]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+from scipy.signal import sosfilt, sosfilt_zi
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from filter_bank import FilterBank
+
+
+class PerBandFilters:
+    """
+    One stateful sosfilt per band, the straightforward way to stream a filter bank.
+    """
+    def __init__(self, filter_bank):
+        self.sos = filter_bank.sos
+        self.zi = None
+
+    def process(self, chunk):
+        if self.zi is None:
+            self.zi = [sosfilt_zi(sos)[:, np.newaxis, :] * chunk[:, 0][np.newaxis, :, np.newaxis] for sos in self.sos]
+        outputs = []
+        for i, sos in enumerate(self.sos):
+            filtered, self.zi[i] = sosfilt(sos, chunk, axis=1, zi=self.zi[i])
+            outputs.append(filtered)
+        return np.stack(outputs)
+
+
+def run(filters, chunks, updates):
+    times = np.empty(updates)
+    for i in range(updates):
+        chunk = chunks[i % len(chunks)]
+        before = time.perf_counter()
+        filters.process(chunk)
+        times[i] = time.perf_counter() - before
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--channels', type=int, default=16)
+    parser.add_argument('--sampling-rate', type=int, default=250)
+    parser.add_argument('--updates', type=int, default=3000)
+    parser.add_argument('--chunks', type=int, nargs='+', default=[1, 5, 25, 125])
+    parser.add_argument('--json', default=None)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    results = []
+    for chunk_size in args.chunks:
+        chunks = [rng.standard_normal((args.channels, chunk_size)) * 10 for _ in range(16)]
+        for mode in ('naive', 'stacked'):
+            filter_bank = FilterBank(args.channels, args.sampling_rate)
+            filters = PerBandFilters(filter_bank) if mode == 'naive' else filter_bank
+            run(filters, chunks, 100)  # Warm up, and build the block matrices of this chunk size
+            times = run(filters, chunks, args.updates) * 1e6
+            results.append({'mode': mode, 'chunk_size': chunk_size, 'bands': len(filter_bank.bands),
+                            'mean_us': times.mean(), **{f'p{q}_us': np.percentile(times, q) for q in (50, 99)}})
+
+    print(f"{'samples':>7} {'mode':<8} {'mean us':>8} {'p50 us':>7} {'p99 us':>7}")
+    for r in results:
+        print(f"{r['chunk_size']:>7} {r['mode']:<8} {r['mean_us']:>8.1f} {r['p50_us']:>7.1f} {r['p99_us']:>7.1f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'channels': args.channels, 'sampling_rate': args.sampling_rate, 'results': results}, f,
+                      indent=2)
+
+
+if __name__ == '__main__':
+    main()
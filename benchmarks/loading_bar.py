@@ -0,0 +1,78 @@
+"""
+Compares the frame time of the loading-bar phase redrawn in full versus with dirty rectangles.
+
+'full' blits the static trial layer and the bar and flips the whole screen every frame, like the GUI did
+before, 'dirty' draws the bar and updates only its rectangle. Runs headless with the SDL dummy video
+driver, uncapped so the numbers are the cost of a frame rather than the frame cap.
+
+Usage: python benchmarks/loading_bar.py [--frames 600] [--size 1920x1080] [--json results.json]
+"""
+import argparse
+import json
+import os
+import time
+import numpy as np
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+import pygame
+
+WHITE = (255, 255, 255)
+GREEN = (0, 255, 0)
+
+
+def run(screen, layer, frames, dirty):
+    width, height = screen.get_size()
+    max_length = width // 2 - 120
+    times = np.empty(frames)
+    screen.blit(layer, (0, 0))
+    pygame.display.flip()
+    for i in range(frames):
+        before = time.perf_counter()
+        bar_rect = pygame.Rect(width // 2, height // 2 - 15, int((i + 1) / frames * max_length), 30)
+        if dirty:
+            pygame.draw.rect(screen, WHITE, bar_rect)
+            pygame.display.update(bar_rect)
+        else:
+            screen.blit(layer, (0, 0))
+            pygame.draw.rect(screen, WHITE, bar_rect)
+            pygame.display.flip()
+        pygame.event.pump()
+        times[i] = time.perf_counter() - before
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--frames', type=int, default=600, help="Frames per mode (7 s at 60 fps is 420)")
+    parser.add_argument('--size', default='1920x1080', help="Display resolution, WIDTHxHEIGHT")
+    parser.add_argument('--json', default=None, help="Write the results to this file")
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.size.split('x'))
+    pygame.init()
+    screen = pygame.display.set_mode((width, height))
+    layer = pygame.Surface((width, height)).convert()
+    pygame.draw.rect(layer, GREEN, (100, height // 2 - 100, 20, 200))
+    pygame.draw.rect(layer, GREEN, (width - 120, height // 2 - 100, 20, 200))
+    pygame.draw.polygon(layer, WHITE, [(width // 2 + 100, height // 2 - 100), (width // 2, height // 2 - 120),
+                                       (width // 2, height // 2 - 80)])
+
+    results = []
+    for mode in ('full', 'dirty'):
+        times = run(screen, layer, args.frames, mode == 'dirty') * 1e3
+        results.append({'mode': mode, 'frames': args.frames, 'mean_ms': times.mean(),
+                        **{f'p{q}_ms': np.percentile(times, q) for q in (50, 95, 99)}, 'max_ms': times.max()})
+    pygame.quit()
+
+    print(f"{'mode':<6} {'mean ms':>8} {'p50 ms':>7} {'p95 ms':>7} {'p99 ms':>7} {'max ms':>7}")
+    for r in results:
+        print(f"{r['mode']:<6} {r['mean_ms']:>8.3f} {r['p50_ms']:>7.3f} {r['p95_ms']:>7.3f} "
+              f"{r['p99_ms']:>7.3f} {r['max_ms']:>7.3f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'size': [width, height], 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
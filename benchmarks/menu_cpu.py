@@ -0,0 +1,159 @@
+"""
+Measures the CPU used by the GUI's idle screens, redrawn every loop iteration versus paced by IdleScreen.
+
+Each screen is drawn the way data_collection_gui.py draws it, at the display resolution given, with the
+SDL dummy video driver so it runs headless. 'spin' is the loop without a frame cap (draw, flip, poll
+events as fast as possible), 'idle' blocks on pygame.event.wait and only redraws when the shown state
+changes. CPU is process time over wall time, so 100% is one core kept busy.
+
+Usage: python benchmarks/menu_cpu.py [--seconds 3] [--size 1920x1080] [--json results.json]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+import pygame
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from checkbox import Checkbox
+from idle_screen import IdleScreen
+from render_cache import TextCache
+
+WHITE = (255, 255, 255)
+BLACK = (0, 0, 0)
+GREEN = (0, 255, 0)
+RED = (255, 0, 0)
+
+
+def make_screens(screen, width, height):
+    """
+    Returns {name: (state function, draw function)} for the idle screens of the GUI.
+    """
+    large_font = pygame.font.SysFont(None, 100)
+    medium_font = pygame.font.SysFont(None, 50)
+    small_font = pygame.font.SysFont(None, 30)
+    text_cache = TextCache()
+    start = time.time()
+
+    def blit_center(surface, center):
+        screen.blit(surface, surface.get_rect(center=center))
+
+    def menu_state():
+        # The menu shows a countdown until the next session can start
+        return ('menu', round(start + 180 - time.time()))
+
+    def draw_menu():
+        screen.fill(BLACK)
+        blit_center(text_cache.render(large_font, "EEG Motor Imagery", True, WHITE), (width // 2, height // 4))
+        blit_center(text_cache.render(medium_font, "Press S to Start", True, GREEN), (width // 2, height // 2 - 50))
+        blit_center(text_cache.render(medium_font, "Press N to Set Number", True, WHITE), (width // 2, height // 2 + 50))
+        blit_center(text_cache.render(medium_font, "Press Q to Quit", True, RED), (width // 2, height // 2 + 150))
+        blit_center(text_cache.render(small_font, "Total Trials: 100", True, WHITE), (width // 2, height // 2 - 150))
+        blit_center(text_cache.render(small_font, f"You have to wait {menu_state()[1]} seconds before starting!",
+                                      True, WHITE), (width // 2, height // 2 + 250))
+
+    height_delta = height // 11
+    width_delta = width // 11
+    boxes = [Checkbox(screen, width_delta * (2 * i + 1), height_delta * row, i, caption=f'Option {i}',
+                      font_color=WHITE) for row in (2, 4) for i in range(5)]
+    questions = [
+        "How much stimulant (e.g. caffiene) have you consumed in the past 12 hours?",
+        "Have you consumed a light, medium, or heavy meal in the past 12 hours?",
+        "Describe what you ate in detail to the best of your ability, include portion size if possible",
+        "Have you exercised in the past 12 hours?",
+        "If you have exercised, please describe what you did and how long it was. N/A if no exercise",
+    ]
+
+    def questionnaire_state():
+        return ('questionnaire',)
+
+    def draw_questionnaire():
+        screen.fill(BLACK)
+        for i, question in enumerate(questions):
+            blit_center(text_cache.render(small_font, question, True, WHITE), (width // 2, height_delta * (2 * i + 1)))
+        for box in boxes:
+            box.render_checkbox()
+
+    def after_session_state():
+        # The after-session menu shows the upload progress
+        return ('after_session', int(time.time() - start))
+
+    def draw_after_session():
+        screen.fill(BLACK)
+        blit_center(text_cache.render(large_font, "Do you want to continue?", True, WHITE), (width // 2, height // 4))
+        blit_center(text_cache.render(medium_font, "Press Y to continue", True, GREEN), (width // 2, height // 2 - 50))
+        blit_center(text_cache.render(medium_font, "Press N to exit", True, RED), (width // 2, height // 2 + 50))
+        blit_center(text_cache.render(small_font, f"Uploaded {after_session_state()[1] % 3}/2 files", True, WHITE),
+                    (width // 2, height // 2 + 200))
+
+    return {
+        'menu': (menu_state, draw_menu),
+        'questionnaire': (questionnaire_state, draw_questionnaire),
+        'after_session': (after_session_state, draw_after_session),
+    }
+
+
+def run_spin(draw, seconds):
+    frames = 0
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        draw()
+        pygame.display.flip()
+        pygame.event.get()
+        frames += 1
+    return frames
+
+
+def run_idle(state, draw, seconds):
+    idle = IdleScreen()
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        if idle.changed(state()):
+            draw()
+            pygame.display.flip()
+        idle.events()
+    return idle.frames
+
+
+def measure(run, seconds):
+    wall, cpu = time.perf_counter(), time.process_time()
+    frames = run()
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    return {'frames_per_second': frames / wall, 'cpu_percent': 100 * cpu / wall}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=3, help="Seconds to run each screen in each mode")
+    parser.add_argument('--size', default='1920x1080', help="Display resolution, WIDTHxHEIGHT")
+    parser.add_argument('--json', default=None, help="Write the results to this file")
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.size.split('x'))
+    pygame.init()
+    screen = pygame.display.set_mode((width, height))
+
+    results = []
+    for name, (state, draw) in make_screens(screen, width, height).items():
+        for mode in ('spin', 'idle'):
+            if mode == 'spin':
+                result = measure(lambda: run_spin(draw, args.seconds), args.seconds)
+            else:
+                result = measure(lambda: run_idle(state, draw, args.seconds), args.seconds)
+            results.append({'screen': name, 'mode': mode, **result})
+    pygame.quit()
+
+    print(f"{'screen':<14} {'mode':<5} {'frames/s':>9} {'CPU %':>6}")
+    for r in results:
+        print(f"{r['screen']:<14} {r['mode']:<5} {r['frames_per_second']:>9.1f} {r['cpu_percent']:>6.1f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'size': [width, height], 'seconds': args.seconds, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+Measures the cost of one SignalQualityMonitor update for the chunk sizes the acquisition worker drains.
+
+At 250 Hz the worker drains about 5 samples every 20 ms poll, larger chunks happen when it falls behind
+or when a recording is replayed faster than real time. Every chunk crossing a block boundary also
+recomputes the window statistics and flags.
+
+Usage: python benchmarks/signal_quality.py [--channels 16] [--sampling-rate 250] [--updates 5000] [--json results.json]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from signal_quality import SignalQualityMonitor
+
+
+def run(n_channels, sampling_rate, chunk_size, updates):
+    rng = np.random.default_rng(0)
+    chunks = [rng.standard_normal((n_channels, chunk_size)) * 10 for _ in range(16)]
+    monitor = SignalQualityMonitor(n_channels, sampling_rate)
+    times = np.empty(updates)
+    for i in range(updates):
+        chunk = chunks[i % len(chunks)]
+        before = time.perf_counter()
+        monitor.update(chunk)
+        times[i] = time.perf_counter() - before
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--channels', type=int, default=16)
+    parser.add_argument('--sampling-rate', type=int, default=250)
+    parser.add_argument('--updates', type=int, default=5000)
+    parser.add_argument('--chunks', type=int, nargs='+', default=[1, 5, 25, 125])
+    parser.add_argument('--json', default=None)
+    args = parser.parse_args()
+
+    results = []
+    for chunk_size in args.chunks:
+        times = run(args.channels, args.sampling_rate, chunk_size, args.updates) * 1e6
+        results.append({'chunk_size': chunk_size, 'updates': args.updates, 'mean_us': times.mean(),
+                        **{f'p{q}_us': np.percentile(times, q) for q in (50, 99)}, 'max_us': times.max()})
+
+    print(f"{'samples':>7} {'mean us':>8} {'p50 us':>7} {'p99 us':>7} {'max us':>8}")
+    for r in results:
+        print(f"{r['chunk_size']:>7} {r['mean_us']:>8.1f} {r['p50_us']:>7.1f} {r['p99_us']:>7.1f} {r['max_us']:>8.1f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'channels': args.channels, 'sampling_rate': args.sampling_rate, 'results': results}, f,
+                      indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+import time
+import numpy as np
+from brainflow.board_shim import BoardShim, BrainFlowInputParams, BoardIds
+from brainflow.data_filter import DataFilter
+from session_recorder import load_recording
+
+
+class BrainFlowSource:
+    """
+    Board source backed by a BrainFlow board (synthetic board by default, Cyton Daisy on a serial port...).
+
+    A board source is what EEGProcessor reads from. It has the board's layout (board_id, sampling_rate,
+    n_rows, eeg_channels, timestamp_channel, marker_channel) and the BoardShim methods used by the
+    pipeline: prepare_session, start_stream, get_board_data, insert_marker, stop_stream, release_session.
+    """
+    def __init__(self, board_id=BoardIds.SYNTHETIC_BOARD.value, serial_port=None, params=None, master_board_id=None,
+                 config=()):
+        if params is None:
+            params = BrainFlowInputParams()
+        if serial_port is not None:
+            params.serial_port = serial_port
+        self.board = BoardShim(board_id, params)
+        self.config = list(config)  # config_board commands sent once the session is prepared
+        # Playback and streaming boards describe their layout with the board that recorded the data
+        self.board_id = board_id if master_board_id is None else master_board_id
+        self.sampling_rate = BoardShim.get_sampling_rate(self.board_id)
+        self.n_rows = BoardShim.get_num_rows(self.board_id)
+        self.eeg_channels = BoardShim.get_eeg_channels(self.board_id)
+        self.timestamp_channel = BoardShim.get_timestamp_channel(self.board_id)
+        self.marker_channel = BoardShim.get_marker_channel(self.board_id)
+
+    @classmethod
+    def from_file(cls, path, master_board_id, speed=1.0, loop=False):
+        """
+        Replays a file written with DataFilter.write_file (see export_playback_file) through BrainFlow's
+        playback file board, at speed times real time.
+        """
+        params = BrainFlowInputParams()
+        params.file = path
+        params.master_board = master_board_id
+        return cls(BoardIds.PLAYBACK_FILE_BOARD.value, params=params, master_board_id=master_board_id,
+                   config=[f'set_speed_multiplier:{float(speed)}', 'loopback_true' if loop else 'loopback_false'])
+
+    def prepare_session(self):
+        self.board.prepare_session()
+        for config in self.config:
+            self.board.config_board(config)
+
+    def start_stream(self):
+        self.board.start_stream()
+
+    def get_board_data(self):
+        return self.board.get_board_data()
+
+    def insert_marker(self, value):
+        self.board.insert_marker(value)
+
+    def stop_stream(self):
+        self.board.stop_stream()
+
+    def release_session(self):
+        self.board.release_session()
+
+
+class ArraySource:
+    """
+    Board source that streams a (n_rows, n_samples) array without BrainFlow, in the board's layout.
+
+    With speed=1 the samples are released at the sampling rate, with speed=N at N times the sampling
+    rate, and with speed=None as fast as they are read, chunk_size samples per get_board_data() call.
+    The timestamp row is rewritten so the first sample is stamped with the time the stream started and
+    the others follow at the replay speed, like a live board. Markers inserted with insert_marker are
+    written on the next samples released, one marker per sample like BrainFlow's marker queue, so
+    markers inserted between two reads are all kept.
+
+    finished is True once every sample was released, unless loop is set.
+    """
+    def __init__(self, data, board_id, sampling_rate, eeg_channels, timestamp_channel, marker_channel,
+                 speed=1.0, loop=False, chunk_size=None):
+        self.data = data
+        self.board_id = board_id
+        self.sampling_rate = sampling_rate
+        self.n_rows = data.shape[0]
+        self.eeg_channels = list(eeg_channels)
+        self.timestamp_channel = timestamp_channel
+        self.marker_channel = marker_channel
+        self.speed = speed
+        self.loop = loop
+        self.chunk_size = chunk_size or max(1, sampling_rate // 10)
+
+        self.position = 0  # samples released so far, across loops
+        self.finished = False
+        self._start = None
+        self._wall_start = None
+        self._pending_markers = []
+
+    def prepare_session(self):
+        pass
+
+    def start_stream(self):
+        self._start = time.perf_counter()
+        self._wall_start = time.time()
+
+    def stop_stream(self):
+        self._start = None
+
+    def release_session(self):
+        pass
+
+    def insert_marker(self, value):
+        self._pending_markers.append(value)
+
+    def _due(self):
+        """
+        Number of samples the stream should have released by now.
+        """
+        if self.speed is None:
+            return self.position + self.chunk_size
+        return int((time.perf_counter() - self._start) * self.sampling_rate * self.speed)
+
+    def get_board_data(self):
+        if self._start is None:
+            raise RuntimeError("The stream is not started")
+        n_total = self.data.shape[1]
+        n = self._due() - self.position
+        if not self.loop:
+            n = min(n, n_total - self.position)
+        if n <= 0:
+            self.finished = not self.loop and self.position >= n_total
+            return np.empty((self.n_rows, 0))
+
+        start = self.position % n_total
+        if start + n <= n_total:
+            chunk = np.array(self.data[:, start:start + n], dtype=np.float64)
+        else:
+            # Wrap around the end of the data when looping
+            chunk = np.array(self.data[:, np.arange(start, start + n) % n_total], dtype=np.float64)
+        if self.timestamp_channel is not None:
+            step = 1.0 / (self.sampling_rate * (self.speed or 1.0))
+            chunk[self.timestamp_channel] = self._wall_start + np.arange(self.position, self.position + n) * step
+        if self.marker_channel is not None and self._pending_markers:
+            # Markers that don't fit in this chunk go on the next one
+            markers = self._pending_markers[:n]
+            chunk[self.marker_channel, :len(markers)] = markers
+            del self._pending_markers[:len(markers)]
+        self.position += n
+        self.finished = not self.loop and self.position >= n_total
+        return chunk
+
+
+class PlaybackSource(ArraySource):
+    """
+    Replays the raw recording of a session (raw_data.bin, see session_recorder) as a live board.
+
+    The recording is memory-mapped, so long sessions are replayed without being loaded in memory.
+    """
+    def __init__(self, directory, speed=1.0, loop=False, chunk_size=None):
+        data, info, self.events = load_recording(directory)
+        super().__init__(data, info['board_id'], info['sampling_rate'], info['eeg_channels'],
+                         info['timestamp_channel'], info['marker_channel'], speed, loop, chunk_size)
+
+
+class SyntheticSource(ArraySource):
+    """
+    Pure NumPy synthetic board with any number of channels and sampling rate.
+
+    Every EEG channel is pink-ish noise with a 10 Hz alpha rhythm and 60 Hz line noise, in microvolts.
+    The rows are laid out like a BrainFlow board: package number, EEG channels, timestamp, marker.
+    duration seconds of signal are generated up front and looped.
+    """
+    def __init__(self, n_channels=16, sampling_rate=250, speed=1.0, duration=60, seed=0, chunk_size=None):
+        rng = np.random.default_rng(seed)
+        n_samples = int(duration * sampling_rate)
+        t = np.arange(n_samples) / sampling_rate
+
+        # 1/f noise by shaping white noise in the frequency domain
+        spectrum = np.fft.rfft(rng.standard_normal((n_channels, n_samples)), axis=1)
+        freqs = np.fft.rfftfreq(n_samples, 1 / sampling_rate)
+        spectrum[:, 1:] /= np.sqrt(freqs[1:])
+        spectrum[:, 0] = 0
+        eeg = np.fft.irfft(spectrum, n_samples, axis=1)
+        eeg *= 10 / eeg.std(axis=1, keepdims=True)
+        phases = rng.uniform(0, 2 * np.pi, (n_channels, 1))
+        eeg += 5 * np.sin(2 * np.pi * 10 * t + phases) + 2 * np.sin(2 * np.pi * 60 * t)
+
+        data = np.zeros((n_channels + 3, n_samples))
+        data[0] = np.arange(n_samples) % 256
+        data[1:n_channels + 1] = eeg
+        super().__init__(data, BoardIds.SYNTHETIC_BOARD.value, sampling_rate, range(1, n_channels + 1),
+                         n_channels + 1, n_channels + 2, speed, loop=True, chunk_size=chunk_size)
+
+
+def export_playback_file(directory, path):
+    """
+    Writes the raw recording of a session in the file format of BrainFlow's playback file board.
+
+    Returns the board ID to give as master_board_id to BrainFlowSource.from_file.
+    """
+    data, info, _ = load_recording(directory)
+    DataFilter.write_file(np.ascontiguousarray(data), path, 'w')
+    return info['board_id']
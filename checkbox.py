@@ -2,6 +2,9 @@ import pygame
 pygame.font.init()
 
 class Checkbox:
+    # Fonts shared by every checkbox, keyed by (name, size)
+    _fonts = {}
+
     def __init__(self, surface, x, y, idnum, color=(230, 230, 230),
         caption="", outline_color=(0, 0, 0), check_color=(0, 0, 0),
         font_size=22, font_color=(0, 0, 0), 
@@ -28,14 +31,29 @@ class Checkbox:
         # variables to test the different states of the checkbox
         self.checked = False
 
+        # caption surface, rendered on first draw
+        self._caption_key = None
+
     def _draw_button_text(self):
-        self.font = pygame.font.SysFont(self.ft, self.fs)
-        self.font_surf = self.font.render(self.caption, True, self.fc)
-        w, h = self.font.size(self.caption)
-        self.font_pos = (self.x + self.to[0], self.y + 12 / 2 - h / 2 + 
-        self.to[1])
+        # The caption is only rendered again when it, its font or its position changes
+        caption_key = (self.ft, self.fs, self.caption, self.fc, self.x, self.y, self.to)
+        if self._caption_key != caption_key:
+            self.font = Checkbox._get_font(self.ft, self.fs)
+            self.font_surf = self.font.render(self.caption, True, self.fc)
+            w, h = self.font.size(self.caption)
+            self.font_pos = (self.x + self.to[0], self.y + 12 / 2 - h / 2 + 
+            self.to[1])
+            self._caption_key = caption_key
         self.surface.blit(self.font_surf, self.font_pos)
 
+    @staticmethod
+    def _get_font(name, size):
+        # SysFont searches the system fonts, so each (name, size) is only loaded once for all checkboxes
+        key = (name, size)
+        if key not in Checkbox._fonts:
+            Checkbox._fonts[key] = pygame.font.SysFont(name, size)
+        return Checkbox._fonts[key]
+
     def render_checkbox(self):
         if self.checked:
             pygame.draw.rect(self.surface, self.color, self.checkbox_obj)
@@ -48,7 +66,8 @@ class Checkbox:
         self._draw_button_text()
 
     def _update(self, event_object):
-        x, y = pygame.mouse.get_pos()
+        # Position of the click itself, so clicks posted to the event queue work too
+        x, y = event_object.pos
         px, py, w, h = self.checkbox_obj
         if px < x < px + w and py < y < py + w:
             if self.checked:
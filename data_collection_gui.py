@@ -1,11 +1,25 @@
+import argparse
 import pygame
 import sys
 import time
-import pickle
 import numpy as np
-from scipy.signal import butter, lfilter, iirnotch
-from brainflow.board_shim import BoardShim, BrainFlowInputParams, BoardIds
+from brainflow.board_shim import BoardShim, BoardIds
 from checkbox import Checkbox
+from streaming_filter import StreamingFilter
+from ring_buffer import RingBuffer
+from acquisition import AcquisitionWorker
+from epoching import EpochSaver
+from session_recorder import SessionRecorder, RAW_DATA_FILE, RAW_INFO_FILE, EVENTS_FILE
+from session_store import append_trial, create_session_store, EPOCHS_FILE, SESSION_INFO_FILE, TRIALS_FILE, METADATA_FILE
+from session_archive import SessionArchive
+from upload_queue import UploadQueue
+from user_registry import UserRegistry
+from render_cache import TextCache, LayerCache
+from idle_screen import IdleScreen
+from stimulus_scheduler import StimulusScheduler, SCHEDULE_FILE
+from board_source import BrainFlowSource, PlaybackSource
+from telemetry import metrics, TIMING_FILE
+from signal_quality import SignalQualityMonitor, epoch_flags, BAD_FLAGS
 import platform
 import serial
 import serial.tools.list_ports
@@ -14,8 +28,19 @@ from datetime import timedelta
 import pandas as pd
 from boxsdk import Client, OAuth2
 import zipfile
+import json
 import os
 
+# Directory where session directories, archives and the local copy of the user table are written
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Box IDs of the user table and of the folder session archives are uploaded to
+TABLE_FILE_ID = '1679766376012'
+SESSION_FOLDER_ID = '289622073398'
+
+# Small files of a session directory added whole to its archive, next to the tracked epochs and raw recording
+SESSION_FILES = (SESSION_INFO_FILE, TRIALS_FILE, METADATA_FILE, RAW_INFO_FILE, EVENTS_FILE, SCHEDULE_FILE, TIMING_FILE)
+
 
 def authenticate():
     """
@@ -48,6 +73,33 @@ def download_file(client, file_id, download_dir):
     print(f'{file.name} has been downloaded to {download_path}')
     return download_path
 
+def sync_user_table(client, file_id, download_dir, user_registry, upload_queue):
+    """
+    Brings the user registry up to date with the user table in Box.
+    The table is only downloaded and imported when Box holds another version than the one the registry
+    last imported or exported, otherwise the registry saved locally is used as it is. If an update of the
+    table from the last launch is still queued, the registry is newer than Box: the table isn't downloaded
+    and the queued update is exported from the registry when it is sent.
+    Call it before starting upload_queue.
+
+    Returns the path of the local copy of the table as a string
+    """
+    file = client.file(file_id).get()
+    table_path = os.path.join(download_dir, file.name)
+    pending = upload_queue.pending_updates(file_id)
+    if pending:
+        for path in pending:
+            user_registry.export_csv(path)
+            upload_queue.update(file_id, path, export=user_registry.export_csv)
+        print(f'{file.name} has changes that are not uploaded yet, keeping the user registry')
+        return table_path
+    if getattr(file, 'sha1', None) is not None and file.sha1 == user_registry.synced_sha1:
+        print(f'{file.name} is up to date in the user registry')
+        return table_path
+    download_file(client, file_id, download_dir)
+    user_registry.import_csv(table_path, replace=True)
+    return table_path
+
 def upload_file(client, folder_id, local_file_path):
     """
     Uploads a file specified by local_file_path to the Box folder specified by folder_id.  
@@ -89,20 +141,40 @@ def update_file(client, file_id, new_file_path):
         print(f"An error occurred: {e}")
         return None
 
+def save_upload_timing(upload_queue, pending, final=False):
+    """
+    Adds the uploads of each session in pending, a list of (upload job keys, timing report path), to the
+    session's timing report once they have finished, or as they stand if final.
+    The report is written before the session is archived, so its uploads can only be added afterwards.
+
+    Returns the sessions whose uploads are still running.
+    """
+    still_pending = []
+    for keys, timing_path in pending:
+        uploads = upload_queue.report(keys)
+        if not final and any(upload['status'] in ('pending', 'active') for upload in uploads):
+            still_pending.append((keys, timing_path))
+            continue
+        with open(timing_path) as f:
+            report = json.load(f)
+        report['uploads'] = uploads
+        with open(timing_path, 'w') as f:
+            json.dump(report, f, indent=2)
+    return still_pending
+
 def zip_directory(dir_name, zip_name):
     """
     Zips the directory specified by zip_name.
 
-    Assumes the the directory to be zipped is located within the script directory
+    Assumes the the directory to be zipped is located within the data directory (DATA_DIR, the script directory by default)
     
-    Writes the zipped file back into the script directory
+    Writes the zipped file back into the data directory
 
     """
 
     # Establish paths
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    sub_dir_path = os.path.join(script_dir, dir_name)
-    zip_file_path = os.path.join(script_dir, zip_name)
+    sub_dir_path = os.path.join(DATA_DIR, dir_name)
+    zip_file_path = os.path.join(DATA_DIR, zip_name)
 
      # Create the zip file
     with zipfile.ZipFile(zip_file_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
@@ -153,18 +225,18 @@ def check_user_table(table, eid):
         0 = Don't do the second half of the survey
         1 = Do the second half of the survey
     """
-    # Check all rows for the name
-    for i in range(table.shape[0]):
-        if table.loc[i, 'EID'] == eid:
-            table_time = datetime.datetime.strptime(table.loc[i, 'LastTime'], '%Y-%m-%d %H:%M:%S.%f')
-            # Update 'SessionNum' using loc to avoid the chained assignment warning
-            table.loc[i, 'SessionNum'] += 1
-            delta = datetime.datetime.now() - table_time
-            seconds = delta.total_seconds()
-            if seconds < 43200:  # 12 hours = 12*60*60 = 43200
-                # Don't do survey
-                return 0
-            break
+    # Find the first row with the eid
+    matches = table.index[table['EID'] == eid]
+    if len(matches) > 0:
+        i = matches[0]
+        table_time = datetime.datetime.strptime(table.loc[i, 'LastTime'], '%Y-%m-%d %H:%M:%S.%f')
+        # Update 'SessionNum' using loc to avoid the chained assignment warning
+        table.loc[i, 'SessionNum'] += 1
+        delta = datetime.datetime.now() - table_time
+        seconds = delta.total_seconds()
+        if seconds < 43200:  # 12 hours = 12*60*60 = 43200
+            # Don't do survey
+            return 0
     # Do survey
     return 1
 
@@ -176,17 +248,12 @@ def track_user(table, first, last, eid, caffeine_mg, meal_size, meal_desc, exerc
     Returns: The modified user table and the individual row of metadata for the specified user (both as pandas dataframes). Handles session number tracking internally 
     by either initializing SessionNum to 1 (new user) or incrementing by 1 (existing user).
     """
-    present = 0
-    index = 0
     # Check if the user is already in the table
-    for i in range(table.shape[0]):
-        if table['First'][i] == first and table['Last'][i] == last and table['EID'][i] == eid:
-            present = 1
-            index = i
-            break
+    matches = np.flatnonzero((table['First'] == first) & (table['Last'] == last) & (table['EID'] == eid))
 
     # If they're there, update their values with new responses
-    if present == 1:
+    if len(matches) > 0:
+        index = matches[0]
         table.at[index, 'StimulantUse'] = stim_use_TF
         table.at[index, 'CaffeineMg'] = caffeine_mg
         table.at[index, 'MealSize'] = meal_size
@@ -198,27 +265,25 @@ def track_user(table, first, last, eid, caffeine_mg, meal_size, meal_desc, exerc
         table.at[index, 'LastTime'] = str(datetime.datetime.now())
         table.at[index, 'SessionNum'] = table.at[index, 'SessionNum'] + 1
 
-    # If they are not there, create a new row with their responses
+    # If they are not there, add a new row with their responses in place
     else:
-        id = table.shape[0] + 1
-        new_row = pd.DataFrame({
-            'ID': [id],
-            'First': [first],
-            'Last': [last],
-            'EID': [eid],
-            'StimulantUse': [stim_use_TF],
-            'CaffeineMg': [caffeine_mg],
-            'MealSize': [meal_size],
-            'MealDesc': [meal_desc],
-            'Exercised': [exercised_TF],
-            'ExerciseDesc': [exercise_desc],
-            'HairProduct': [hair_product],
-            'OtherHair': [other_hair],
-            'LastTime': [str(datetime.datetime.now())],
-            'SessionNum': [1]  # New user, start at session 1
+        index = table.shape[0]
+        table.loc[index] = pd.Series({
+            'ID': index + 1,
+            'First': first,
+            'Last': last,
+            'EID': eid,
+            'StimulantUse': stim_use_TF,
+            'CaffeineMg': caffeine_mg,
+            'MealSize': meal_size,
+            'MealDesc': meal_desc,
+            'Exercised': exercised_TF,
+            'ExerciseDesc': exercise_desc,
+            'HairProduct': hair_product,
+            'OtherHair': other_hair,
+            'LastTime': str(datetime.datetime.now()),
+            'SessionNum': 1  # New user, start at session 1
         })
-        table = pd.concat([table, new_row], ignore_index=True)
-        index = table.shape[0] - 1  # Update index to the new row
 
     # Return the updated table and the row as a DataFrame
     return table, table.iloc[[index]]
@@ -236,47 +301,63 @@ def get_user_data(table, eid):
 
 def create_user_directory(first_name, last_name, session_num):
     """
-    Creates a new folder in the current script directory.
+    Creates a new folder in the data directory (DATA_DIR, the script directory by default).
     Directory Name = {first_name}_{last_name}_Session{session_num}
     Returns the name of the directory for later manipulation of the directory.
     """
     dir_name = first_name + '_' + last_name + '_' + 'Session' + str(session_num)
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    new_dir_path = os.path.join(script_dir, dir_name)
+    new_dir_path = os.path.join(DATA_DIR, dir_name)
     os.mkdir(new_dir_path)
     return dir_name
 
 class EEGProcessor:
-    def __init__(self):
-        # Initialize BrainFlow
-        BoardShim.enable_dev_board_logger()
-        params = BrainFlowInputParams()
-        #serial_port = find_serial_port()
-        #params.serial_port = serial_port
-        #self.board_id = BoardIds.CYTON_DAISY_BOARD.value
-        self.board_id = BoardIds.SYNTHETIC_BOARD.value
-        self.board = BoardShim(self.board_id, params)
+    def __init__(self, source=None, window_size_sec=7):
+        """
+        Reads from a board source (see board_source), the BrainFlow synthetic board by default.
+        Give a board_source.PlaybackSource to replay a recorded session instead of streaming from a headset.
+        window_size_sec is the length of the windows returned by get_recent_data, the buffers hold two of them.
+        """
+        if source is None:
+            # Initialize BrainFlow
+            BoardShim.enable_dev_board_logger()
+            #serial_port = find_serial_port()
+            #source = BrainFlowSource(BoardIds.CYTON_DAISY_BOARD.value, serial_port=serial_port)
+            source = BrainFlowSource(BoardIds.SYNTHETIC_BOARD.value)
+        self.board = source
+        self.board_id = source.board_id
         self.board.prepare_session()
         self.board.start_stream()
         print("BrainFlow streaming started...")
 
         # Sampling rate and window size
-        self.sampling_rate = BoardShim.get_sampling_rate(self.board_id)
-        self.window_size_sec = 7  # seconds
+        self.sampling_rate = source.sampling_rate
+        self.window_size_sec = window_size_sec  # seconds
         self.window_size_samples = int(self.window_size_sec * self.sampling_rate)
 
-        # we set raw window size to 10 seconds
-        self.window_size_raw = int(10 * self.sampling_rate)
         self.lowcut = 1.0
         self.highcut = 50.0
         self.notch = 60.0
 
         # Get EEG channels
-        self.eeg_channels = BoardShim.get_eeg_channels(self.board_id)
+        self.eeg_channels = source.eeg_channels
+        self.timestamp_channel = source.timestamp_channel
+        self.marker_channel = source.marker_channel
+        self.n_rows = source.n_rows
 
-        # Initialize buffers
-        self.raw_data_buffer = np.empty((len(self.eeg_channels), 0))
-        self.processed_data_buffer = np.empty((len(self.eeg_channels), 0))
+        # Bandpass and notch filter, designed once and kept stateful between calls
+        self.filter = StreamingFilter(len(self.eeg_channels), self.sampling_rate,
+                                      self.lowcut, self.highcut, self.notch)
+
+        # Per-channel quality of the raw signal (flatline, railing, line noise, variance)
+        self.quality = SignalQualityMonitor(len(self.eeg_channels), self.sampling_rate, line_freq=self.notch)
+
+        # Initialize preallocated circular buffers, the processed buffer holds two windows
+        self.processed_data_buffer = RingBuffer(len(self.eeg_channels), self.window_size_samples * 2)
+        # Sample timestamps, aligned with processed_data_buffer, used to locate stimulus onsets
+        self.timestamp_buffer = RingBuffer(1, self.window_size_samples * 2)
+
+        # Optional SessionRecorder that receives every drained chunk with all board rows
+        self.recorder = None
 
     def stop(self):
         # Stop the data stream and release the session
@@ -284,107 +365,143 @@ class EEGProcessor:
         self.board.release_session()
         print("BrainFlow streaming stopped.")
 
-    def get_recent_data(self):
+    def update(self):
         """
-        Returns the most recent 7 seconds of processed EEG data.
+        Drains all new samples from the board and processes them into the processed buffer.
 
-        The data is bandpass filtered, notch filtered, and z-scored.
-        Each data point is filtered only once.
+        Returns the number of new samples.
         """
+        before = time.perf_counter()
         data = self.board.get_board_data() 
-        if data.shape[1] == 0:
-            # No new data
-            pass
-        else:
-        
-            # Append new raw data to the raw_data_buffer
-            eeg_data = data[self.eeg_channels, :]
-            self.raw_data_buffer = np.hstack((self.raw_data_buffer, eeg_data))
+        metrics.observe('drain_time', time.perf_counter() - before)
+        metrics.observe('drain_samples', data.shape[1])
+        if data.shape[1] > 0:
+            metrics.count('samples', data.shape[1])
+            if self.recorder is not None:
+                with metrics.timer('record_time'):
+                    self.recorder.append(data)
 
-            # Process new data
-            new_processed_data = np.empty(self.raw_data_buffer.shape)
-            # It is important to process each channel separately (why?)
-            for i in range(len(self.eeg_channels)):
+            eeg_data = data[self.eeg_channels, :]
+            with metrics.timer('quality_time'):
+                self.quality.update(eeg_data)
 
-                # it is important to use the whole buffer for filtering (why?)
-                # Get the channel data
-                channel_data = self.raw_data_buffer[i, :].copy()
+            # Filter only the new samples, the filter state carries over from the last call
+            with metrics.timer('filter_time'):
+                new_processed_data = self.filter.process(eeg_data)
+            self.processed_data_buffer.append(new_processed_data)
+            self.timestamp_buffer.append(data[[self.timestamp_channel], :])
 
-                # Bandpass filter
-                b, a = butter(2, [self.lowcut, self.highcut], btype='band', fs=self.sampling_rate)
-                channel_data = lfilter(b, a, channel_data)
-                
-                # Notch filter
-                b, a = iirnotch(self.notch, 30, fs=self.sampling_rate)
-                channel_data = lfilter(b, a, channel_data)
+        return data.shape[1]
 
-                # add channel dimension to channel_data
-                new_processed_data[i, :] =  channel_data
+    def get_sample_index(self, t):
+        """
+        Returns the absolute index of the first sample recorded at or after time t (seconds since the epoch),
+        which is the index of the next sample if it hasn't been received yet.
 
-            
-            self.processed_data_buffer = np.hstack((self.processed_data_buffer, new_processed_data))
+        Raises IndexError if t is older than every sample left in the buffer.
+        """
+        timestamps = self.timestamp_buffer.latest()[0]
+        oldest = self.timestamp_buffer.total_written - len(timestamps)
+        if oldest > 0 and timestamps[0] > t:
+            raise IndexError("The samples at the requested time have already been dropped from the buffer")
+        return oldest + int(np.searchsorted(timestamps, t))
 
-            max_buffer_size = self.window_size_samples * 2
-            if self.raw_data_buffer.shape[1] > self.window_size_raw:
-                self.raw_data_buffer = self.raw_data_buffer[:, -self.window_size_raw:]
-            if self.processed_data_buffer.shape[1] > max_buffer_size:
-                self.processed_data_buffer = self.processed_data_buffer[:, -max_buffer_size:]
+    def get_epoch(self, onset_time, n_samples):
+        """
+        Returns a copy of the n_samples processed samples starting at onset_time, along with the
+        absolute index of the onset sample, or None if the last samples haven't been received yet.
+        """
+        onset_sample = self.get_sample_index(onset_time)
+        if onset_sample + n_samples > self.processed_data_buffer.total_written:
+            return None
+        return self.processed_data_buffer.get_range(onset_sample, onset_sample + n_samples).copy(), onset_sample
 
-        if self.processed_data_buffer.shape[1] >= self.window_size_samples:
-            recent_data = self.processed_data_buffer[:, -self.window_size_samples:]
-        else:
-            recent_data = self.processed_data_buffer
+    def get_recent_data(self):
+        """
+        Returns the most recent window_size_sec (7 by default) seconds of processed EEG data.
 
-        return recent_data
+        The data is bandpass filtered and notch filtered.
+        Each data point is filtered only once, as it is drained from the board.
+        The returned array can be a view into the processed buffer, copy it to keep it past the next call.
+        """
+        self.update()
+        # A view into the buffer when possible, otherwise one contiguous copy
+        return self.processed_data_buffer.latest(self.window_size_samples)
     
-#Save last 7 seconds of signal and metadata to its own .pkl file in the session directory
-def save_data(eeg_processor, metadata, direction, trial_num, directory):
-    sig = eeg_processor.get_recent_data()
-    # Checks for nan's or if there are any channels that have a standard deviation of 1
-    if np.isnan(sig).any():
-        return None
-    for i in range(sig.shape[0]):
-        if np.std(sig[i, :]) == 0:
-            return None
-    #Establish a filename - I think maybe we could do [Direction]_[Number].pkl but maybe we could just work that out
-    filename = direction + '_' + str(trial_num) + '.pkl'
+def save_data(sig, metadata, direction, trial_num, directory, trial_info=None):
+    """
+    Appends the epoch of a finished trial to the session store in the session directory.
 
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    intermediate = os.path.join(script_dir, directory)
-    filepath = os.path.join(intermediate, filename)
+    Trials are kept whatever their quality: the channels with NaN samples or no signal in the epoch,
+    and the channels flagged by the signal quality monitor during the trial (trial_info['ChannelFlags']),
+    are recorded in the QualityFlags and BadChannels columns of trials.csv.
 
-    #Dump signal and metadata into pickle file - this saves into the folder that we created earlier
-    with open(filepath, 'wb') as f:
-        pickle.dump((sig, metadata), f)
-    
+    Returns the index of the trial in the store.
+    """
+    trial_info = dict(trial_info or {})
+    flags = epoch_flags(sig) | trial_info.get('ChannelFlags', 0)
+    trial_info['QualityFlags'] = int(np.bitwise_or.reduce(flags))
+    # Numbered from 1 like on the quality display
+    trial_info['BadChannels'] = ' '.join(str(channel + 1) for channel in np.flatnonzero(flags))
+    if trial_info['QualityFlags']:
+        metrics.count('trials_flagged')
+
+    session_dir = os.path.join(DATA_DIR, directory)
+    return append_trial(session_dir, sig, direction, trial_num, metadata=metadata, trial_info=trial_info)
 
-def main():
-    eeg_processor = EEGProcessor()
+
+def main(source=None, client_factory=authenticate, display_size=None, time_scale=1.0, idle_screen=None):
+    """
+    Runs the data collection application.
+
+    The defaults run a real session: BrainFlow board, Box, fullscreen display. The parameters let
+    simulate_session.py run it headless: source is the board source given to EEGProcessor,
+    client_factory creates the Box client, display_size opens a window of that size instead of
+    fullscreen, time_scale runs every trial phase that many times faster (with a board source
+    streaming as fast) and idle_screen paces and can script the input of the menu screens.
+    """
+    eeg_processor = EEGProcessor(source)
+    # Drain and filter on a background thread so the render loop only reads processed windows
+    acquisition = AcquisitionWorker(eeg_processor, poll_interval=0.02)
+    acquisition.start()
+    # Cuts each trial's epoch out of the stream once the trial ends and saves it in the background
+    epoch_saver = EpochSaver(acquisition, save_data, epoch_duration=7)
+    epoch_saver.start()
     
     # Load table from Box
-    client = authenticate()
-    file_id = '1679766376012'
-    download_dir = os.path.dirname(os.path.abspath(__file__))
-    table_path = download_file(client, file_id, download_dir)
-    print("Table saved to " + table_path)
-    user_table = pd.read_csv(table_path)
+    client = client_factory()
+    file_id = TABLE_FILE_ID
+    download_dir = DATA_DIR
+    # Indexed user registry, kept locally with the session history and reloaded only when the table in Box changed
+    # Uploads run on a background worker, unfinished uploads are resumed on the next launch
+    upload_queue = UploadQueue(client_factory, os.path.join(download_dir, 'upload_queue.json'))
+    user_registry = UserRegistry(os.path.join(download_dir, 'user_registry.db'))
+    # Before the queue starts, so an update of the table left over by the last launch isn't sent before it is exported
+    table_path = sync_user_table(client, file_id, download_dir, user_registry, upload_queue)
+    upload_queue.start()
 
     # Initialize Pygame
     pygame.init()
-    infoObject = pygame.display.Info()
-    screen = pygame.display.set_mode((infoObject.current_w, infoObject.current_h), pygame.FULLSCREEN)
+    if display_size is None:
+        infoObject = pygame.display.Info()
+        screen = pygame.display.set_mode((infoObject.current_w, infoObject.current_h), pygame.FULLSCREEN)
+    else:
+        screen = pygame.display.set_mode(display_size)
+        infoObject = pygame.display.Info()
     pygame.display.set_caption("Motor Imagery Task")
 
     # Colors
     BLACK = (0, 0, 0)
     WHITE = (255, 255, 255)
     GREEN = (0, 255, 0)
+    YELLOW = (255, 200, 0)
     RED = (255, 0, 0)
 
     # Fonts
     large_font = pygame.font.SysFont(None, 200)
     medium_font = pygame.font.SysFont(None, 100)
     small_font = pygame.font.SysFont(None, 50)
+    quality_font = pygame.font.SysFont(None, 30)
 
     # Control Variables
     running = True
@@ -398,9 +515,16 @@ def main():
     trial_number = 1
     total_trials = 1 # Default number of trials
     time_between_sessions = 180 # number of seconds to wait between sessions of data collection
+    archive_codec = 'deflate' # compression of the session archive, see session_archive.CODECS
+    archive_level = 1 # fast compression keeps up with the session
+    archive_downcast = False # archive the raw recording as float32, except its timestamps, extracted back as float64
+    dirty_rect_rendering = True # during the loading bar, only update the region of the bar instead of flipping the whole screen
     start_enable_time = time.time() # the time at/after which the start button is enabled
     saved_questionnaire_data = False
     uploaded_session = False
+    session_archive = None
+    scheduler = None
+    pending_upload_timing = [] # (upload job keys, timing report path) of the sessions still uploading
 
     # Bar Settings
     green_bar_width = 20
@@ -415,8 +539,107 @@ def main():
     # Center Position
     center_pos = (infoObject.current_w // 2, infoObject.current_h // 2)
 
-    # Clock
-    clock = pygame.time.Clock()
+    # Arrow Settings
+    arrow_length = 100
+    arrow_color = WHITE
+    arrow_width = 20
+    arrow_y_offset = arrow_offset_y  # Move arrow up by arrow_offset_y pixels
+
+    # Caches for rendered text and for the static layer of each screen
+    text_cache = TextCache()
+    # The menu, the green bars and the two cue layers
+    layer_cache = LayerCache((infoObject.current_w, infoObject.current_h), BLACK, max_size=4)
+
+    def loading_bar_rect(direction, progress):
+        """
+        Returns the rectangle of the loading bar, growing from the center towards the green bar of the direction.
+        """
+        if direction == 'left':
+            # From center to left green bar
+            max_length = center_pos[0] - (left_green_bar_pos[0] + green_bar_width)
+            current_length = int(progress * max_length)
+            # Start at center and move left
+            return pygame.Rect(center_pos[0] - current_length, center_pos[1] - loading_bar_thickness // 2,
+                               current_length, loading_bar_thickness)
+        # From center to right green bar
+        max_length = right_green_bar_pos[0] - center_pos[0]
+        current_length = int(progress * max_length)
+        # Start at center and move right
+        return pygame.Rect(center_pos[0], center_pos[1] - loading_bar_thickness // 2,
+                           current_length, loading_bar_thickness)
+
+    def draw_menu_layer(surface):
+        """
+        Draws the static text of the main menu.
+        """
+        title_text = large_font.render("EEG Motor Imagery", True, WHITE)
+        start_text = medium_font.render("Press S to Start", True, GREEN)
+        set_text = medium_font.render("Press N to Set Number", True, WHITE)
+        quit_text = medium_font.render("Press Q to Quit", True, RED)
+        trials_text = small_font.render(f"Total Trials: {total_trials}", True, WHITE)
+
+        # Positioning Text
+        title_rect = title_text.get_rect(center=(infoObject.current_w // 2, infoObject.current_h // 4))
+        start_rect = start_text.get_rect(center=(infoObject.current_w // 2, infoObject.current_h // 2 - 50))
+        set_rect = set_text.get_rect(center=(infoObject.current_w // 2, infoObject.current_h // 2 + 50))
+        quit_rect = quit_text.get_rect(center=(infoObject.current_w // 2, infoObject.current_h // 2 + 150))
+        trials_rect = trials_text.get_rect(center=(infoObject.current_w // 2, infoObject.current_h // 2 - 150))
+
+        # Blit Text to the layer
+        surface.blit(title_text, title_rect)
+        surface.blit(start_text, start_rect)
+        surface.blit(set_text, set_rect)
+        surface.blit(quit_text, quit_rect)
+        surface.blit(trials_text, trials_rect)
+
+    def draw_trial_layer(surface, direction=None):
+        """
+        Draws the green bars, and the cue arrow if a direction is given.
+        """
+        pygame.draw.rect(surface, GREEN, (*left_green_bar_pos, green_bar_width, green_bar_height))
+        pygame.draw.rect(surface, GREEN, (*right_green_bar_pos, green_bar_width, green_bar_height))
+        if direction == 'left':
+            pygame.draw.polygon(surface, arrow_color, [
+                (center_pos[0] - arrow_length, center_pos[1] - arrow_y_offset),
+                (center_pos[0], center_pos[1] - arrow_y_offset - arrow_width),
+                (center_pos[0], center_pos[1] - arrow_y_offset + arrow_width)
+            ])
+        elif direction == 'right':
+            pygame.draw.polygon(surface, arrow_color, [
+                (center_pos[0] + arrow_length, center_pos[1] - arrow_y_offset),
+                (center_pos[0], center_pos[1] - arrow_y_offset - arrow_width),
+                (center_pos[0], center_pos[1] - arrow_y_offset + arrow_width)
+            ])
+
+    def blit_trial_layer(layer, trial_number):
+        """
+        Blits a trial layer and the trial counter over it, the counter being the only part that changes between trials.
+        """
+        screen.blit(layer, (0, 0))
+        trial_info = text_cache.render(small_font, f"Trial {trial_number}/{total_trials}", True, WHITE)
+        screen.blit(trial_info, trial_info.get_rect(topright=(infoObject.current_w - 50, 50)))
+
+    def draw_quality_strip(surface, flags, center_y):
+        """
+        Draws the live signal quality of every channel as a row of numbered boxes:
+        green if the signal is good, yellow if it is noisy, red if it is unusable.
+        """
+        box_size = 40
+        spacing = 10
+        left = infoObject.current_w // 2 - (len(flags) * (box_size + spacing) - spacing) // 2
+        caption = text_cache.render(quality_font, "Signal quality", True, WHITE)
+        surface.blit(caption, caption.get_rect(center=(infoObject.current_w // 2, center_y - box_size)))
+        for channel, flag in enumerate(flags):
+            color = RED if flag & BAD_FLAGS else YELLOW if flag else GREEN
+            box = pygame.Rect(left + channel * (box_size + spacing), center_y - box_size // 2, box_size, box_size)
+            pygame.draw.rect(surface, color, box)
+            label = text_cache.render(quality_font, str(channel + 1), True, BLACK)
+            surface.blit(label, label.get_rect(center=box.center))
+
+    # Menus and questionnaire wait for input instead of redrawing every iteration,
+    # trial phases are paced by the StimulusScheduler of the session
+    if idle_screen is None:
+        idle_screen = IdleScreen(timeout_ms=100)
 
     # Input Variables
     input_text = ""
@@ -471,35 +694,17 @@ def main():
     while running:
 
         if in_menu:
-            # Display Main Menu
-            screen.fill(BLACK)
-            title_text = large_font.render("EEG Motor Imagery", True, WHITE)
-            start_text = medium_font.render("Press S to Start", True, GREEN)
-            set_text = medium_font.render("Press N to Set Number", True, WHITE)
-            quit_text = medium_font.render("Press Q to Quit", True, RED)
-            trials_text = small_font.render(f"Total Trials: {total_trials}", True, WHITE)
-            wait_text = small_font.render(f"You have to wait {round(start_enable_time - time.time())} seconds before starting!", True, WHITE)
-
-            # Positioning Text
-            title_rect = title_text.get_rect(center=(infoObject.current_w // 2, infoObject.current_h // 4))
-            start_rect = start_text.get_rect(center=(infoObject.current_w // 2, infoObject.current_h // 2 - 50))
-            set_rect = set_text.get_rect(center=(infoObject.current_w // 2, infoObject.current_h // 2 + 50))
-            quit_rect = quit_text.get_rect(center=(infoObject.current_w // 2, infoObject.current_h // 2 + 150))
-            trials_rect = trials_text.get_rect(center=(infoObject.current_w // 2, infoObject.current_h // 2 - 150))
-            wait_rect = wait_text.get_rect(center=(infoObject.current_w // 2, infoObject.current_h // 2 + 250))
-
-            # Blit Text to Screen
-            screen.blit(title_text, title_rect)
-            screen.blit(start_text, start_rect)
-            screen.blit(set_text, set_rect)
-            screen.blit(quit_text, quit_rect)
-            screen.blit(trials_text, trials_rect)
-            if (start_enable_time > time.time()): # If the start button is currently disabled
-                screen.blit(wait_text, wait_rect)
-            pygame.display.flip()
+            if idle_screen.changed(('menu', total_trials, max(0, round(start_enable_time - time.time())))):
+                # Display Main Menu, the static text is drawn once into its layer
+                screen.blit(layer_cache.get(('menu', total_trials), draw_menu_layer), (0, 0))
+                if (start_enable_time > time.time()): # If the start button is currently disabled
+                    wait_text = text_cache.render(small_font, f"You have to wait {round(start_enable_time - time.time())} seconds before starting!", True, WHITE)
+                    wait_rect = wait_text.get_rect(center=(infoObject.current_w // 2, infoObject.current_h // 2 + 250))
+                    screen.blit(wait_text, wait_rect)
+                pygame.display.flip()
 
             # Processing Input at the Main Menu
-            for event in pygame.event.get():
+            for event in idle_screen.events():
                 if event.type == pygame.QUIT:
                     running = False
                 elif event.type == pygame.KEYDOWN:
@@ -517,42 +722,43 @@ def main():
 
 
         elif in_questionaire_subject:
-            # Displays the questions about the subject 
-            screen.fill(BLACK)
-
-            # Form questions from questionaire
-            first_name_text = medium_font.render("Enter first name", True, WHITE)
-            last_name_text = medium_font.render("Enter last name", True, WHITE)
-            eid_text = medium_font.render("Enter eid", True, WHITE)
-
-            # Position for questions
-            height_delta = infoObject.current_h // 6
-            first_name_rect = first_name_text.get_rect(center=(infoObject.current_w // 2, height_delta))
-            last_name_rect = last_name_text.get_rect(center=(infoObject.current_w // 2, height_delta * 3))
-            eid_rect = eid_text.get_rect(center=(infoObject.current_w // 2, height_delta * 5))
-
-            # Form answers for questionaire
-            first_name_response = medium_font.render(identity_answers[0], True, WHITE)
-            last_name_response = medium_font.render(identity_answers[1], True, WHITE)
-            eid_response = medium_font.render(identity_answers[2], True, WHITE)
-
-            # Position for answer
-            first_name_response_rect = first_name_response.get_rect(center=(infoObject.current_w // 2, height_delta * 2))
-            last_name_response_rect = last_name_response.get_rect(center=(infoObject.current_w // 2, height_delta * 4))
-            eid_response_rect = eid_response.get_rect(center=(infoObject.current_w // 2, height_delta * 6))
-
-            # Blit Text to Screen
-            screen.blit(first_name_text, first_name_rect)
-            screen.blit(last_name_text, last_name_rect)
-            screen.blit(eid_text, eid_rect)
+            if idle_screen.changed(('subject',)):
+                # Displays the questions about the subject 
+                screen.fill(BLACK)
+
+                # Form questions from questionaire
+                first_name_text = text_cache.render(medium_font, "Enter first name", True, WHITE)
+                last_name_text = text_cache.render(medium_font, "Enter last name", True, WHITE)
+                eid_text = text_cache.render(medium_font, "Enter eid", True, WHITE)
+
+                # Position for questions
+                height_delta = infoObject.current_h // 6
+                first_name_rect = first_name_text.get_rect(center=(infoObject.current_w // 2, height_delta))
+                last_name_rect = last_name_text.get_rect(center=(infoObject.current_w // 2, height_delta * 3))
+                eid_rect = eid_text.get_rect(center=(infoObject.current_w // 2, height_delta * 5))
+
+                # Form answers for questionaire
+                first_name_response = text_cache.render(medium_font, identity_answers[0], True, WHITE)
+                last_name_response = text_cache.render(medium_font, identity_answers[1], True, WHITE)
+                eid_response = text_cache.render(medium_font, identity_answers[2], True, WHITE)
+
+                # Position for answer
+                first_name_response_rect = first_name_response.get_rect(center=(infoObject.current_w // 2, height_delta * 2))
+                last_name_response_rect = last_name_response.get_rect(center=(infoObject.current_w // 2, height_delta * 4))
+                eid_response_rect = eid_response.get_rect(center=(infoObject.current_w // 2, height_delta * 6))
+
+                # Blit Text to Screen
+                screen.blit(first_name_text, first_name_rect)
+                screen.blit(last_name_text, last_name_rect)
+                screen.blit(eid_text, eid_rect)
                         
-            screen.blit(first_name_response, first_name_response_rect)
-            screen.blit(last_name_response, last_name_response_rect)
-            screen.blit(eid_response, eid_response_rect)
-            pygame.display.flip()
+                screen.blit(first_name_response, first_name_response_rect)
+                screen.blit(last_name_response, last_name_response_rect)
+                screen.blit(eid_response, eid_response_rect)
+                pygame.display.flip()
 
             # Subject info page handling
-            for event in pygame.event.get():
+            for event in idle_screen.events():
                 if event.type == pygame.QUIT:
                     running = False
                     break
@@ -576,54 +782,56 @@ def main():
 
 
         elif in_questionaire_physiological:
-            # Display the questions about the subject's physiological condition
-            screen.fill(BLACK)
-
-            # Multiple Choice Questions
-            stimulant_text = small_font.render("How much stimulant (e.g. caffiene) have you consumed in the past 12 hours?", True, WHITE)
-            meal_text = small_font.render("Have you consumed a light, medium, or heavy meal in the past 12 hours?", True, WHITE)
-            exercise_text = small_font.render("Have you exercised in the past 12 hours?", True, WHITE)
-
-            # Free Response Questions
-            food_description_text = small_font.render("Describe what you ate in detail to the best of your ability, include portion size if possible", True, WHITE)
-            exercise_type_text = small_font.render("If you have exercised, please describe what you did and how long it was. N/A if no exercise", True, WHITE) 
-
-            # Free Response Answers
-            food_response = small_font.render(free_response_answers[0], True, WHITE)
-            exercise_response = small_font.render(free_response_answers[1], True, WHITE)
-
-            food_response_rect = food_response.get_rect(center=(infoObject.current_w // 2, height_delta * 6))
-            exercise_response_rect = exercise_response.get_rect(center=(infoObject.current_w // 2, height_delta * 10))
-
-            # Question Positioning
-            height_delta = infoObject.current_h // 11
-            stimulant_rect = stimulant_text.get_rect(center=(infoObject.current_w // 2, height_delta))
-            meal_rect = meal_text.get_rect(center=(infoObject.current_w // 2, height_delta * 3))
-            food_description_rect = food_description_text.get_rect(center=(infoObject.current_w // 2, height_delta * 5))
-            exercise_rect = exercise_text.get_rect(center=(infoObject.current_w // 2, height_delta * 7))
-            exercise_type_rect = exercise_type_text.get_rect(center=(infoObject.current_w // 2, height_delta * 9))
-
-            screen.blit(stimulant_text, stimulant_rect)
-            screen.blit(meal_text, meal_rect)
-            screen.blit(food_description_text, food_description_rect)
-            screen.blit(exercise_text, exercise_rect)
-            screen.blit(exercise_type_text, exercise_type_rect)
-
-            screen.blit(food_response, food_response_rect)
-            screen.blit(exercise_response, exercise_response_rect)
-
             all_boxes = []
             all_boxes.append(stimulant_boxes)
             all_boxes.append(meal_boxes)
             all_boxes.append(exercise_bool_boxes)
-            for box_holder in all_boxes:
-                for box in box_holder:
-                    box.render_checkbox()
-            pygame.display.flip()
+
+            if idle_screen.changed(('physiological',)):
+                # Display the questions about the subject's physiological condition
+                screen.fill(BLACK)
+
+                # Multiple Choice Questions
+                stimulant_text = text_cache.render(small_font, "How much stimulant (e.g. caffiene) have you consumed in the past 12 hours?", True, WHITE)
+                meal_text = text_cache.render(small_font, "Have you consumed a light, medium, or heavy meal in the past 12 hours?", True, WHITE)
+                exercise_text = text_cache.render(small_font, "Have you exercised in the past 12 hours?", True, WHITE)
+
+                # Free Response Questions
+                food_description_text = text_cache.render(small_font, "Describe what you ate in detail to the best of your ability, include portion size if possible", True, WHITE)
+                exercise_type_text = text_cache.render(small_font, "If you have exercised, please describe what you did and how long it was. N/A if no exercise", True, WHITE) 
+
+                # Free Response Answers
+                food_response = text_cache.render(small_font, free_response_answers[0], True, WHITE)
+                exercise_response = text_cache.render(small_font, free_response_answers[1], True, WHITE)
+
+                food_response_rect = food_response.get_rect(center=(infoObject.current_w // 2, height_delta * 6))
+                exercise_response_rect = exercise_response.get_rect(center=(infoObject.current_w // 2, height_delta * 10))
+
+                # Question Positioning
+                height_delta = infoObject.current_h // 11
+                stimulant_rect = stimulant_text.get_rect(center=(infoObject.current_w // 2, height_delta))
+                meal_rect = meal_text.get_rect(center=(infoObject.current_w // 2, height_delta * 3))
+                food_description_rect = food_description_text.get_rect(center=(infoObject.current_w // 2, height_delta * 5))
+                exercise_rect = exercise_text.get_rect(center=(infoObject.current_w // 2, height_delta * 7))
+                exercise_type_rect = exercise_type_text.get_rect(center=(infoObject.current_w // 2, height_delta * 9))
+
+                screen.blit(stimulant_text, stimulant_rect)
+                screen.blit(meal_text, meal_rect)
+                screen.blit(food_description_text, food_description_rect)
+                screen.blit(exercise_text, exercise_rect)
+                screen.blit(exercise_type_text, exercise_type_rect)
+
+                screen.blit(food_response, food_response_rect)
+                screen.blit(exercise_response, exercise_response_rect)
+
+                for box_holder in all_boxes:
+                    for box in box_holder:
+                        box.render_checkbox()
+                pygame.display.flip()
             
             # Loop
             # Subject info page handling
-            for event in pygame.event.get():
+            for event in idle_screen.events():
                 if event.type == pygame.QUIT:
                     running = False
                     break
@@ -685,29 +893,58 @@ def main():
                         exercise = box.get_caption()
 
                 #Use questionnaire to update metadata and track user
-                user_table, metadata = track_user(user_table, first_name, last_name, eid, stim, meal, 
-                                                    describe_meal, exercise_yn, exercise_description)
-                user_table.to_csv(table_path, index=False)  # Save modifications locally
+                metadata = user_registry.upsert(first_name, last_name, eid, stim, meal,
+                                                describe_meal, exercise_yn, exercise_description)
+                user_registry.export_csv(table_path)  # Save modifications locally
                 session_num = metadata.iloc[0, 13]
                 directory = create_user_directory(first_name, last_name, session_num)
                 saved_questionnaire_data = True
+
+                # Record the whole raw stream of the session, with stimulus events as markers
+                recorder = SessionRecorder(os.path.join(DATA_DIR, directory), eeg_processor.board_id,
+                                           eeg_processor.sampling_rate, eeg_processor.n_rows,
+                                           eeg_processor.eeg_channels, eeg_processor.timestamp_channel,
+                                           eeg_processor.marker_channel)
+                acquisition.start_recording(recorder)
+                acquisition.mark('session_start')
+
+                # Every trial epoch is appended to one contiguous array in the session store
+                create_session_store(os.path.join(DATA_DIR, directory), len(eeg_processor.eeg_channels),
+                                     epoch_saver.epoch_samples, eeg_processor.sampling_rate, metadata)
+
+                # Build the zip archive while the session runs, the new data is compressed after every trial
+                session_archive = SessionArchive(os.path.join(DATA_DIR, directory + '.zip'),
+                                                 codec=archive_codec, level=archive_level, downcast=archive_downcast)
+                session_archive.track(os.path.join(DATA_DIR, directory, EPOCHS_FILE))
+                # The timestamps need float64 to keep sub-millisecond precision
+                session_archive.track(os.path.join(DATA_DIR, directory, RAW_DATA_FILE), columns=eeg_processor.n_rows,
+                                      keep=(eeg_processor.timestamp_channel,))
+                epoch_saver.archive = session_archive
+
+                # Trial phases are timed against deadlines counted from the first trial of the session
+                scheduler = StimulusScheduler()
+                # Timing telemetry of this session, saved next to its data
+                metrics.reset()
         
-            # Display buffer screen that appears before the trials
-            screen.fill(BLACK)
-            buffer_screen_title = large_font.render("Ready?", True, WHITE)
-            start_trial_text = medium_font.render("Press S to Start Trial", True, GREEN)
-
-            # Positioning Text
-            buffer_screen_title_rect = buffer_screen_title.get_rect(center=(infoObject.current_w // 2, infoObject.current_h // 4))
-            start_trial_text_rect = start_trial_text.get_rect(center=(infoObject.current_w // 2, infoObject.current_h // 2 + 50))
-
-            # Blit Text to Screen
-            screen.blit(buffer_screen_title, buffer_screen_title_rect)
-            screen.blit(start_trial_text, start_trial_text_rect)
-            pygame.display.flip()
+            quality = acquisition.get_quality()
+            if idle_screen.changed(('buffer', tuple(quality))):
+                # Display buffer screen that appears before the trials
+                screen.fill(BLACK)
+                buffer_screen_title = text_cache.render(large_font, "Ready?", True, WHITE)
+                start_trial_text = text_cache.render(medium_font, "Press S to Start Trial", True, GREEN)
+
+                # Positioning Text
+                buffer_screen_title_rect = buffer_screen_title.get_rect(center=(infoObject.current_w // 2, infoObject.current_h // 4))
+                start_trial_text_rect = start_trial_text.get_rect(center=(infoObject.current_w // 2, infoObject.current_h // 2 + 50))
+
+                # Blit Text to Screen
+                screen.blit(buffer_screen_title, buffer_screen_title_rect)
+                screen.blit(start_trial_text, start_trial_text_rect)
+                draw_quality_strip(screen, quality, infoObject.current_h * 3 // 4)
+                pygame.display.flip()
 
             # Processing Inputs at the Buffer Screen
-            for event in pygame.event.get():
+            for event in idle_screen.events():
                 if event.type == pygame.QUIT:
                     running = False
                     break
@@ -717,28 +954,30 @@ def main():
                         break
                     if event.key == pygame.K_s:
                         in_buffer_screen = False
+                        scheduler.rebase()
 
 
         elif in_input:
-            # Display Input Menu for Setting Number of Trials
-            screen.fill(BLACK)
-            prompt_text = medium_font.render("Enter Number of Recordings (Even):", True, WHITE)
-            input_display = medium_font.render(input_text, True, GREEN if not input_error else RED)
-            instructions_text = small_font.render("Press Enter to Confirm", True, WHITE)
-
-            # Positioning Text
-            prompt_rect = prompt_text.get_rect(center=(infoObject.current_w // 2, infoObject.current_h // 3))
-            input_rect = input_display.get_rect(center=(infoObject.current_w // 2, infoObject.current_h // 2))
-            instructions_rect = instructions_text.get_rect(center=(infoObject.current_w // 2, infoObject.current_h // 2 + 100))
-
-            # Blit Text to Screen
-            screen.blit(prompt_text, prompt_rect)
-            screen.blit(input_display, input_rect)
-            screen.blit(instructions_text, instructions_rect)
-            pygame.display.flip()
+            if idle_screen.changed(('input',)):
+                # Display Input Menu for Setting Number of Trials
+                screen.fill(BLACK)
+                prompt_text = text_cache.render(medium_font, "Enter Number of Recordings (Even):", True, WHITE)
+                input_display = text_cache.render(medium_font, input_text, True, GREEN if not input_error else RED)
+                instructions_text = text_cache.render(small_font, "Press Enter to Confirm", True, WHITE)
+
+                # Positioning Text
+                prompt_rect = prompt_text.get_rect(center=(infoObject.current_w // 2, infoObject.current_h // 3))
+                input_rect = input_display.get_rect(center=(infoObject.current_w // 2, infoObject.current_h // 2))
+                instructions_rect = instructions_text.get_rect(center=(infoObject.current_w // 2, infoObject.current_h // 2 + 100))
+
+                # Blit Text to Screen
+                screen.blit(prompt_text, prompt_rect)
+                screen.blit(input_display, input_rect)
+                screen.blit(instructions_text, instructions_rect)
+                pygame.display.flip()
 
             # Processing Inputs at the Input Menu
-            for event in pygame.event.get():
+            for event in idle_screen.events():
                 if event.type == pygame.QUIT:
                     running = False
                     break
@@ -767,25 +1006,28 @@ def main():
 
 
         elif in_trial_menu: 
-            # Display Trial Menu (Accessible via 'M' during trials)
-            screen.fill(BLACK)
-            menu_title = medium_font.render("Trial Menu", True, WHITE)
-            quit_text = medium_font.render("Press Q to Quit", True, RED)
-            resume_text = medium_font.render("Press R to Resume", True, GREEN)
-
-            # Positioning Text
-            menu_title_rect = menu_title.get_rect(center=(infoObject.current_w // 2, infoObject.current_h // 3))
-            quit_rect = quit_text.get_rect(center=(infoObject.current_w // 2, infoObject.current_h // 2))
-            resume_rect = resume_text.get_rect(center=(infoObject.current_w // 2, infoObject.current_h // 2 + 100))
-
-            # Blit Text to Screen
-            screen.blit(menu_title, menu_title_rect)
-            screen.blit(quit_text, quit_rect)
-            screen.blit(resume_text, resume_rect)
-            pygame.display.flip()
+            quality = acquisition.get_quality()
+            if idle_screen.changed(('trial_menu', tuple(quality))):
+                # Display Trial Menu (Accessible via 'M' during trials)
+                screen.fill(BLACK)
+                menu_title = text_cache.render(medium_font, "Trial Menu", True, WHITE)
+                quit_text = text_cache.render(medium_font, "Press Q to Quit", True, RED)
+                resume_text = text_cache.render(medium_font, "Press R to Resume", True, GREEN)
+
+                # Positioning Text
+                menu_title_rect = menu_title.get_rect(center=(infoObject.current_w // 2, infoObject.current_h // 3))
+                quit_rect = quit_text.get_rect(center=(infoObject.current_w // 2, infoObject.current_h // 2))
+                resume_rect = resume_text.get_rect(center=(infoObject.current_w // 2, infoObject.current_h // 2 + 100))
+
+                # Blit Text to Screen
+                screen.blit(menu_title, menu_title_rect)
+                screen.blit(quit_text, quit_rect)
+                screen.blit(resume_text, resume_rect)
+                draw_quality_strip(screen, quality, infoObject.current_h * 3 // 4)
+                pygame.display.flip()
 
             # Processing Inputs at the Trial Menu 
-            for event in pygame.event.get():
+            for event in idle_screen.events():
                 if event.type == pygame.QUIT:
                     running = False
                 elif event.type == pygame.KEYDOWN:
@@ -796,36 +1038,52 @@ def main():
 
 
         elif in_after_session_menu:
-            # Display After Session Menu
-            screen.fill(BLACK)
-            question_text = large_font.render("Do you want to continue?", True, WHITE)
-            continue_text = medium_font.render("Press Y to continue", True, GREEN)
-            quit_text = medium_font.render("Press N to exit", True, RED)
-
-            # Positioning Text
-            question_rect = question_text.get_rect(center=(infoObject.current_w // 2, infoObject.current_h // 4))
-            continue_rect = continue_text.get_rect(center=(infoObject.current_w // 2, infoObject.current_h // 2 - 50))
-            quit_rect = quit_text.get_rect(center=(infoObject.current_w // 2, infoObject.current_h // 2 + 50))
-
-            # Blit Text to Screen
-            screen.blit(question_text, question_rect)
-            screen.blit(continue_text, continue_rect)
-            screen.blit(quit_text, quit_rect)
-            pygame.display.flip()
+            progress = upload_queue.progress()
+            if pending_upload_timing:
+                pending_upload_timing = save_upload_timing(upload_queue, pending_upload_timing)
+
+            if idle_screen.changed(('after_session', progress['done'], progress['total'], progress['failed'])):
+                # Display After Session Menu
+                screen.fill(BLACK)
+                question_text = text_cache.render(large_font, "Do you want to continue?", True, WHITE)
+                continue_text = text_cache.render(medium_font, "Press Y to continue", True, GREEN)
+                quit_text = text_cache.render(medium_font, "Press N to exit", True, RED)
+
+                # Positioning Text
+                question_rect = question_text.get_rect(center=(infoObject.current_w // 2, infoObject.current_h // 4))
+                continue_rect = continue_text.get_rect(center=(infoObject.current_w // 2, infoObject.current_h // 2 - 50))
+                quit_rect = quit_text.get_rect(center=(infoObject.current_w // 2, infoObject.current_h // 2 + 50))
+
+                # Blit Text to Screen
+                screen.blit(question_text, question_rect)
+                screen.blit(continue_text, continue_rect)
+                screen.blit(quit_text, quit_rect)
+
+                # Show the progress of the background uploads
+                upload_status = f"Uploaded {progress['done']}/{progress['total']} files"
+                if progress['failed'] > 0:
+                    upload_status += f" ({progress['failed']} failed, will retry on next launch)"
+                upload_text = text_cache.render(small_font, upload_status, True, WHITE)
+                upload_rect = upload_text.get_rect(center=(infoObject.current_w // 2, infoObject.current_h // 2 + 200))
+                screen.blit(upload_text, upload_rect)
+                pygame.display.flip()
 
             if not uploaded_session:
-                # Zip the data and upload it
-                zip_path = zip_directory(directory, directory + '.zip')
-                client = authenticate()
-                file_id = '1679766376012'
-                upload_file(client, '289622073398', zip_path) # uploads the zipped directory
+                # Make sure every epoch and the raw recording are on disk, then finish the archive
+                epoch_saver.flush()
+                acquisition.stop_recording()
+                epoch_saver.archive = None
+                session_dir = os.path.join(DATA_DIR, directory)
+                scheduler.save(os.path.join(session_dir, SCHEDULE_FILE))
+                metrics.save(os.path.join(session_dir, TIMING_FILE))
+                zip_path = session_archive.close([os.path.join(session_dir, name) for name in SESSION_FILES])
+                # Queue the zipped directory and the updated user table, each is sent exactly once
+                upload_jobs = [upload_queue.upload(SESSION_FOLDER_ID, zip_path), upload_queue.update(file_id, table_path, export=user_registry.export_csv)]
+                pending_upload_timing.append((upload_jobs, os.path.join(session_dir, TIMING_FILE)))
                 uploaded_session = True
 
-            #Update the table in Box
-            update_file(client, file_id, table_path)
-
             # Processsing Inputs at the After Session Menu
-            for event in pygame.event.get():
+            for event in idle_screen.events():
                 if event.type == pygame.QUIT:
                     running = False
                 elif event.type == pygame.KEYDOWN:
@@ -837,34 +1095,37 @@ def main():
                         # Not fully sure if all of the following lines are necessary, but they are functional
                         in_after_session_menu = False
                         running = False
-                        eeg_processor.board.stop_stream()
-                        eeg_processor.board.release_session()
+                        acquisition.stop()
+                        # Give the uploads some time to finish, the rest resumes on the next launch
+                        upload_queue.flush(timeout=60)
+                        upload_queue.stop()
+                        save_upload_timing(upload_queue, pending_upload_timing, final=True)
                         pygame.quit()
                         sys.exit()
 
 
         else:
-            # Display Current Trial Number
-            screen.fill(BLACK)
-            # Redraw green bars
-            pygame.draw.rect(screen, GREEN, (*left_green_bar_pos, green_bar_width, green_bar_height))
-            pygame.draw.rect(screen, GREEN, (*right_green_bar_pos, green_bar_width, green_bar_height))
+            # The trial phases draw directly, the next idle screen has to be drawn again
+            idle_screen.invalidate()
 
-            # Draw Current Trial Info
-            trial_info = small_font.render(f"Trial {trial_number}/{total_trials}", True, WHITE)
-            trial_info_rect = trial_info.get_rect(topright=(infoObject.current_w - 50, 50))
-            screen.blit(trial_info, trial_info_rect)
+            # Display green bars and Current Trial Number, the layers are built once and shared by every trial
+            trial_layer = layer_cache.get(('trial',), draw_trial_layer)
+            # Same layer with the arrow of this trial's direction
+            cue_layer = layer_cache.get(('cue', direction), lambda surface: draw_trial_layer(surface, direction))
+            frame_start = time.perf_counter()
+            blit_trial_layer(trial_layer, trial_number)
 
             # Draw Focus Period '+' sign
-            plus_text = large_font.render("+", True, WHITE)
+            plus_text = text_cache.render(large_font, "+", True, WHITE)
             plus_rect = plus_text.get_rect(center=center_pos)
             screen.blit(plus_text, plus_rect)
             pygame.display.flip()
+            metrics.observe('render_time', time.perf_counter() - frame_start)
 
             # Collect data during focus period
-            focus_duration = 3  # seconds
-            focus_start_time = time.time()
-            while time.time() - focus_start_time < focus_duration:
+            focus_duration = 3 / time_scale  # seconds
+            acquisition.mark('focus', scheduler.begin('focus', focus_duration, trial_number))
+            while not scheduler.expired():
                 for event in pygame.event.get():
                     if event.type == pygame.QUIT:
                         running = False
@@ -873,44 +1134,21 @@ def main():
                         if event.key == pygame.K_ESCAPE:
                             running = False
                             break
-                clock.tick(60)
+                scheduler.wait_frame(60)
 
             if not running:
                 break
 
-            # Show Arrow (Moved Up)
-            arrow_length = 100
-            arrow_color = WHITE
-            arrow_width = 20
-            arrow_y_offset = arrow_offset_y  # Move arrow up by arrow_offset_y pixels
-
-            # Clear screen but keep green bars and trial info
-            screen.fill(BLACK)
-            # Redraw green bars
-            pygame.draw.rect(screen, GREEN, (*left_green_bar_pos, green_bar_width, green_bar_height))
-            pygame.draw.rect(screen, GREEN, (*right_green_bar_pos, green_bar_width, green_bar_height))
-            # Redraw trial info
-            screen.blit(trial_info, trial_info_rect)
-
-            # Draw Arrow
-            if direction == 'left':
-                pygame.draw.polygon(screen, arrow_color, [
-                    (center_pos[0] - arrow_length, center_pos[1] - arrow_y_offset),
-                    (center_pos[0], center_pos[1] - arrow_y_offset - arrow_width),
-                    (center_pos[0], center_pos[1] - arrow_y_offset + arrow_width)
-                ])
-            else:
-                pygame.draw.polygon(screen, arrow_color, [
-                    (center_pos[0] + arrow_length, center_pos[1] - arrow_y_offset),
-                    (center_pos[0], center_pos[1] - arrow_y_offset - arrow_width),
-                    (center_pos[0], center_pos[1] - arrow_y_offset + arrow_width)
-                ])
+            # Show Arrow (Moved Up), keeping green bars and trial info
+            frame_start = time.perf_counter()
+            blit_trial_layer(cue_layer, trial_number)
             pygame.display.flip()
+            metrics.observe('render_time', time.perf_counter() - frame_start)
 
             # Wait before starting the loading bar
-            pre_loading_duration = 1  # second
-            pre_loading_start = time.time()
-            while time.time() - pre_loading_start < pre_loading_duration:
+            pre_loading_duration = 1 / time_scale  # second
+            acquisition.mark('cue', scheduler.begin('cue', pre_loading_duration, trial_number))
+            while not scheduler.expired():
                 for event in pygame.event.get():
                     if event.type == pygame.QUIT:
                         running = False
@@ -919,16 +1157,25 @@ def main():
                         if event.key == pygame.K_ESCAPE:
                             running = False
                             break
-                clock.tick(60)
+                scheduler.wait_frame(60)
 
             if not running:
                 break
 
             # Loading Bar
-            loading_duration = 7  # seconds
-            loading_start_time = time.time()
+            loading_duration = 7 / time_scale  # seconds
+            if dirty_rect_rendering:
+                # Draw the static layer once, the loop below only updates the growing bar
+                frame_start = time.perf_counter()
+                blit_trial_layer(cue_layer, trial_number)
+                pygame.display.flip()
+                metrics.observe('render_time', time.perf_counter() - frame_start)
+            # The epoch starts at the sample of the loading onset
+            loading_start_time = scheduler.begin('loading', loading_duration, trial_number)
+            epoch_saver.mark_onset(loading_start_time)
+            acquisition.mark('loading_start', loading_start_time)
 
-            while time.time() - loading_start_time < loading_duration:
+            while not scheduler.expired():
                 for event in pygame.event.get():
                     if event.type == pygame.QUIT:
                         running = False
@@ -942,65 +1189,35 @@ def main():
                             break
 
                 # Calculate loading bar progress
-                elapsed_time = time.time() - loading_start_time
-                loading_progress = elapsed_time / loading_duration
-
-                screen.fill(BLACK)
-                # Redraw green bars
-                pygame.draw.rect(screen, GREEN, (*left_green_bar_pos, green_bar_width, green_bar_height))
-                pygame.draw.rect(screen, GREEN, (*right_green_bar_pos, green_bar_width, green_bar_height))
-                # Redraw trial info
-                screen.blit(trial_info, trial_info_rect)
-
-                # Redraw Arrow
-                if direction == 'left':
-                    pygame.draw.polygon(screen, arrow_color, [
-                        (center_pos[0] - arrow_length, center_pos[1] - arrow_y_offset),
-                        (center_pos[0], center_pos[1] - arrow_y_offset - arrow_width),
-                        (center_pos[0], center_pos[1] - arrow_y_offset + arrow_width)
-                    ])
-                    # Calculate current length of the loading bar
-                    # From center to left green bar
-                    max_length = center_pos[0] - (left_green_bar_pos[0] + green_bar_width)
-                    current_length = loading_progress * max_length
-
-                    # Draw loading bar moving left from center
-                    pygame.draw.rect(screen, WHITE, (
-                        center_pos[0] - current_length,  # Start at center and move left
-                        center_pos[1] - loading_bar_thickness // 2,
-                        current_length,
-                        loading_bar_thickness
-                    ))
+                elapsed_time = loading_duration - scheduler.remaining()
+                loading_progress = min(elapsed_time / loading_duration, 1.0)
+
+                frame_start = time.perf_counter()
+                bar_rect = loading_bar_rect(direction, loading_progress)
+                if dirty_rect_rendering:
+                    # The static layer is already on screen, only push the region of the bar
+                    pygame.draw.rect(screen, WHITE, bar_rect)
+                    pygame.display.update(bar_rect)
                 else:
-                    pygame.draw.polygon(screen, arrow_color, [
-                        (center_pos[0] + arrow_length, center_pos[1] - arrow_y_offset),
-                        (center_pos[0], center_pos[1] - arrow_y_offset - arrow_width),
-                        (center_pos[0], center_pos[1] - arrow_y_offset + arrow_width)
-                    ])
-                    # Calculate current length of the loading bar
-                    # From center to right green bar
-                    max_length = (right_green_bar_pos[0]) - center_pos[0]
-                    current_length = loading_progress * max_length
-
-                    # Draw loading bar moving right from center
-                    pygame.draw.rect(screen, WHITE, (
-                        center_pos[0],  # Start at center and move right
-                        center_pos[1] - loading_bar_thickness // 2,
-                        current_length,
-                        loading_bar_thickness
-                    ))
-
-                pygame.display.flip()
-                save_data(eeg_processor, metadata, direction, trial_number, directory)
-                clock.tick(60)
+                    # Redraw green bars, trial info, arrow and the bar, then flip the whole screen
+                    blit_trial_layer(cue_layer, trial_number)
+                    pygame.draw.rect(screen, WHITE, bar_rect)
+                    pygame.display.flip()
+                metrics.observe('render_time', time.perf_counter() - frame_start)
+                scheduler.wait_frame(60)
 
             if not running:
                 break
 
+            # Save the [onset, onset + 7 s] epoch once, the saver waits for the last samples to arrive
+            epoch_saver.mark_offset()
+            acquisition.mark('loading_end')
+            epoch_saver.finish_trial(metadata, direction, trial_number, directory)
+
             # Optional rest period with accessible menu
-            rest_duration = 2  # seconds
-            rest_start_time = time.time()
-            while time.time() - rest_start_time < rest_duration:
+            rest_duration = 2 / time_scale  # seconds
+            acquisition.mark('rest', scheduler.begin('rest', rest_duration, trial_number))
+            while not scheduler.expired():
                 for event in pygame.event.get():
                     if event.type == pygame.QUIT:
                         running = False
@@ -1013,19 +1230,16 @@ def main():
                             in_trial_menu = True
                             break
 
-                # Display Rest Text with Menu Instruction
-                screen.fill(BLACK)
-                # Redraw green bars
-                pygame.draw.rect(screen, GREEN, (*left_green_bar_pos, green_bar_width, green_bar_height))
-                pygame.draw.rect(screen, GREEN, (*right_green_bar_pos, green_bar_width, green_bar_height))
-                # Redraw trial info
-                screen.blit(trial_info, trial_info_rect)
+                # Display Rest Text with Menu Instruction over green bars and trial info
+                frame_start = time.perf_counter()
+                blit_trial_layer(trial_layer, trial_number)
 
-                rest_text = small_font.render("Rest (Press M for Menu)", True, WHITE)
+                rest_text = text_cache.render(small_font, "Rest (Press M for Menu)", True, WHITE)
                 rest_rect = rest_text.get_rect(center=center_pos)
                 screen.blit(rest_text, rest_rect)
                 pygame.display.flip()
-                clock.tick(60)
+                metrics.observe('render_time', time.perf_counter() - frame_start)
+                scheduler.wait_frame(60)
 
             if not running:
                 break
@@ -1043,35 +1257,41 @@ def main():
             if trial_number > total_trials:
                 # Display a completion message
                 screen.fill(BLACK)
-                completion_text = medium_font.render("All Trials Completed!", True, GREEN)
+                completion_text = text_cache.render(medium_font, "All Trials Completed!", True, GREEN)
                 completion_rect = completion_text.get_rect(center=center_pos)
                 screen.blit(completion_text, completion_rect)
                 pygame.display.flip()
                 # Wait for 3 seconds before returning to menu
-                time.sleep(3)
+                acquisition.mark('session_end')
+                time.sleep(3 / time_scale)
                 trial_number = 1  # Reset trial number
                 in_after_session_menu = True
 
         # Handle Trial Menu outside the main loop to avoid missing quit events
+        if in_trial_menu and running:
+            acquisition.mark('menu_pause')
         while in_trial_menu and running:
-            # Display Trial Menu (Accessible via 'M' during trials)
-            screen.fill(BLACK)
-            menu_title = medium_font.render("Trial Menu", True, WHITE)
-            quit_text = medium_font.render("Press Q to Quit", True, RED)
-            resume_text = medium_font.render("Press R to Resume", True, GREEN)
-
-            # Positioning Text
-            menu_title_rect = menu_title.get_rect(center=(infoObject.current_w // 2, infoObject.current_h // 3))
-            quit_rect = quit_text.get_rect(center=(infoObject.current_w // 2, infoObject.current_h // 2))
-            resume_rect = resume_text.get_rect(center=(infoObject.current_w // 2, infoObject.current_h // 2 + 100))
-
-            # Blit Text to Screen
-            screen.blit(menu_title, menu_title_rect)
-            screen.blit(quit_text, quit_rect)
-            screen.blit(resume_text, resume_rect)
-            pygame.display.flip()
+            quality = acquisition.get_quality()
+            if idle_screen.changed(('trial_menu', tuple(quality))):
+                # Display Trial Menu (Accessible via 'M' during trials)
+                screen.fill(BLACK)
+                menu_title = text_cache.render(medium_font, "Trial Menu", True, WHITE)
+                quit_text = text_cache.render(medium_font, "Press Q to Quit", True, RED)
+                resume_text = text_cache.render(medium_font, "Press R to Resume", True, GREEN)
+
+                # Positioning Text
+                menu_title_rect = menu_title.get_rect(center=(infoObject.current_w // 2, infoObject.current_h // 3))
+                quit_rect = quit_text.get_rect(center=(infoObject.current_w // 2, infoObject.current_h // 2))
+                resume_rect = resume_text.get_rect(center=(infoObject.current_w // 2, infoObject.current_h // 2 + 100))
+
+                # Blit Text to Screen
+                screen.blit(menu_title, menu_title_rect)
+                screen.blit(quit_text, quit_rect)
+                screen.blit(resume_text, resume_rect)
+                draw_quality_strip(screen, quality, infoObject.current_h * 3 // 4)
+                pygame.display.flip()
 
-            for event in pygame.event.get():
+            for event in idle_screen.events():
                 if event.type == pygame.QUIT:
                     running = False
                     in_trial_menu = False
@@ -1081,7 +1301,23 @@ def main():
                         in_trial_menu = False
                     elif event.key == pygame.K_r:
                         in_trial_menu = False
+                        acquisition.mark('menu_resume')
+                        scheduler.rebase()
+
+    epoch_saver.flush()
+    acquisition.stop_recording()
+    if session_archive is not None:
+        # Leave a valid archive behind if the session was quit early
+        session_archive.close([os.path.join(DATA_DIR, directory, name) for name in SESSION_FILES])
+    acquisition.stop()
+    upload_queue.stop()
+    save_upload_timing(upload_queue, pending_upload_timing, final=True)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="EEG motor imagery data collection")
+    parser.add_argument('--playback', default=None,
+                        help="Replay the raw recording of this session directory instead of streaming from the board")
+    parser.add_argument('--speed', type=float, default=1.0, help="Playback speed, as a multiple of real time")
+    args = parser.parse_args()
+    main(PlaybackSource(args.playback, speed=args.speed) if args.playback else None)
\ No newline at end of file
@@ -0,0 +1,207 @@
+import os
+import pickle
+import queue
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from session_store import LABELS, SessionStore, find_sessions, is_session_store, pickle_trial_paths
+
+
+class EpochDataset:
+    """
+    Iterates over the epochs of many recorded sessions in batches, for training, without loading them all.
+
+    sessions are session directories (session stores or pickle sessions, see session_store.find_sessions
+    to collect them). Every iteration is one pass over all trials and yields (epochs, labels, metadata)
+    batches: a (batch_size, n_channels, n_samples) array, the labels (session_store.LABELS, from the
+    trial table of a store or the left_/right_ prefix of a pickle file) and one dict per epoch with its
+    session, trial and direction.
+
+    Epochs are read lazily, from the memory-mapped epochs.dat of stores or one pickle at a time,
+    by workers background threads that keep up to prefetch batches ready. With shuffle, the order of
+    the sessions and of the trials within them is shuffled, and epochs go through a shuffle buffer
+    of shuffle_buffer epochs that mixes trials of different sessions. memory_budget (bytes) bounds the
+    epochs held at once in the shuffle buffer and the prefetched batches; the shuffle buffer is shrunk
+    to fit it. Epochs whose shape differs from the first one are skipped and counted in skipped.
+    """
+    def __init__(self, sessions, batch_size=32, shuffle=True, shuffle_buffer=1024, prefetch=2, workers=2,
+                 float32=True, memory_budget=None, drop_last=False, seed=None):
+        self.sessions = list(sessions)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.shuffle_buffer = shuffle_buffer if shuffle else 0
+        self.prefetch = prefetch
+        self.workers = workers
+        self.dtype = np.float32 if float32 else np.float64
+        self.memory_budget = memory_budget
+        self.drop_last = drop_last
+        self.seed = seed
+        self.passes = 0
+        self.skipped = 0
+
+        self.trials = self._index()
+        self.shape = None
+        for session in self.sessions:
+            if is_session_store(session):
+                store = SessionStore(session)
+                if len(store):
+                    self.shape = store.epochs.shape[1:]
+                    break
+        if self.shape is None and self.trials:
+            self.shape = self._load(self.trials[0])[0].shape
+
+        if memory_budget is not None and self.shape is not None:
+            epoch_bytes = int(np.prod(self.shape)) * np.dtype(self.dtype).itemsize
+            # Batches in the queue, the one being filled and the one handed out, and the epochs being loaded
+            batch_epochs = (self.prefetch + 2 + max(self.workers, 1)) * self.batch_size
+            if batch_epochs * epoch_bytes > memory_budget:
+                raise ValueError(f"memory_budget of {memory_budget} bytes can't hold {batch_epochs} epochs "
+                                 f"of {epoch_bytes} bytes, reduce batch_size or prefetch")
+            self.shuffle_buffer = max(0, min(self.shuffle_buffer, memory_budget // epoch_bytes - batch_epochs))
+
+    @classmethod
+    def from_directories(cls, roots, **kwargs):
+        """
+        Dataset of every session found under roots.
+        """
+        return cls(find_sessions(roots), **kwargs)
+
+    def _index(self):
+        """
+        Lists every trial as (session, kind, key, label, trial, direction, session name), key being
+        the index of the trial in a store or the path of its pickle file.
+        """
+        trials = []
+        for session in self.sessions:
+            name = os.path.basename(os.path.normpath(session))
+            if is_session_store(session):
+                store = SessionStore(session)
+                for index, row in enumerate(store.trials.itertuples(index=False)):
+                    trials.append((session, 'store', index, int(row.Label), row.Trial, row.Direction, name))
+            else:
+                for trial_num, direction, path in pickle_trial_paths(session):
+                    trials.append((session, 'pickle', path, LABELS[direction], trial_num, direction, name))
+        return trials
+
+    def __len__(self):
+        return len(self.trials)
+
+    def _load(self, trial, stores=None):
+        session, kind, key, label, trial_num, direction, name = trial
+        if kind == 'store':
+            if stores is None:
+                stores = {}
+            store = stores.get(session)
+            if store is None:
+                store = stores[session] = SessionStore(session)
+            epoch = np.asarray(store.epochs[key], dtype=self.dtype)
+        else:
+            with open(key, 'rb') as f:
+                sig, _ = pickle.load(f)
+            epoch = np.asarray(sig, dtype=self.dtype)
+        return epoch, label, {'session': name, 'trial': trial_num, 'direction': direction}
+
+    def _order(self, rng):
+        """
+        Trials of the pass in reading order: sessions and trials within sessions shuffled with shuffle,
+        trials of a session read together so a store's memory map is read mostly sequentially.
+        """
+        if not self.shuffle:
+            return list(self.trials)
+        by_session = {}
+        for trial in self.trials:
+            by_session.setdefault(trial[0], []).append(trial)
+        sessions = list(by_session.values())
+        rng.shuffle(sessions)
+        order = []
+        for trials in sessions:
+            rng.shuffle(trials)
+            order.extend(trials)
+        return order
+
+    def _batches(self, rng, stop):
+        """
+        Reads the epochs of one pass on worker threads and groups them into batches.
+        """
+        buffer = []
+        batch = []
+        stores = {}
+        order = self._order(rng)
+        # Load a few batches ahead on the worker threads, in order
+        step = max(self.batch_size, 1) * max(self.workers, 1)
+        with ThreadPoolExecutor(max(self.workers, 1)) as pool:
+            for start in range(0, len(order), step):
+                if stop.is_set():
+                    return
+                for epoch, label, metadata in pool.map(lambda t: self._load(t, stores), order[start:start + step]):
+                    if epoch.shape != self.shape:
+                        self.skipped += 1
+                        continue
+                    item = (epoch, label, metadata)
+                    if self.shuffle_buffer > 0:
+                        # Hand out a random epoch of the buffer once it is full
+                        if len(buffer) < self.shuffle_buffer:
+                            buffer.append(item)
+                            continue
+                        i = rng.randrange(len(buffer))
+                        item, buffer[i] = buffer[i], item
+                    batch.append(item)
+                    if len(batch) == self.batch_size:
+                        yield batch
+                        batch = []
+        rng.shuffle(buffer)
+        for item in buffer:
+            batch.append(item)
+            if len(batch) == self.batch_size:
+                yield batch
+                batch = []
+        if batch and not self.drop_last:
+            yield batch
+
+    @staticmethod
+    def _put(batches, item, stop):
+        """
+        Queues item unless the consumer stops first, returns False if it did.
+        """
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _produce(self, rng, batches, stop):
+        try:
+            for batch in self._batches(rng, stop):
+                epochs = np.stack([epoch for epoch, _, _ in batch])
+                labels = np.array([label for _, label, _ in batch])
+                metadata = [m for _, _, m in batch]
+                if not self._put(batches, (epochs, labels, metadata), stop):
+                    return
+            self._put(batches, None, stop)
+        except Exception as e:
+            self._put(batches, e, stop)
+
+    def __iter__(self):
+        # Every pass is shuffled differently, reproducibly with a seed
+        rng = random.Random(None if self.seed is None else self.seed * 1000 + self.passes)
+        self.passes += 1
+        batches = queue.Queue(maxsize=max(self.prefetch, 1))
+        stop = threading.Event()
+        producer = threading.Thread(target=self._produce, args=(rng, batches, stop), name="EpochDataset",
+                                    daemon=True)
+        producer.start()
+        try:
+            while True:
+                batch = batches.get()
+                if batch is None:
+                    return
+                if isinstance(batch, Exception):
+                    raise batch
+                yield batch
+        finally:
+            # The consumer can stop early, the producer then stops at its next batch
+            stop.set()
+            producer.join()
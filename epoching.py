@@ -0,0 +1,98 @@
+import queue
+import threading
+import time
+from telemetry import metrics
+
+
+class EpochSaver(threading.Thread):
+    """
+    Background thread that cuts one epoch per trial out of the processed stream and saves it once.
+
+    The trial loop calls mark_onset() when the cue appears and finish_trial() when the loading bar
+    ends. The saver then waits until the acquisition worker has received every sample of
+    [onset, onset + epoch_duration], extracts exactly that window and passes it to save_fn,
+    which is called as save_fn(sig, metadata, direction, trial_num, directory, trial_info) where
+    trial_info holds the onset time, the onset/offset sample indices and the signal quality flags of
+    every channel during the epoch.
+    """
+    def __init__(self, acquisition, save_fn, epoch_duration=7, timeout=5.0):
+        super().__init__(name="EpochSaver", daemon=True)
+        self.acquisition = acquisition
+        self.save_fn = save_fn
+        self.epoch_samples = int(epoch_duration * acquisition.eeg_processor.sampling_rate)
+        self.timeout = timeout  # seconds to wait for the last samples of an epoch to arrive
+        self.onset_time = None
+        self.offset_time = None
+
+        # One record per finished trial with its onset/offset sample indices and what save_fn returned
+        self.records = []
+        self._jobs = queue.Queue()
+
+        # Optional SessionArchive that is synced after every saved trial
+        self.archive = None
+
+    def mark_onset(self, onset_time=None):
+        """
+        Records the stimulus onset of the current trial (defaults to now).
+        """
+        self.onset_time = time.time() if onset_time is None else onset_time
+        self.offset_time = None
+
+    def mark_offset(self, offset_time=None):
+        """
+        Records the stimulus offset of the current trial (defaults to now).
+        """
+        self.offset_time = time.time() if offset_time is None else offset_time
+
+    def finish_trial(self, metadata, direction, trial_num, directory):
+        """
+        Queues the current trial to be extracted and saved once all of its samples have arrived.
+        """
+        if self.onset_time is None:
+            raise RuntimeError("finish_trial() called before mark_onset()")
+        if self.offset_time is None:
+            self.mark_offset()
+        self._jobs.put((self.onset_time, self.offset_time, metadata, direction, trial_num, directory))
+        self.onset_time = None
+        self.offset_time = None
+
+    def flush(self):
+        """
+        Blocks until every queued trial has been saved or dropped.
+        """
+        self._jobs.join()
+
+    def run(self):
+        while True:
+            job = self._jobs.get()
+            try:
+                self._save(*job)
+            except Exception as e:
+                print(f"Could not save trial {job[4]} ({job[3]}): {e}")
+            finally:
+                self._jobs.task_done()
+
+    def _save(self, onset_time, offset_time, metadata, direction, trial_num, directory):
+        deadline = time.time() + self.timeout
+        while True:
+            epoch = self.acquisition.get_epoch(onset_time, self.epoch_samples)
+            if epoch is not None:
+                break
+            if time.time() > deadline:
+                raise TimeoutError("the samples of the epoch never arrived")
+            time.sleep(self.acquisition.poll_interval)
+
+        sig, onset_sample = epoch
+        trial_info = {
+            'OnsetTime': onset_time,
+            'OnsetSample': onset_sample,
+            'OffsetSample': self.acquisition.get_sample_index(offset_time),
+            'ChannelFlags': self.acquisition.get_trial_quality(onset_sample, onset_sample + self.epoch_samples),
+        }
+        with metrics.timer('save_time'):
+            saved = self.save_fn(sig, metadata, direction, trial_num, directory, trial_info)
+        metrics.count('trials_saved' if saved is not None else 'trials_rejected')
+        self.records.append({'Trial': trial_num, 'Direction': direction, **trial_info, 'Saved': saved})
+        if self.archive is not None:
+            with metrics.timer('archive_sync_time'):
+                self.archive.sync()
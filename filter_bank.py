@@ -0,0 +1,130 @@
+import numpy as np
+from scipy.signal import butter, sosfilt, sosfilt_zi, sosfiltfilt, tf2ss
+
+# 4 Hz sub-bands of the mu and beta rhythms from 8 to 30 Hz, every 2 Hz so neighbouring bands overlap by half
+DEFAULT_BANDS = tuple((low, low + 4) for low in range(8, 27, 2))
+
+
+def _state_space(sos):
+    """
+    State-space realization (A, B, C, D) of a cascade of second-order sections, built section by
+    section so it stays as well conditioned as the sections themselves.
+    """
+    A, B, C, D = tf2ss(sos[0, :3], sos[0, 3:])
+    for section in sos[1:]:
+        A2, B2, C2, D2 = tf2ss(section[:3], section[3:])
+        # The output of the cascade so far is the input of the next section
+        A = np.block([[A, np.zeros((A.shape[0], A2.shape[1]))], [B2 @ C, A2]])
+        B = np.vstack((B, B2 @ D))
+        C = np.hstack((D2 @ C, C2))
+        D = D2 @ D
+    return A, B, C, D
+
+
+class FilterBank:
+    """
+    Stateful bank of bandpass filters that splits multi-channel EEG into sub-bands.
+
+    Every band is a Butterworth bandpass as second-order sections. For streaming, the cascade of each
+    band is turned into a state-space system and the bands are stacked: a chunk of L samples is then
+    filtered in every band and channel at once with four batched matrix products, output = O @ state +
+    T @ chunk and state = A^L @ state + R @ chunk, where T is the lower-triangular impulse response
+    matrix of each band. The matrices depend on L only and are built once per chunk length; longer
+    chunks are processed in blocks of max_block samples.
+
+    process() returns a (n_bands, n_channels, n_samples) array and carries the state over to the next
+    call, so consecutive chunks are filtered as one continuous signal. apply() filters a whole recording
+    or a stack of epochs offline.
+    """
+    def __init__(self, n_channels, sampling_rate, bands=DEFAULT_BANDS, order=4, max_block=32):
+        self.n_channels = n_channels
+        self.sampling_rate = sampling_rate
+        self.bands = tuple(tuple(band) for band in bands)
+        self.max_block = max_block
+
+        # Design the coefficients once
+        self.sos = [butter(order, band, btype='band', fs=sampling_rate, output='sos') for band in self.bands]
+        systems = [_state_space(sos) for sos in self.sos]
+        self.A = np.stack([A for A, _, _, _ in systems])
+        self.B = np.stack([B for _, B, _, _ in systems])
+        self.C = np.stack([C for _, _, C, _ in systems])
+        self.D = np.stack([D for _, _, _, D in systems])
+        n_states = self.A.shape[1]
+        # Steady state reached with a unit constant input, scaled by the first sample like StreamingFilter
+        self._state_step = np.linalg.solve(np.eye(n_states) - self.A, self.B)
+        self._blocks = {}
+        self.state = None
+
+    def reset(self):
+        """
+        Forgets the filter state. The next call to process() starts the filters again.
+        """
+        self.state = None
+
+    def _block_matrices(self, n_samples):
+        matrices = self._blocks.get(n_samples)
+        if matrices is not None:
+            return matrices
+        n_bands, n_states, _ = self.A.shape
+        # powers[k] = A^k for k = 0..n_samples
+        powers = np.empty((n_samples + 1, n_bands, n_states, n_states))
+        powers[0] = np.eye(n_states)
+        for k in range(n_samples):
+            powers[k + 1] = powers[k] @ self.A
+        # Response to the initial state: C A^k
+        observe = np.einsum('bij,kbjl->bkl', self.C, powers[:n_samples])
+        # Impulse response: D, then C A^(k-1) B
+        impulse = np.empty((n_bands, n_samples))
+        impulse[:, 0] = self.D[:, 0, 0]
+        impulse[:, 1:] = (observe[:, :n_samples - 1] @ self.B)[:, :, 0]
+        lags = np.subtract.outer(np.arange(n_samples), np.arange(n_samples))
+        toeplitz = np.where(lags >= 0, impulse[:, np.clip(lags, 0, None)], 0.0)
+        # State after the block: A^L state + sum of A^(L-1-j) B u_j
+        reach = np.einsum('kbij,bjl->bik', powers[n_samples - 1::-1], self.B)
+        matrices = (observe, toeplitz, powers[n_samples], reach)
+        self._blocks[n_samples] = matrices
+        return matrices
+
+    def process(self, chunk):
+        """
+        Filters a (n_channels, n_samples) chunk of new samples into every band.
+
+        Returns a (n_bands, n_channels, n_samples) array.
+        """
+        n_samples = chunk.shape[1]
+        output = np.empty((len(self.bands), self.n_channels, n_samples))
+        if n_samples == 0:
+            return output
+        if self.state is None:
+            # Start from the steady state of the first sample to avoid a step transient from the DC offset
+            self.state = self._state_step * chunk[:, 0]
+
+        for start in range(0, n_samples, self.max_block):
+            block = chunk[:, start:start + self.max_block]
+            observe, toeplitz, power, reach = self._block_matrices(block.shape[1])
+            samples = block.T
+            # (n_bands, L, n_channels)
+            filtered = observe @ self.state + toeplitz @ samples
+            self.state = power @ self.state + reach @ samples
+            output[:, :, start:start + block.shape[1]] = filtered.transpose(0, 2, 1)
+        return output
+
+    def apply(self, data, zero_phase=False):
+        """
+        Filters data offline along its last axis, e.g. a (n_channels, n_samples) recording or a
+        (n_trials, n_channels, n_samples) stack of epochs, and returns an array with the bands first:
+        (n_bands, *data.shape). Each signal starts from the steady state of its first sample, like
+        process(), and the streaming state is left untouched.
+
+        On whole recordings scipy's sosfilt per band is faster than the block matrices, which pay off
+        on the short chunks of streaming. zero_phase filters forward and backward (sosfiltfilt) instead.
+        """
+        output = np.empty((len(self.bands),) + data.shape)
+        for i, sos in enumerate(self.sos):
+            if zero_phase:
+                output[i] = sosfiltfilt(sos, data, axis=-1)
+            else:
+                zi = sosfilt_zi(sos).reshape((sos.shape[0],) + (1,) * (data.ndim - 1) + (2,)) * \
+                    data[np.newaxis, ..., 0, np.newaxis]
+                output[i], _ = sosfilt(sos, data, axis=-1, zi=zi)
+        return output
@@ -0,0 +1,51 @@
+import pygame
+
+# Events that never change what a screen shows
+IGNORED_EVENTS = {pygame.MOUSEMOTION, pygame.ACTIVEEVENT, pygame.WINDOWENTER, pygame.WINDOWLEAVE}
+
+
+class IdleScreen:
+    """
+    Pacing for screens that only change on user input (menus, questionnaire, buffer screen).
+
+    Instead of redrawing and flipping as fast as the CPU allows, an idle screen blocks in events()
+    until input arrives or timeout_ms passes, and is only redrawn when changed() says so: when the
+    screen shows a different state than the last one drawn, or when input arrived since then.
+    Screens showing a countdown or a progress pass that value in the state, so they are redrawn when
+    it changes and otherwise sleep.
+
+    Code that draws to the screen without going through changed() (the trial phases) has to call
+    invalidate() so the next idle screen is drawn again.
+    """
+    def __init__(self, timeout_ms=100):
+        self.timeout_ms = timeout_ms
+        self.frames = 0
+        self._state = None
+        self._dirty = True
+
+    def invalidate(self):
+        self._dirty = True
+
+    def changed(self, state):
+        """
+        Returns True if the screen has to be drawn for this state, the caller then draws and flips.
+        state is any comparable value that identifies what the screen shows, e.g. ('menu', total_trials).
+        """
+        if not self._dirty and state == self._state:
+            return False
+        self._state = state
+        self._dirty = False
+        self.frames += 1
+        return True
+
+    def events(self, timeout_ms=None):
+        """
+        Waits for the next event, or at most timeout_ms, and returns it with every other queued event.
+        """
+        event = pygame.event.wait(self.timeout_ms if timeout_ms is None else timeout_ms)
+        events = [] if event.type == pygame.NOEVENT else [event]
+        events.extend(pygame.event.get())
+        for event in events:
+            if event.type not in IGNORED_EVENTS:
+                self._dirty = True
+        return events
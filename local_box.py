@@ -0,0 +1,168 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+
+class LocalBoxClient:
+    """
+    Stand-in for boxsdk.Client that keeps "Box" files in a local directory.
+
+    It implements the subset of the Box API used by the GUI and the upload queue: downloading,
+    uploading and updating files, and chunked uploads through upload sessions. Files uploaded to
+    folder f are stored in root/f/. fail_next(n) makes the next n requests raise, to exercise retries.
+    """
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._index_path = os.path.join(root, 'index.json')
+        self._lock = threading.Lock()
+        if os.path.exists(self._index_path):
+            with open(self._index_path) as f:
+                self._index = json.load(f)
+        else:
+            self._index = {'files': {}, 'sessions': {}, 'next_id': 1}
+        self._failures = 0
+        self.requests = 0
+
+    def fail_next(self, n=1):
+        self._failures += n
+
+    def folder(self, folder_id):
+        return _LocalFolder(self, str(folder_id))
+
+    def file(self, file_id):
+        return _LocalFile(self, str(file_id))
+
+    def upload_session(self, session_id):
+        session = self._index['sessions'].get(str(session_id))
+        if session is None:
+            raise KeyError(f"Upload session {session_id} does not exist")
+        return _LocalUploadSession(self, str(session_id), session['folder_id'], session['file_name'])
+
+    def add_file(self, folder_id, local_path, file_name=None, file_id=None):
+        """
+        Copies local_path into the fake Box folder and returns its file ID, which can be chosen with file_id.
+        """
+        return self._store(str(folder_id), local_path, file_name or os.path.basename(local_path), file_id)
+
+    def _request(self):
+        with self._lock:
+            self.requests += 1
+            if self._failures > 0:
+                self._failures -= 1
+                raise ConnectionError("Simulated Box request failure")
+
+    def _next_id(self):
+        file_id = str(self._index['next_id'])
+        self._index['next_id'] += 1
+        return file_id
+
+    def _save_index(self):
+        with open(self._index_path, 'w') as f:
+            json.dump(self._index, f, indent=2)
+
+    def _file(self, file_id):
+        return _LocalFile(self, file_id, self._index['files'][file_id]['name'])
+
+    def _path(self, file_id):
+        entry = self._index['files'][file_id]
+        return os.path.join(self.root, entry['folder_id'], entry['name'])
+
+    def _store(self, folder_id, local_path, file_name, file_id=None):
+        with self._lock:
+            os.makedirs(os.path.join(self.root, folder_id), exist_ok=True)
+            shutil.copyfile(local_path, os.path.join(self.root, folder_id, file_name))
+            file_id = self._next_id() if file_id is None else str(file_id)
+            self._index['files'][file_id] = {'folder_id': folder_id, 'name': file_name}
+            self._save_index()
+            return file_id
+
+
+class _LocalItem:
+    def __init__(self, client, object_id, name=None):
+        self.id = object_id
+        self.name = name
+        self._client = client
+
+
+class _LocalFolder(_LocalItem):
+    def upload(self, file_path, file_name=None):
+        self._client._request()
+        file_name = file_name or os.path.basename(file_path)
+        return self._client._file(self._client._store(self.id, file_path, file_name))
+
+    def get_chunked_uploader(self, file_path, file_name=None):
+        file_name = file_name or os.path.basename(file_path)
+        return self.create_upload_session(os.path.getsize(file_path), file_name).get_chunked_uploader(file_path)
+
+    def create_upload_session(self, file_size, file_name):
+        self._client._request()
+        with self._client._lock:
+            session_id = 'session_' + self._client._next_id()
+            self._client._index['sessions'][session_id] = {'folder_id': self.id, 'file_name': file_name}
+            self._client._save_index()
+        return _LocalUploadSession(self._client, session_id, self.id, file_name)
+
+
+class _LocalFile(_LocalItem):
+    def get(self):
+        self._client._request()
+        self.name = self._client._index['files'][self.id]['name']
+        with open(self._client._path(self.id), 'rb') as f:
+            self.sha1 = hashlib.sha1(f.read()).hexdigest()
+        return self
+
+    def download_to(self, stream):
+        with open(self._client._path(self.id), 'rb') as f:
+            shutil.copyfileobj(f, stream)
+
+    def update_contents(self, file_path):
+        with open(file_path, 'rb') as f:
+            return self.update_contents_with_stream(f)
+
+    def update_contents_with_stream(self, stream):
+        self._client._request()
+        with open(self._client._path(self.id), 'wb') as f:
+            shutil.copyfileobj(stream, f)
+        return self._client._file(self.id)
+
+
+class _LocalUploadSession(_LocalItem):
+    def __init__(self, client, session_id, folder_id, file_name):
+        super().__init__(client, session_id)
+        self.folder_id = folder_id
+        self.file_name = file_name
+
+    def get_chunked_uploader(self, file_path):
+        return _LocalChunkedUploader(self, file_path)
+
+
+class _LocalChunkedUploader:
+    """
+    Uploads a file in fixed-size parts, resume() continues after the last uploaded part.
+    """
+    part_size = 8 * 1024 * 1024
+
+    def __init__(self, upload_session, file_path):
+        self._session = upload_session
+        self._client = upload_session._client
+        self._file_path = file_path
+        self._part_path = os.path.join(self._client.root, upload_session.id + '.part')
+
+    def start(self):
+        if os.path.exists(self._part_path):
+            os.remove(self._part_path)
+        return self.resume()
+
+    def resume(self):
+        uploaded = os.path.getsize(self._part_path) if os.path.exists(self._part_path) else 0
+        with open(self._file_path, 'rb') as src, open(self._part_path, 'ab') as dst:
+            src.seek(uploaded)
+            for part in iter(lambda: src.read(self.part_size), b''):
+                self._client._request()
+                dst.write(part)
+        file_id = self._client._store(self._session.folder_id, self._part_path, self._session.file_name)
+        os.remove(self._part_path)
+        return self._client._file(file_id)
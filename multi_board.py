@@ -0,0 +1,272 @@
+"""
+Concurrent collection from several boards, one acquisition process per board.
+
+Usage: python multi_board.py [--boards 1 2 4] [--seconds 5] [--speed 0] [--out DIR]
+"""
+import argparse
+import multiprocessing
+import os
+import queue
+import time
+
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+
+def make_source(spec):
+    """
+    Creates the board source described by spec, a dict with 'source' set to:
+      'brainflow': BrainFlow board spec['board_id'] (synthetic board by default), on spec['serial_port'] if given
+      'synthetic': board_source.SyntheticSource with spec['n_channels'], spec['sampling_rate'] and spec['speed']
+      'playback': board_source.PlaybackSource of the recording in spec['directory'] at spec['speed']
+    Sources are created in the worker process, BrainFlow boards can't be passed between processes.
+    """
+    from board_source import BrainFlowSource, PlaybackSource, SyntheticSource
+    kind = spec.get('source', 'brainflow')
+    if kind == 'brainflow':
+        from brainflow.board_shim import BoardIds
+        return BrainFlowSource(spec.get('board_id', BoardIds.SYNTHETIC_BOARD.value), spec.get('serial_port'))
+    if kind == 'synthetic':
+        return SyntheticSource(spec.get('n_channels', 16), spec.get('sampling_rate', 250), spec.get('speed', 1.0),
+                               seed=spec.get('seed', 0), chunk_size=spec.get('chunk_size'))
+    if kind == 'playback':
+        return PlaybackSource(spec['directory'], spec.get('speed', 1.0), loop=True)
+    raise ValueError(f"Unknown board source {kind}")
+
+
+def run_worker(name, spec, directory, start_event, stop_event, commands, health, health_interval, poll_interval):
+    """
+    Acquisition process of one board: drains and filters its stream, records it to directory if given,
+    inserts the markers it receives on commands, and reports its health every health_interval seconds.
+    """
+    from data_collection_gui import EEGProcessor
+    from session_recorder import SessionRecorder, EVENT_CODES
+
+    processor = None
+    recorder = None
+    try:
+        processor = EEGProcessor(make_source(spec))
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            recorder = SessionRecorder(directory, processor.board_id, processor.sampling_rate, processor.n_rows,
+                                       processor.eeg_channels, processor.timestamp_channel, processor.marker_channel)
+        health.put({'name': name, 'status': 'ready', 'pid': os.getpid()})
+
+        # Every board starts at the same time, what was streamed while the others got ready is dropped
+        while not start_event.wait(0.1):
+            if stop_event.is_set():
+                return
+        processor.board.get_board_data()
+        processor.recorder = recorder
+
+        samples = 0
+        reported_samples = 0
+        update_times = []
+        report_time = time.perf_counter()
+        report_cpu = time.process_time()
+        while not stop_event.is_set():
+            before = time.perf_counter()
+            samples += processor.update()
+            update_times.append(time.perf_counter() - before)
+
+            while True:
+                try:
+                    event = commands.get_nowait()
+                except queue.Empty:
+                    break
+                processor.board.insert_marker(EVENT_CODES[event])
+                if recorder is not None:
+                    recorder.mark(event)
+
+            now = time.perf_counter()
+            if now - report_time >= health_interval:
+                cpu = time.process_time()
+                health.put({
+                    'name': name,
+                    'status': 'running',
+                    'samples': samples,
+                    'samples_per_second': (samples - reported_samples) / (now - report_time),
+                    'update_ms_mean': 1e3 * sum(update_times) / len(update_times),
+                    'update_ms_max': 1e3 * max(update_times),
+                    'cpu_percent': 100 * (cpu - report_cpu) / (now - report_time),
+                    'time': time.time(),
+                })
+                reported_samples, report_time, report_cpu = samples, now, cpu
+                update_times = []
+
+            remaining = poll_interval - (time.perf_counter() - before)
+            if remaining > 0:
+                time.sleep(remaining)
+
+        samples += processor.update()
+        health.put({'name': name, 'status': 'stopped', 'samples': samples, 'time': time.time()})
+    except Exception as e:
+        health.put({'name': name, 'status': 'error', 'error': repr(e), 'time': time.time()})
+    finally:
+        if recorder is not None:
+            recorder.close()
+        if processor is not None:
+            processor.stop()
+
+
+class MultiBoardSupervisor:
+    """
+    Runs one acquisition process per board, so several participants can be recorded from one machine
+    and every board gets its own core for filtering and writing.
+
+    specs maps a board name to its source spec (see make_source). Every board is recorded to
+    data_dir/<name> if data_dir is given. start() launches the processes and waits until every board
+    is streaming, begin() starts all recordings together and stop() stops them. mark() inserts a
+    stimulus event in one or all boards, and health() returns the last report of every board:
+    its status, samples received and rate, update time and CPU use.
+    """
+    def __init__(self, specs, data_dir=None, health_interval=1.0, poll_interval=0.02):
+        self.specs = dict(specs)
+        self.data_dir = data_dir
+        self.health_interval = health_interval
+        self.poll_interval = poll_interval
+
+        # Spawned processes don't inherit the BrainFlow and pygame state of the parent
+        self._context = multiprocessing.get_context('spawn')
+        self._start_event = self._context.Event()
+        self._stop_event = self._context.Event()
+        self._health = self._context.Queue()
+        self._commands = {}
+        self.processes = {}
+        self.status = {}
+
+    def start(self, timeout=60):
+        """
+        Starts the worker processes and waits until every board is streaming.
+        Raises RuntimeError if a board fails to start.
+        """
+        for name, spec in self.specs.items():
+            directory = os.path.join(self.data_dir, name) if self.data_dir else None
+            self._commands[name] = self._context.Queue()
+            process = self._context.Process(
+                target=run_worker, name=f"board-{name}", daemon=True,
+                args=(name, spec, directory, self._start_event, self._stop_event, self._commands[name],
+                      self._health, self.health_interval, self.poll_interval))
+            process.start()
+            self.processes[name] = process
+
+        deadline = time.time() + timeout
+        while any(self.status.get(name, {}).get('status') != 'ready' for name in self.specs):
+            self.poll_health(timeout=max(0.0, deadline - time.time()))
+            failed = {name: s for name, s in self.status.items() if s['status'] in ('error', 'dead')}
+            if failed:
+                self.stop()
+                raise RuntimeError(f"Boards failed to start: {failed}")
+            if time.time() > deadline:
+                self.stop()
+                raise RuntimeError("Timed out waiting for the boards to start")
+
+    def begin(self):
+        """
+        Starts recording on every board at once.
+        """
+        self._start_event.set()
+
+    def mark(self, event, name=None):
+        """
+        Inserts a stimulus event (see session_recorder.EVENT_CODES) in one board, or in every board if name is None.
+        """
+        for board, commands in self._commands.items():
+            if name is None or board == name:
+                commands.put(event)
+
+    def poll_health(self, timeout=0.0):
+        """
+        Reads the pending health reports, waiting up to timeout seconds for the first one,
+        and marks boards whose process died without reporting it.
+        """
+        try:
+            report = self._health.get(timeout=timeout) if timeout > 0 else self._health.get_nowait()
+            while True:
+                self.status[report['name']] = report
+                report = self._health.get_nowait()
+        except queue.Empty:
+            pass
+        for name, process in self.processes.items():
+            last = self.status.get(name, {}).get('status')
+            if not process.is_alive() and process.exitcode not in (None, 0) and last not in ('error', 'dead'):
+                self.status[name] = {'name': name, 'status': 'dead', 'exitcode': process.exitcode}
+        return self.status
+
+    def health(self):
+        return dict(self.poll_health())
+
+    def stop(self, timeout=10):
+        """
+        Stops every board and waits for the processes to flush their recordings and exit.
+        """
+        self._stop_event.set()
+        deadline = time.time() + timeout
+        for process in self.processes.values():
+            process.join(max(0.0, deadline - time.time()))
+        for process in self.processes.values():
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        self.poll_health()
+        return self.status
+
+
+def measure(n_boards, seconds, speed, n_channels, sampling_rate, data_dir=None):
+    """
+    Runs n_boards NumPy synthetic boards for seconds and returns the final health report of each.
+    speed=None streams as fast as the workers can process. The rates, CPU and update times are None for
+    a board that hadn't reported running yet, e.g. with a short run or a slow process start.
+    """
+    specs = {f'board{i}': {'source': 'synthetic', 'n_channels': n_channels, 'sampling_rate': sampling_rate,
+                           'speed': speed, 'seed': i, 'chunk_size': sampling_rate} for i in range(n_boards)}
+    supervisor = MultiBoardSupervisor(specs, data_dir and os.path.join(data_dir, f'{n_boards}_boards'),
+                                      health_interval=seconds / 2, poll_interval=0 if speed is None else 0.02)
+    supervisor.start()
+    supervisor.begin()
+    begin = time.time()
+    time.sleep(seconds)
+    running = supervisor.health()
+    status = supervisor.stop()
+    elapsed = time.time() - begin
+    results = {}
+    for name in specs:
+        report = running.get(name, {})
+        if report.get('status') != 'running':
+            report = {'status': report.get('status', 'not started'), 'samples_per_second': None,
+                      'cpu_percent': None, 'update_ms_max': None}
+        results[name] = {**report, 'total_samples': status.get(name, {}).get('samples'), 'seconds': elapsed,
+                         'cpu_count': os.cpu_count()}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[1])
+    parser.add_argument('--boards', type=int, nargs='+', default=[1, 2, 4], help="Numbers of boards to run")
+    parser.add_argument('--seconds', type=float, default=5, help="Seconds to run each configuration")
+    parser.add_argument('--speed', type=float, default=0,
+                        help="Stream speed as a multiple of real time, 0 streams as fast as possible")
+    parser.add_argument('--channels', type=int, default=16)
+    parser.add_argument('--sampling-rate', type=int, default=250)
+    parser.add_argument('--out', default=None, help="Record every board under this directory")
+    args = parser.parse_args()
+
+    # The boards share the CPUs, so the scaling depends on how many there are
+    print(f"{os.cpu_count()} CPUs")
+    print(f"{'boards':>6} {'per-board samples/s':>20} {'min':>10} {'CPU % per board':>16} {'update ms max':>14} "
+          f"{'not reporting':>14}")
+    for n_boards in args.boards:
+        results = measure(n_boards, args.seconds, args.speed or None, args.channels, args.sampling_rate, args.out)
+        reported = [r for r in results.values() if r['samples_per_second'] is not None]
+        missing = len(results) - len(reported)
+        if not reported:
+            print(f"{n_boards:>6} {'-':>20} {'-':>10} {'-':>16} {'-':>14} {missing:>14}")
+            continue
+        rates = [r['samples_per_second'] for r in reported]
+        cpu = [r['cpu_percent'] for r in reported]
+        update_max = max(r['update_ms_max'] for r in reported)
+        print(f"{n_boards:>6} {sum(rates) / len(rates):>20.0f} {min(rates):>10.0f} {sum(cpu) / len(cpu):>16.0f} "
+              f"{update_max:>14.2f} {missing:>14}")
+
+
+if __name__ == '__main__':
+    main()
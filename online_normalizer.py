@@ -0,0 +1,148 @@
+import numpy as np
+from ring_buffer import RingBuffer
+
+
+def _chunk_stats(chunk, weights=None):
+    """
+    Returns the total weight, mean and sum of squared deviations of every channel of a chunk.
+    """
+    if weights is None:
+        mean = chunk.mean(axis=1)
+        deviations = chunk - mean[:, np.newaxis]
+        return chunk.shape[1], mean, np.einsum('ij,ij->i', deviations, deviations)
+    total = weights.sum()
+    mean = chunk @ weights / total
+    deviations = chunk - mean[:, np.newaxis]
+    return total, mean, (deviations * deviations) @ weights
+
+
+class OnlineNormalizer:
+    """
+    Z-scores a multi-channel stream with running per-channel statistics.
+
+    The mean and variance are kept as Welford statistics (weight, mean, sum of squared deviations)
+    and every chunk is merged in at once with Chan's formula, so an update costs O(new samples)
+    whatever the length of the history. The statistics cover, depending on the parameters:
+      - every sample seen (default)
+      - the last lookback samples: the samples that leave the window are removed with the inverse
+        formula, and the statistics are recomputed from the window once per window length to keep
+        rounding errors from accumulating
+      - every sample seen with exponential forgetting: the weight of a sample halves every half_life
+        samples
+
+    freeze() stops updating the statistics, so every later window is normalized the same way,
+    e.g. after a calibration period. freeze_after freezes them after that many samples.
+    """
+    def __init__(self, n_channels, lookback=None, half_life=None, freeze_after=None, min_std=1e-12):
+        if lookback is not None and half_life is not None:
+            raise ValueError("Give either lookback or half_life")
+        if freeze_after is not None and freeze_after <= 0:
+            raise ValueError(f"freeze_after has to be a positive number of samples, not {freeze_after}")
+        self.n_channels = n_channels
+        self.lookback = lookback
+        self.decay = None if half_life is None else 0.5 ** (1 / half_life)
+        self.freeze_after = freeze_after
+        self.min_std = min_std
+        self.window = RingBuffer(n_channels, lookback) if lookback is not None else None
+        self.reset()
+
+    def reset(self):
+        """
+        Forgets the statistics and unfreezes them.
+        """
+        self.count = 0.0
+        self.mean = np.zeros(self.n_channels)
+        self.m2 = np.zeros(self.n_channels)
+        self.samples_seen = 0
+        self.frozen = False
+        self._since_recompute = 0
+        if self.window is not None:
+            self.window.clear()
+
+    def freeze(self):
+        self.frozen = True
+
+    def unfreeze(self):
+        self.frozen = False
+
+    @property
+    def variance(self):
+        return self.m2 / self.count if self.count > 0 else np.ones(self.n_channels)
+
+    @property
+    def std(self):
+        std = np.sqrt(self.variance)
+        std[std < self.min_std] = 1
+        return std
+
+    def _merge(self, count, mean, m2):
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean = self.mean + delta * (count / total)
+        self.m2 = self.m2 + m2 + delta * delta * (self.count * count / total)
+        self.count = total
+
+    def _remove(self, count, mean, m2):
+        remaining = self.count - count
+        if remaining <= 0:
+            self.count, self.mean, self.m2 = 0.0, np.zeros(self.n_channels), np.zeros(self.n_channels)
+            return
+        new_mean = (self.count * self.mean - count * mean) / remaining
+        delta = mean - new_mean
+        self.m2 = np.maximum(self.m2 - m2 - delta * delta * (remaining * count / self.count), 0)
+        self.mean = new_mean
+        self.count = remaining
+
+    def _recompute(self):
+        self.count, self.mean, self.m2 = _chunk_stats(self.window.latest())
+        self._since_recompute = 0
+
+    def update(self, chunk):
+        """
+        Adds a (n_channels, n_samples) chunk to the statistics, unless they are frozen.
+        """
+        if self.frozen or chunk.shape[1] == 0:
+            return
+        if self.freeze_after is not None:
+            chunk = chunk[:, :self.freeze_after - self.samples_seen]
+        n_samples = chunk.shape[1]
+
+        if self.window is not None:
+            if n_samples >= self.lookback:
+                self.window.append(chunk)
+                self._recompute()
+            else:
+                evicted = len(self.window) + n_samples - self.lookback
+                if evicted > 0:
+                    oldest = self.window.total_written - len(self.window)
+                    self._remove(*_chunk_stats(self.window.get_range(oldest, oldest + evicted)))
+                self.window.append(chunk)
+                self._merge(*_chunk_stats(chunk))
+                self._since_recompute += n_samples
+                if self._since_recompute >= self.lookback:
+                    self._recompute()
+        elif self.decay is not None:
+            # Older samples, and the samples at the start of the chunk, weigh less
+            decay = self.decay ** n_samples
+            self.count *= decay
+            self.m2 = self.m2 * decay
+            self._merge(*_chunk_stats(chunk, self.decay ** np.arange(n_samples - 1, -1, -1)))
+        else:
+            self._merge(*_chunk_stats(chunk))
+
+        self.samples_seen += n_samples
+        if self.freeze_after is not None and self.samples_seen >= self.freeze_after:
+            self.frozen = True
+
+    def transform(self, chunk):
+        """
+        Returns the chunk z-scored with the current statistics.
+        """
+        return (chunk - self.mean[:, np.newaxis]) / self.std[:, np.newaxis]
+
+    def process(self, chunk):
+        """
+        Adds a chunk of new samples to the statistics, then returns it z-scored.
+        """
+        self.update(chunk)
+        return self.transform(chunk)
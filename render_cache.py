@@ -0,0 +1,74 @@
+from collections import OrderedDict
+import pygame
+
+
+class TextCache:
+    """
+    LRU cache of rendered text surfaces.
+
+    render() takes the same arguments as pygame.font.Font.render, with the font first, and only calls
+    the font's renderer the first time a (font, text, antialias, color, background) combination is seen.
+    The least recently used surfaces are dropped once max_size surfaces are cached.
+    """
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self._surfaces = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, font, text, antialias, color, background=None):
+        key = (font, text, antialias, tuple(color), None if background is None else tuple(background))
+        surface = self._surfaces.get(key)
+        if surface is not None:
+            self._surfaces.move_to_end(key)
+            self.hits += 1
+            return surface
+
+        self.misses += 1
+        if background is None:
+            surface = font.render(text, antialias, color)
+        else:
+            surface = font.render(text, antialias, color, background)
+        self._surfaces[key] = surface
+        if len(self._surfaces) > self.max_size:
+            self._surfaces.popitem(last=False)
+        return surface
+
+    def clear(self):
+        self._surfaces.clear()
+
+
+class LayerCache:
+    """
+    Cache of prebuilt static layers, one full-screen surface per screen.
+
+    get(key, draw) returns the layer for key, building it the first time by filling a new surface with
+    the background color and calling draw(surface). Drawing a screen then starts with a single blit
+    of its layer instead of redrawing every static element. Every layer is a full-screen surface
+    (8 MB at 1080p), so keys should only cover what is really static and max_size the layers reused.
+    """
+    def __init__(self, size, background=(0, 0, 0), max_size=4):
+        self.size = size
+        self.background = background
+        self.max_size = max_size
+        self._layers = OrderedDict()
+
+    def get(self, key, draw):
+        layer = self._layers.get(key)
+        if layer is not None:
+            self._layers.move_to_end(key)
+            return layer
+
+        layer = pygame.Surface(self.size)
+        if pygame.display.get_surface() is not None:
+            # Match the display's pixel format so blitting doesn't convert every pixel
+            layer = layer.convert()
+        layer.fill(self.background)
+        draw(layer)
+        self._layers[key] = layer
+        if len(self._layers) > self.max_size:
+            self._layers.popitem(last=False)
+        return layer
+
+    def clear(self):
+        self._layers.clear()
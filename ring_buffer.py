@@ -0,0 +1,74 @@
+import numpy as np
+
+
+class RingBuffer:
+    """
+    Fixed-capacity circular buffer for multi-channel samples.
+
+    The samples live in one preallocated (n_channels, capacity) array with a write cursor that
+    wraps around, so appending never reallocates. Samples are also counted with an absolute index
+    (total_written) so a range of samples can be requested by where it occurred in the stream.
+    """
+    def __init__(self, n_channels, capacity, dtype=np.float64):
+        self.n_channels = n_channels
+        self.capacity = capacity
+        self.data = np.zeros((n_channels, capacity), dtype=dtype)
+        self.write_pos = 0  # Column the next sample is written to
+        self.total_written = 0  # Number of samples appended since creation
+
+    def __len__(self):
+        return min(self.total_written, self.capacity)
+
+    def clear(self):
+        self.write_pos = 0
+        self.total_written = 0
+
+    def append(self, chunk):
+        """
+        Appends a (n_channels, n_samples) chunk, overwriting the oldest samples once the buffer is full.
+        """
+        n_samples = chunk.shape[1]
+        if n_samples == 0:
+            return
+        if n_samples >= self.capacity:
+            # Only the newest samples fit
+            self.data[:, :] = chunk[:, -self.capacity:]
+            self.write_pos = 0
+        else:
+            first = min(n_samples, self.capacity - self.write_pos)
+            self.data[:, self.write_pos:self.write_pos + first] = chunk[:, :first]
+            if first < n_samples:
+                # Wrap around to the start of the array
+                self.data[:, :n_samples - first] = chunk[:, first:]
+            self.write_pos = (self.write_pos + n_samples) % self.capacity
+        self.total_written += n_samples
+
+    def latest(self, n_samples=None):
+        """
+        Returns the newest n_samples samples in chronological order (all stored samples if None).
+
+        The result is a view into the buffer when the samples are contiguous in memory, otherwise a
+        single contiguous copy. Views are overwritten by later appends, copy them to keep them.
+        """
+        if n_samples is None or n_samples > len(self):
+            n_samples = len(self)
+        return self._slice((self.write_pos - n_samples) % self.capacity, n_samples)
+
+    def get_range(self, start, stop):
+        """
+        Returns the samples with absolute indices [start, stop) in chronological order.
+
+        Raises IndexError if part of the range has already been overwritten or not written yet.
+        """
+        oldest = self.total_written - len(self)
+        if start < oldest or stop > self.total_written or start > stop:
+            raise IndexError(f"Samples [{start}, {stop}) are not in the buffer, "
+                             f"it holds [{oldest}, {self.total_written})")
+        n_samples = stop - start
+        offset = self.total_written - start
+        return self._slice((self.write_pos - offset) % self.capacity, n_samples)
+
+    def _slice(self, first, n_samples):
+        if first + n_samples <= self.capacity:
+            return self.data[:, first:first + n_samples]
+        return np.concatenate((self.data[:, first:], self.data[:, :first + n_samples - self.capacity]), axis=1)
@@ -0,0 +1,184 @@
+import io
+import json
+import os
+import re
+import threading
+import time
+import zipfile
+import numpy as np
+
+# Compression method and valid levels of each codec
+CODECS = {
+    'store': (zipfile.ZIP_STORED, None),
+    'deflate': (zipfile.ZIP_DEFLATED, range(0, 10)),
+    'bzip2': (zipfile.ZIP_BZIP2, range(1, 10)),
+    'lzma': (zipfile.ZIP_LZMA, None),
+}
+
+# Growing session files are archived as numbered parts: epochs.dat.00000, epochs.dat.00001, ...
+PART_PATTERN = re.compile(r'(.+)\.(\d{5})$')
+# Suffix of the parts of a downcast file, its layout is in {arcname}.f32.json
+DOWNCAST_SUFFIX = '.f32'
+
+
+def _packed_layout(columns, keep):
+    """
+    Columns downcast to float32, columns kept as float64 and the record dtype of a downcast file.
+    """
+    keep = sorted(keep)
+    downcast = [column for column in range(columns) if column not in keep]
+    dtype = np.dtype([('downcast', '<f4', (len(downcast),)), ('keep', '<f8', (len(keep),))])
+    return downcast, keep, dtype
+
+
+class SessionArchive:
+    """
+    Zip archive of a session that is built while the session runs.
+
+    Files that grow during the session (the epoch store and the raw recording) are registered with
+    track() and every call to sync() compresses only the bytes appended to them since the last call,
+    as a new numbered part. Small files are added whole with add_file() and arrays with add_array().
+    Closing the archive therefore only has to compress what was written since the last sync.
+    Use extract_archive() to put the parts back together.
+
+    With downcast=True, float64 data is stored as float32: arrays given to add_array, and tracked files
+    registered with their number of columns. Columns that need the float64 precision, like Unix
+    timestamps, can be kept as they are. extract_archive() converts them back to float64.
+    """
+    def __init__(self, zip_path, codec='deflate', level=1, downcast=False):
+        if codec not in CODECS:
+            raise ValueError(f"Unknown codec {codec}, choose from {', '.join(CODECS)}")
+        self.compression, levels = CODECS[codec]
+        if level is not None and levels is not None and level not in levels:
+            raise ValueError(f"Invalid level {level} for codec {codec}")
+        self.level = level if levels is not None else None
+        self.downcast = downcast  # store float64 arrays and tracked files as float32
+        self.zip_path = zip_path
+
+        self._zipf = zipfile.ZipFile(zip_path, 'w', self.compression, allowZip64=True)
+        self.closed = False
+        self._lock = threading.Lock()
+        self._tracked = {}  # path -> [arcname, bytes archived, parts written, downcast layout]
+
+    def track(self, path, arcname=None, columns=None, keep=()):
+        """
+        Registers a file that keeps growing, its new bytes are archived on every sync().
+
+        columns is the number of float64 values of every record of the file, e.g. the rows of the raw
+        recording. If it is given and the archive was created with downcast=True, the file is archived
+        as float32 except for the columns in keep.
+        """
+        arcname = arcname or os.path.basename(path)
+        with self._lock:
+            if path in self._tracked:
+                return
+            layout = None
+            if self.downcast and columns is not None:
+                layout = _packed_layout(columns, keep)
+                arcname += DOWNCAST_SUFFIX
+                self._write(arcname + '.json', json.dumps({'columns': columns, 'keep': layout[1]}).encode())
+            self._tracked[path] = [arcname, 0, 0, layout]
+
+    def sync(self):
+        """
+        Archives the bytes appended to every tracked file since the last sync, one part per file.
+        """
+        with self._lock:
+            for path, state in self._tracked.items():
+                if not os.path.exists(path):
+                    continue
+                arcname, offset, parts, layout = state
+                size = os.path.getsize(path)
+                if layout is not None:
+                    # Only whole records can be converted, the rest is archived with the next sync
+                    downcast, keep, dtype = layout
+                    record_size = 8 * (len(downcast) + len(keep))
+                    size = offset + (size - offset) // record_size * record_size
+                if size <= offset:
+                    continue
+                with open(path, 'rb') as f:
+                    f.seek(offset)
+                    data = f.read(size - offset)
+                size = offset + len(data)
+                if layout is not None:
+                    records = np.frombuffer(data, dtype=np.float64).reshape(-1, len(downcast) + len(keep))
+                    packed = np.empty(len(records), dtype=dtype)
+                    packed['downcast'] = records[:, downcast]
+                    packed['keep'] = records[:, keep]
+                    data = packed.tobytes()
+                self._write(f"{arcname}.{parts:05d}", data)
+                state[1] = size
+                state[2] = parts + 1
+
+    def add_file(self, path, arcname=None):
+        with open(path, 'rb') as f:
+            data = f.read()
+        with self._lock:
+            self._write(arcname or os.path.basename(path), data)
+
+    def add_array(self, arcname, array):
+        """
+        Adds an array as a .npy member, downcast to float32 if the archive was created with downcast=True.
+        """
+        if self.downcast and array.dtype == np.float64:
+            array = array.astype(np.float32)
+        buffer = io.BytesIO()
+        np.save(buffer, array)
+        with self._lock:
+            self._write(arcname, buffer.getvalue())
+
+    def close(self, files=()):
+        """
+        Archives the remaining bytes of the tracked files and the given small files, then closes the archive.
+        Returns the path of the archive. Closing an archive again does nothing.
+        """
+        if self.closed:
+            return self.zip_path
+        self.sync()
+        for path in files:
+            if os.path.exists(path):
+                self.add_file(path)
+        with self._lock:
+            self._zipf.close()
+            self.closed = True
+        return self.zip_path
+
+    def _write(self, arcname, data):
+        info = zipfile.ZipInfo(arcname, date_time=time.localtime()[:6])
+        info.compress_type = self.compression
+        self._zipf.writestr(info, data, compress_type=self.compression, compresslevel=self.level)
+
+
+def extract_archive(zip_path, dst_dir):
+    """
+    Extracts a session archive into dst_dir, joining the numbered parts of each growing file.
+    Downcast files are converted back to float64.
+    """
+    os.makedirs(dst_dir, exist_ok=True)
+    with zipfile.ZipFile(zip_path) as zipf:
+        parts = {}
+        layouts = {}
+        for name in zipf.namelist():
+            match = PART_PATTERN.match(name)
+            if match:
+                parts.setdefault(match.group(1), []).append((int(match.group(2)), name))
+            elif name.endswith(DOWNCAST_SUFFIX + '.json'):
+                layout = json.loads(zipf.read(name))
+                layouts[name[:-len('.json')]] = _packed_layout(layout['columns'], layout['keep'])
+            else:
+                zipf.extract(name, dst_dir)
+        for arcname, members in parts.items():
+            layout = layouts.get(arcname)
+            if layout is not None:
+                arcname = arcname[:-len(DOWNCAST_SUFFIX)]
+            with open(os.path.join(dst_dir, arcname), 'wb') as f:
+                for _, name in sorted(members):
+                    data = zipf.read(name)
+                    if layout is not None:
+                        downcast, keep, dtype = layout
+                        packed = np.frombuffer(data, dtype=dtype)
+                        records = np.empty((len(packed), len(downcast) + len(keep)))
+                        records[:, downcast] = packed['downcast']
+                        records[:, keep] = packed['keep']
+                        data = records.tobytes()
+                    f.write(data)
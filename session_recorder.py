@@ -0,0 +1,107 @@
+import csv
+import json
+import os
+import threading
+import time
+import numpy as np
+import pandas as pd
+
+# Marker values inserted into the board's marker channel for each stimulus event
+EVENT_CODES = {
+    'session_start': 1,
+    'focus': 2,
+    'cue': 3,
+    'loading_start': 4,
+    'loading_end': 5,
+    'rest': 6,
+    'menu_pause': 7,
+    'menu_resume': 8,
+    'session_end': 9,
+}
+
+RAW_DATA_FILE = 'raw_data.bin'
+RAW_INFO_FILE = 'raw_data.json'
+EVENTS_FILE = 'events.csv'
+
+
+class SessionRecorder:
+    """
+    Continuous recorder for the raw board stream of one session.
+
+    Every chunk drained from the board, with all of its rows (EEG, accelerometer, timestamps, markers...),
+    is appended as float64 to raw_data.bin in bulk, one sample after another. raw_data.json describes the
+    layout of the file and events.csv holds one row per stimulus event, so epochs can be re-cut offline
+    with any window or filter.
+    """
+    def __init__(self, directory, board_id, sampling_rate, n_rows, eeg_channels, timestamp_channel,
+                 marker_channel, buffer_size=1 << 20):
+        self.directory = directory
+        self.n_rows = n_rows
+        self.samples_written = 0
+        self._lock = threading.Lock()
+
+        info = {
+            'board_id': board_id,
+            'sampling_rate': sampling_rate,
+            'n_rows': n_rows,
+            'eeg_channels': list(eeg_channels),
+            'timestamp_channel': timestamp_channel,
+            'marker_channel': marker_channel,
+            'dtype': 'float64',
+            'layout': 'samples x rows',
+            'event_codes': EVENT_CODES,
+            'start_time': time.time(),
+        }
+        with open(os.path.join(directory, RAW_INFO_FILE), 'w') as f:
+            json.dump(info, f, indent=2)
+
+        self._data_file = open(os.path.join(directory, RAW_DATA_FILE), 'ab', buffering=buffer_size)
+        self._events_file = open(os.path.join(directory, EVENTS_FILE), 'a', newline='')
+        self._events = csv.writer(self._events_file)
+        self._events.writerow(['Time', 'Sample', 'Event', 'Code'])
+
+    def append(self, data):
+        """
+        Appends a (n_rows, n_samples) chunk as returned by BoardShim.get_board_data().
+        """
+        if data.shape[1] == 0:
+            return
+        with self._lock:
+            # Store samples one after another so chunks can be appended without rewriting the file
+            np.ascontiguousarray(data.T, dtype=np.float64).tofile(self._data_file)
+            self.samples_written += data.shape[1]
+
+    def mark(self, event, t=None):
+        """
+        Adds a stimulus event to the event table. The sample column holds the number of samples written
+        so far, the exact sample is given by the marker channel when the marker was also inserted into the board.
+        """
+        t = time.time() if t is None else t
+        with self._lock:
+            self._events.writerow([repr(t), self.samples_written, event, EVENT_CODES[event]])
+
+    def close(self):
+        with self._lock:
+            self._data_file.close()
+            self._events_file.close()
+
+
+def load_recording(directory):
+    """
+    Opens the raw recording of a session without loading it into memory.
+
+    Returns:
+        data (np.memmap): Read-only (n_rows, n_samples) view of the board data.
+        info (dict): Contents of raw_data.json (sampling rate, channel rows, event codes...).
+        events (pd.DataFrame): The event table.
+    """
+    with open(os.path.join(directory, RAW_INFO_FILE)) as f:
+        info = json.load(f)
+    data_path = os.path.join(directory, RAW_DATA_FILE)
+    n_samples = os.path.getsize(data_path) // (8 * info['n_rows'])
+    if n_samples > 0:
+        data = np.memmap(data_path, dtype=np.float64, mode='r', shape=(n_samples, info['n_rows'])).T
+    else:
+        data = np.empty((info['n_rows'], 0))
+    events = pd.read_csv(os.path.join(directory, EVENTS_FILE))
+    return data, info, events
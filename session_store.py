@@ -0,0 +1,205 @@
+import argparse
+import glob
+import json
+import os
+import pickle
+import re
+import numpy as np
+import pandas as pd
+
+EPOCHS_FILE = 'epochs.dat'
+SESSION_INFO_FILE = 'session.json'
+TRIALS_FILE = 'trials.csv'
+METADATA_FILE = 'metadata.csv'
+
+# Numeric label of each cue direction
+LABELS = {'left': 0, 'right': 1}
+
+# QualityFlags is the signal_quality bitmask of the trial, BadChannels the flagged channels numbered from 1
+TRIAL_COLUMNS = ['Trial', 'Direction', 'Label', 'OnsetTime', 'OnsetSample', 'OffsetSample', 'QualityFlags',
+                 'BadChannels']
+
+# Name of the directory of every session: {first_name}_{last_name}_Session{number}
+SESSION_DIR_PATTERN = re.compile(r'.+_.+_Session\d+')
+
+
+def create_session_store(directory, n_channels, n_samples, sampling_rate=None, metadata=None):
+    """
+    Writes the description of a new session store, and its metadata row if given, into directory.
+    """
+    info = {
+        'n_channels': n_channels,
+        'n_samples': n_samples,
+        'dtype': 'float32',
+        'sampling_rate': sampling_rate,
+        'labels': LABELS,
+    }
+    with open(os.path.join(directory, SESSION_INFO_FILE), 'w') as f:
+        json.dump(info, f, indent=2)
+    if metadata is not None:
+        metadata.to_csv(os.path.join(directory, METADATA_FILE), index=False)
+
+
+def append_trial(directory, sig, direction, trial_num, metadata=None, trial_info=None):
+    """
+    Appends one (n_channels, n_samples) epoch to the session store in directory.
+
+    Epochs are stored back to back as float32 in epochs.dat, so the file is one contiguous
+    (n_trials, n_channels, n_samples) array. The label and trial information go in trials.csv.
+    The store is created with the first trial if create_session_store wasn't called.
+
+    Returns the index of the trial in the store.
+    """
+    n_channels, n_samples = sig.shape
+    info_path = os.path.join(directory, SESSION_INFO_FILE)
+    if os.path.exists(info_path):
+        with open(info_path) as f:
+            info = json.load(f)
+        if (info['n_channels'], info['n_samples']) != (n_channels, n_samples):
+            raise ValueError(f"Epoch shape {sig.shape} does not match the session's "
+                             f"({info['n_channels']}, {info['n_samples']})")
+    else:
+        create_session_store(directory, n_channels, n_samples, metadata=metadata)
+
+    epochs_path = os.path.join(directory, EPOCHS_FILE)
+    with open(epochs_path, 'ab') as f:
+        np.ascontiguousarray(sig, dtype=np.float32).tofile(f)
+    index = os.path.getsize(epochs_path) // (n_channels * n_samples * 4) - 1
+
+    trial_info = trial_info or {}
+    row = {'Trial': trial_num, 'Direction': direction, 'Label': LABELS[direction]}
+    for column in TRIAL_COLUMNS[3:]:
+        row[column] = trial_info.get(column)
+    trials_path = os.path.join(directory, TRIALS_FILE)
+    pd.DataFrame([row], columns=TRIAL_COLUMNS).to_csv(trials_path, mode='a', index=False,
+                                                      header=not os.path.exists(trials_path))
+    return index
+
+
+class SessionStore:
+    """
+    Read-only view of a session store written by append_trial.
+
+    epochs is a (n_trials, n_channels, n_samples) float32 np.memmap, so slicing it only reads the
+    requested trials from disk. labels, trials and metadata are loaded from the side tables.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, SESSION_INFO_FILE)) as f:
+            self.info = json.load(f)
+        self.sampling_rate = self.info.get('sampling_rate')
+
+        # The store is created when the session starts, the trial table and epochs with the first trial
+        trials_path = os.path.join(directory, TRIALS_FILE)
+        if os.path.exists(trials_path):
+            self.trials = pd.read_csv(trials_path)
+        else:
+            self.trials = pd.DataFrame(columns=TRIAL_COLUMNS)
+        n_channels, n_samples = self.info['n_channels'], self.info['n_samples']
+        epochs_path = os.path.join(directory, EPOCHS_FILE)
+        epochs_size = os.path.getsize(epochs_path) if os.path.exists(epochs_path) else 0
+        # Ignore a trial that was only partly written
+        n_trials = min(epochs_size // (n_channels * n_samples * 4), len(self.trials))
+        self.trials = self.trials.iloc[:n_trials]
+        if n_trials > 0:
+            self.epochs = np.memmap(epochs_path, dtype=np.float32, mode='r',
+                                    shape=(n_trials, n_channels, n_samples))
+        else:
+            self.epochs = np.empty((0, n_channels, n_samples), dtype=np.float32)
+        self.labels = self.trials['Label'].to_numpy()
+
+        metadata_path = os.path.join(directory, METADATA_FILE)
+        self.metadata = pd.read_csv(metadata_path) if os.path.exists(metadata_path) else None
+
+    def __len__(self):
+        return self.epochs.shape[0]
+
+
+def is_session_store(directory):
+    return os.path.exists(os.path.join(directory, SESSION_INFO_FILE))
+
+
+def pickle_trial_paths(directory):
+    """
+    Returns (trial_num, direction, path) of every {direction}_{trial}.pkl file in directory,
+    ordered by trial number, left before right, as they were collected.
+    """
+    trials = []
+    for path in glob.glob(os.path.join(directory, '*.pkl')):
+        match = re.fullmatch(r'(left|right)_(\d+)\.pkl', os.path.basename(path))
+        if match:
+            trials.append((int(match.group(2)), LABELS[match.group(1)], match.group(1), path))
+    trials.sort()
+    return [(trial_num, direction, path) for trial_num, _, direction, path in trials]
+
+
+def load_pickle_session(directory):
+    """
+    Loads the trials of a pickle session directory as a list of (trial_num, direction, sig, metadata).
+    """
+    loaded = []
+    for trial_num, direction, path in pickle_trial_paths(directory):
+        with open(path, 'rb') as f:
+            sig, metadata = pickle.load(f)
+        loaded.append((trial_num, direction, np.asarray(sig), metadata))
+    return loaded
+
+
+def find_sessions(roots):
+    """
+    Returns the session directories (session stores or pickle sessions) found under roots, sorted.
+    """
+    sessions = []
+    for root in roots:
+        for directory, subdirs, _ in os.walk(root):
+            if SESSION_DIR_PATTERN.fullmatch(os.path.basename(os.path.normpath(directory))) and \
+                    (is_session_store(directory) or pickle_trial_paths(directory)):
+                sessions.append(directory)
+                subdirs[:] = []
+    return sorted(sessions)
+
+
+def convert_pickle_session(src_dir, dst_dir=None, sampling_rate=None):
+    """
+    Converts a session directory of {direction}_{trial}.pkl files into a session store.
+
+    The store is written to dst_dir (src_dir by default). Trials are ordered by trial number,
+    left before right, as they were collected. Epochs whose length differs from the most common
+    length are skipped.
+
+    Returns the number of converted trials.
+    """
+    dst_dir = src_dir if dst_dir is None else dst_dir
+    if is_session_store(dst_dir):
+        raise FileExistsError(f"{dst_dir} already contains a session store")
+    os.makedirs(dst_dir, exist_ok=True)
+
+    loaded = load_pickle_session(src_dir)
+    if not loaded:
+        return 0
+
+    lengths = [sig.shape[1] for _, _, sig, _ in loaded]
+    n_samples = max(set(lengths), key=lengths.count)
+    create_session_store(dst_dir, loaded[0][2].shape[0], n_samples, sampling_rate, metadata=loaded[0][3])
+    converted = 0
+    for trial_num, direction, sig, metadata in loaded:
+        if sig.shape[1] != n_samples:
+            print(f"Skipping {direction}_{trial_num}.pkl: {sig.shape[1]} samples instead of {n_samples}")
+            continue
+        append_trial(dst_dir, sig, direction, trial_num)
+        converted += 1
+    return converted
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Convert pickle session directories into session stores.")
+    parser.add_argument('sessions', nargs='+', help="Session directories containing {direction}_{trial}.pkl files")
+    parser.add_argument('--sampling-rate', type=float, default=None, help="Sampling rate of the recordings")
+    parser.add_argument('--out', default=None, help="Directory to write the converted sessions into "
+                                                    "(defaults to converting each session in place)")
+    args = parser.parse_args()
+
+    for session in args.sessions:
+        dst = session if args.out is None else os.path.join(args.out, os.path.basename(os.path.normpath(session)))
+        n = convert_pickle_session(session, dst, args.sampling_rate)
+        print(f"Converted {n} trials from {session} to {dst}")
@@ -0,0 +1,282 @@
+import os
+import sys
+import time
+import numpy as np
+from multiprocessing import resource_tracker, shared_memory
+
+# Header of the shared block, uint64 fields
+_MAGIC = 0x45454753  # 'EEGS'
+_HEADER_FIELDS = ['magic', 'seq', 'total_written', 'n_channels', 'capacity', 'sampling_rate_mhz', 'pid']
+_HEADER_BYTES = 8 * len(_HEADER_FIELDS)
+_MAGIC_I, _SEQ, _TOTAL, _N_CHANNELS, _CAPACITY, _RATE, _PID = range(len(_HEADER_FIELDS))
+
+
+def _attach(name):
+    """
+    Attaches to an existing block without registering it with the resource tracker: before Python 3.13
+    every process attaching to a block removes it at exit, which would remove the publisher's block
+    when a subscriber exits.
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+def _process_alive(pid):
+    """
+    True if the process pid is running. On Windows a block is freed with its last handle, so an existing
+    block always has a live owner.
+    """
+    if pid == 0:
+        return False
+    if os.name == 'nt':
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class StreamPublisher:
+    """
+    Publishes a processed EEG stream in shared memory, for any number of local reader processes.
+
+    The block holds a header and a (n_channels, capacity) float64 ring buffer laid out like
+    ring_buffer.RingBuffer. Writes follow a seqlock protocol: the sequence counter is made odd before
+    the ring is modified and even again afterwards, so readers (StreamSubscriber) can detect that a
+    write happened while they were reading and retry. There is a single writer and writers never wait
+    for readers, so a slow reader can't hold back acquisition.
+
+    The header holds the publisher's PID. A block left over by a publisher that didn't close, e.g. after
+    a crash, is replaced, but FileExistsError is raised if the publisher of the block is still running.
+    """
+    def __init__(self, name, n_channels, capacity, sampling_rate):
+        size = _HEADER_BYTES + n_channels * capacity * 8
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            self._reclaim(name)
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self.name = self.shm.name
+        self.header = np.ndarray((len(_HEADER_FIELDS),), dtype=np.uint64, buffer=self.shm.buf)
+        self.data = np.ndarray((n_channels, capacity), dtype=np.float64, buffer=self.shm.buf, offset=_HEADER_BYTES)
+        self.capacity = capacity
+        self.write_pos = 0
+
+        self.header[:] = 0
+        self.header[_N_CHANNELS] = n_channels
+        self.header[_CAPACITY] = capacity
+        self.header[_RATE] = int(round(sampling_rate * 1000))
+        self.header[_PID] = os.getpid()
+        self.header[_MAGIC_I] = _MAGIC
+
+    @staticmethod
+    def _reclaim(name):
+        """
+        Removes the existing block name if its publisher is gone, raises FileExistsError otherwise.
+        """
+        existing = _attach(name)
+        try:
+            header = np.frombuffer(bytes(existing.buf[:min(existing.size, _HEADER_BYTES)]), dtype=np.uint64)
+        finally:
+            existing.close()
+        if len(header) < len(_HEADER_FIELDS) or int(header[_MAGIC_I]) != _MAGIC:
+            raise FileExistsError(f"Shared memory block {name} exists and is not a published EEG stream")
+        pid = int(header[_PID])
+        if _process_alive(pid):
+            raise FileExistsError(f"Stream {name} is already published by process {pid}")
+        stale = shared_memory.SharedMemory(name=name)
+        stale.close()
+        stale.unlink()
+
+    def publish(self, chunk):
+        """
+        Appends a (n_channels, n_samples) chunk to the shared ring buffer.
+        """
+        n = chunk.shape[1]
+        if n == 0:
+            return
+        if n > self.capacity:
+            # Only the most recent samples fit
+            skipped = n - self.capacity
+            chunk = chunk[:, skipped:]
+            self.write_pos = (self.write_pos + skipped) % self.capacity
+        else:
+            skipped = 0
+
+        self.header[_SEQ] += 1  # odd: write in progress
+        m = chunk.shape[1]
+        end = self.write_pos + m
+        if end <= self.capacity:
+            self.data[:, self.write_pos:end] = chunk
+        else:
+            first = self.capacity - self.write_pos
+            self.data[:, self.write_pos:] = chunk[:, :first]
+            self.data[:, :m - first] = chunk[:, first:]
+        self.write_pos = end % self.capacity
+        self.header[_TOTAL] += n
+        self.header[_SEQ] += 1  # even: consistent again
+
+    def close(self):
+        """
+        Detaches from and removes the shared block, readers keep their mapping until they close.
+        """
+        self.header = None
+        self.data = None
+        self.shm.close()
+        self.shm.unlink()
+
+
+class StreamSubscriber:
+    """
+    Reads a stream published by StreamPublisher from another process.
+
+    latest(n) copies the n most recent samples into a reusable output array, retrying while the
+    publisher is writing, which is the only copy made: no serialization and no extra board session.
+    For zero-copy access, read data (the shared ring itself) between read_begin() and read_valid(),
+    and discard the result if read_valid() returns False.
+
+    A publisher that dies in the middle of a write leaves the sequence number odd. read_begin() then
+    gives up after write_timeout seconds, and raises RuntimeError if the publisher is gone.
+    """
+    def __init__(self, name, retries=1000, write_timeout=1.0):
+        self.shm = _attach(name)
+        self.header = np.ndarray((len(_HEADER_FIELDS),), dtype=np.uint64, buffer=self.shm.buf)
+        if int(self.header[_MAGIC_I]) != _MAGIC:
+            self.shm.close()
+            raise ValueError(f"Shared memory block {name} is not a published EEG stream")
+        self.n_channels = int(self.header[_N_CHANNELS])
+        self.capacity = int(self.header[_CAPACITY])
+        self.sampling_rate = int(self.header[_RATE]) / 1000
+        self.data = np.ndarray((self.n_channels, self.capacity), dtype=np.float64, buffer=self.shm.buf,
+                               offset=_HEADER_BYTES)
+        self.pid = int(self.header[_PID])
+        self.retries = retries
+        self.write_timeout = write_timeout
+        self.torn_reads = 0  # reads retried because the publisher was writing
+        self._out = None
+
+    def total_written(self):
+        return int(self.header[_TOTAL])
+
+    def publisher_alive(self):
+        return _process_alive(self.pid)
+
+    def read_begin(self):
+        """
+        Waits until no write is in progress and returns the sequence number to give to read_valid().
+
+        Raises RuntimeError if the publisher died during a write, TimeoutError if a write lasts more
+        than write_timeout seconds.
+        """
+        seq = int(self.header[_SEQ])
+        if seq % 2 == 0:
+            return seq
+        started = time.perf_counter()
+        while True:
+            waited = time.perf_counter() - started
+            if waited > self.write_timeout:
+                if not self.publisher_alive():
+                    raise RuntimeError(f"The publisher (process {self.pid}) died while writing")
+                raise TimeoutError(f"The publisher has been writing for more than {self.write_timeout} s")
+            # Writes take microseconds, only yield at first, then sleep instead of spinning
+            time.sleep(0 if waited < 0.001 else 0.001)
+            seq = int(self.header[_SEQ])
+            if seq % 2 == 0:
+                return seq
+
+    def read_valid(self, seq):
+        """
+        True if nothing was written since read_begin() returned seq.
+        """
+        return int(self.header[_SEQ]) == seq
+
+    def latest(self, n=None, out=None):
+        """
+        Returns (window, total_written): a consistent copy of the n most recent samples (all the
+        available ones by default) and the number of samples published when it was taken.
+
+        The window is written into out if given, otherwise into an array reused between calls,
+        so copy it to keep it past the next call.
+        """
+        for _ in range(self.retries):
+            seq = self.read_begin()
+            total = int(self.header[_TOTAL])
+            available = min(total, self.capacity)
+            count = available if n is None else min(n, available)
+            if out is None:
+                if self._out is None or self._out.shape[1] != count:
+                    self._out = np.empty((self.n_channels, count))
+                window = self._out
+            else:
+                window = out[:, :count]
+
+            end = total % self.capacity
+            start = end - count
+            if start >= 0:
+                window[:] = self.data[:, start:end]
+            else:
+                window[:, :-start] = self.data[:, start:]
+                window[:, -start:] = self.data[:, :end]
+
+            if self.read_valid(seq):
+                return window, total
+            self.torn_reads += 1
+        raise RuntimeError("The publisher kept writing during every read attempt")
+
+    def wait_for(self, total, timeout=None, poll_interval=0.001):
+        """
+        Waits until more than total samples were published. Returns False on timeout.
+        Raises RuntimeError if the publisher is gone, no sample will be published anymore.
+        """
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        next_check = time.perf_counter() + 1.0
+        while int(self.header[_TOTAL]) <= total:
+            now = time.perf_counter()
+            if deadline is not None and now > deadline:
+                return False
+            if now > next_check:
+                if not self.publisher_alive():
+                    raise RuntimeError(f"The publisher (process {self.pid}) is gone")
+                next_check = now + 1.0
+            time.sleep(poll_interval)
+        return True
+
+    def close(self):
+        self.header = None
+        self.data = None
+        self._out = None
+        self.shm.close()
+
+
+def main():
+    """
+    Prints the latest second of a published stream 10 times a second, e.g. while RT_preprocess.py runs.
+    """
+    from RT_preprocess import STREAM_NAME
+    name = sys.argv[1] if len(sys.argv) > 1 else STREAM_NAME
+    subscriber = StreamSubscriber(name)
+    total = 0
+    try:
+        while True:
+            if subscriber.wait_for(total, timeout=1.0):
+                window, total = subscriber.latest(int(subscriber.sampling_rate))
+                print(f"{total} samples published, latest window {window.shape}, "
+                      f"mean {window.mean():.3f}, std {window.std():.3f}")
+            time.sleep(0.1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        subscriber.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+import numpy as np
+
+# Quality flags of a channel, combined as a bitmask
+FLAT = 1  # Standard deviation below flat_std: disconnected or shorted electrode
+RAILED = 2  # Too many samples at the limit of the amplifier's range
+LINE_NOISE = 4  # Most of the power is line noise: bad contact
+HIGH_VARIANCE = 8  # Standard deviation above max_std: movement, loose electrode
+MISSING = 16  # NaN samples
+FLAG_NAMES = {FLAT: 'flat', RAILED: 'railed', LINE_NOISE: 'line noise', HIGH_VARIANCE: 'high variance',
+              MISSING: 'missing'}
+# Flags making a channel unusable, the others make it noisy
+BAD_FLAGS = FLAT | RAILED | MISSING
+
+
+def describe(flags):
+    """
+    Names of the flags set in the bitmask flags.
+    """
+    return [name for flag, name in FLAG_NAMES.items() if flags & flag]
+
+
+def epoch_flags(sig, flat_std=0.0):
+    """
+    Flags of every channel of a (n_channels, n_samples) epoch that can be told from the epoch alone:
+    MISSING if it has NaN samples, FLAT if its standard deviation is at most flat_std.
+    """
+    flags = np.zeros(sig.shape[0], dtype=np.uint8)
+    missing = np.isnan(sig).any(axis=1)
+    flags[missing] |= MISSING
+    with np.errstate(invalid='ignore'):
+        flags[~missing & (np.std(sig, axis=1) <= flat_std)] |= FLAT
+    return flags
+
+
+class SignalQualityMonitor:
+    """
+    Per-channel signal quality of the raw EEG stream over a sliding window, updated incrementally.
+
+    update() is given every new raw chunk. Samples are summarized in blocks of block_sec seconds:
+    count, mean and sum of squared deviations, samples at the rail, NaN samples and the complex
+    amplitude of the line frequency (a single-bin DFT on the absolute sample index, so blocks add up
+    coherently). Each update only touches the new samples, and each completed block combines the
+    window_sec / block_sec last blocks into the window statistics, so the cost doesn't depend on the
+    window length.
+
+    flags holds the FLAT/RAILED/LINE_NOISE/HIGH_VARIANCE/MISSING bitmask of every channel for the
+    last window, and std and line_noise (fraction of the power at the line frequency) the statistics
+    they come from. The flags of every block are
+    kept for history_sec seconds so trial_flags() can return the flags seen during a trial.
+
+    Amplitudes are in the unit of the stream, microvolts for BrainFlow boards. The default rail level
+    is the input range of the Cyton's ADS1299 at gain 24 (+/-187.5 mV).
+    """
+    def __init__(self, n_channels, sampling_rate, window_sec=2.0, block_sec=0.25, line_freq=60.0, flat_std=0.5,
+                 max_std=500.0, rail_level=187000.0, rail_fraction=0.1, line_ratio=0.5, history_sec=60.0):
+        self.n_channels = n_channels
+        self.sampling_rate = sampling_rate
+        self.block_size = max(1, int(round(block_sec * sampling_rate)))
+        self.n_blocks = max(1, int(round(window_sec / block_sec)))
+        self.flat_std = flat_std
+        self.max_std = max_std
+        self.rail_level = rail_level
+        self.rail_fraction = rail_fraction
+        self.line_ratio = line_ratio
+        self.omega = 2 * np.pi * line_freq / sampling_rate
+
+        # Statistics of the last n_blocks complete blocks, indexed by block number modulo n_blocks
+        self._count = np.zeros((self.n_blocks, n_channels))
+        self._mean = np.zeros((self.n_blocks, n_channels))
+        self._m2 = np.zeros((self.n_blocks, n_channels))
+        self._railed = np.zeros((self.n_blocks, n_channels))
+        self._missing = np.zeros((self.n_blocks, n_channels))
+        self._line = np.zeros((self.n_blocks, n_channels), dtype=np.complex128)
+
+        # Sums of the block being filled
+        self._filled = 0
+        self._sum = np.zeros(n_channels)
+        self._sumsq = np.zeros(n_channels)
+        self._block_railed = np.zeros(n_channels)
+        self._block_missing = np.zeros(n_channels)
+        self._block_valid = np.zeros(n_channels)
+        self._projection = np.zeros(n_channels, dtype=np.complex128)
+        self._phasor_sum = 0j
+
+        # Flags of every complete block, by block number modulo the history length
+        self.history_blocks = max(1, int(history_sec * sampling_rate) // self.block_size)
+        self._history = np.zeros((self.history_blocks, n_channels), dtype=np.uint8)
+
+        self.samples = 0  # Samples received, the absolute index of the next sample
+        self.blocks = 0  # Complete blocks
+        self.flags = np.zeros(n_channels, dtype=np.uint8)
+        self.std = np.full(n_channels, np.nan)
+        self.line_noise = np.full(n_channels, np.nan)
+
+    def update(self, chunk):
+        """
+        Adds a (n_channels, n_samples) chunk of raw samples.
+        """
+        n_samples = chunk.shape[1]
+        start = 0
+        while start < n_samples:
+            end = min(n_samples, start + self.block_size - self._filled)
+            self._accumulate(chunk[:, start:end])
+            start = end
+            if self._filled == self.block_size:
+                self._close_block()
+
+    def _accumulate(self, piece):
+        n = piece.shape[1]
+        missing = np.isnan(piece)
+        if missing.any():
+            n_missing = missing.sum(axis=1)
+            self._block_missing += n_missing
+            self._block_valid += n - n_missing
+            piece = np.where(missing, 0.0, piece)
+        else:
+            self._block_valid += n
+        self._sum += piece.sum(axis=1)
+        self._sumsq += np.einsum('ij,ij->i', piece, piece)
+        if self.rail_level is not None:
+            self._block_railed += np.count_nonzero(np.abs(piece) >= self.rail_level, axis=1)
+        phasor = np.exp(-1j * self.omega * np.arange(self.samples, self.samples + n))
+        self._projection += piece @ phasor
+        self._phasor_sum += phasor.sum()
+        self._filled += n
+        self.samples += n
+
+    def _close_block(self):
+        i = self.blocks % self.n_blocks
+        count = self._block_valid
+        safe_count = np.maximum(count, 1)
+        mean = self._sum / safe_count
+        self._count[i] = count
+        self._mean[i] = mean
+        self._m2[i] = np.maximum(self._sumsq - self._sum * mean, 0)
+        self._railed[i] = self._block_railed
+        self._missing[i] = self._block_missing
+        # Line frequency amplitude of the block with its mean removed, the DC offset of the electrodes
+        # would otherwise leak into it
+        self._line[i] = self._projection - mean * self._phasor_sum
+        self.blocks += 1
+
+        self._filled = 0
+        self._sum[:] = 0
+        self._sumsq[:] = 0
+        self._block_railed[:] = 0
+        self._block_missing[:] = 0
+        self._block_valid[:] = 0
+        self._projection[:] = 0
+        self._phasor_sum = 0j
+
+        self._update_flags()
+        self._history[(self.blocks - 1) % self.history_blocks] = self.flags
+
+    def _update_flags(self):
+        blocks = min(self.blocks, self.n_blocks)
+        count = self._count[:blocks]
+        total = count.sum(axis=0)
+        safe_total = np.maximum(total, 1)
+        # Combine the block means and squared deviations (Chan et al.)
+        mean = (count * self._mean[:blocks]).sum(axis=0) / safe_total
+        m2 = self._m2[:blocks].sum(axis=0) + (count * (self._mean[:blocks] - mean) ** 2).sum(axis=0)
+        variance = m2 / safe_total
+        std = np.sqrt(variance)
+        # Power of a sinusoid of amplitude 2|X|/N is 2|X|^2/N^2
+        line_power = 2 * np.abs(self._line[:blocks].sum(axis=0)) ** 2 / safe_total ** 2
+        with np.errstate(divide='ignore', invalid='ignore'):
+            line_ratio = np.where(variance > 0, line_power / variance, 0.0)
+
+        flags = np.zeros(self.n_channels, dtype=np.uint8)
+        missing = self._missing[:blocks].sum(axis=0) > 0
+        flags[missing] |= MISSING
+        flags[(total > 1) & (std < self.flat_std)] |= FLAT
+        flags[self._railed[:blocks].sum(axis=0) > self.rail_fraction * safe_total] |= RAILED
+        # The gaps left by missing samples distort the spectrum
+        flags[~missing & (line_ratio > self.line_ratio)] |= LINE_NOISE
+        flags[std > self.max_std] |= HIGH_VARIANCE
+        # Replaced rather than modified so other threads can read them without a lock
+        self.flags = flags
+        self.std = std
+        self.line_noise = line_ratio
+
+    def trial_flags(self, start_sample, end_sample):
+        """
+        Flags of every channel in any window that ended between the samples start_sample and end_sample
+        (absolute indices), as far as they are still in the history.
+        """
+        first = max(start_sample // self.block_size, self.blocks - self.history_blocks, 0)
+        last = min((end_sample - 1) // self.block_size, self.blocks - 1)
+        if last < first:
+            return np.zeros(self.n_channels, dtype=np.uint8)
+        rows = np.arange(first, last + 1) % self.history_blocks
+        return np.bitwise_or.reduce(self._history[rows], axis=0)
@@ -0,0 +1,207 @@
+"""
+Runs a whole data collection session headless and reports its performance.
+
+The GUI runs with the SDL dummy video driver and scripted input: it sets the number of trials, fills in
+the questionnaire, runs every trial, then saves, archives and uploads the session and exits. Box is
+replaced by a LocalBoxClient and everything is written to a temporary directory. Trial phases run
+time_scale times faster, on a NumPy synthetic board (or a replayed recording) streaming that much faster,
+so the epochs still hold 7 s of signal.
+
+The report gives the frame interval and render time distribution and the phase onset error (from the
+session's timing.json and schedule.csv), the CPU and memory used, and the size of the session on disk.
+
+Usage: python simulate_session.py [--trials 10] [--time-scale 10] [--json report.json]
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import tempfile
+import time
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+import pandas as pd
+import pygame
+
+import data_collection_gui
+from board_source import BrainFlowSource, PlaybackSource, SyntheticSource
+from idle_screen import IdleScreen
+from local_box import LocalBoxClient
+from stimulus_scheduler import SCHEDULE_FILE
+from telemetry import TIMING_FILE
+from user_registry import TABLE_COLUMNS
+
+
+def key(k, unicode=''):
+    return pygame.event.Event(pygame.KEYDOWN, key=k, unicode=unicode, mod=0)
+
+
+def typed(text):
+    return [key(pygame.key.key_code(c) if c.isalnum() else 0, c) for c in text]
+
+
+def click(pos):
+    return pygame.event.Event(pygame.MOUSEBUTTONDOWN, pos=pos, button=1)
+
+
+class ScriptedScreen(IdleScreen):
+    """
+    IdleScreen that posts scripted input: every time a screen asks for events, the next batch of
+    events scripted for that screen (if any) is posted first.
+    """
+    def __init__(self, script, timeout_ms=100):
+        super().__init__(timeout_ms)
+        self.script = {screen: list(batches) for screen, batches in script.items()}
+
+    def events(self, timeout_ms=None):
+        screen = self._state[0] if self._state else None
+        batches = self.script.get(screen)
+        if batches:
+            for event in batches.pop(0):
+                pygame.event.post(event)
+        return super().events(timeout_ms)
+
+
+def make_script(trials, display_size, first='Sim', last='User', eid='sim001'):
+    """
+    Input of one session: set the number of trials, start, fill in the questionnaire, start the trials,
+    and exit from the after-session menu.
+    """
+    width_delta = display_size[0] // 11
+    height_delta = display_size[1] // 11
+    # Centers of the first stimulant box, the second meal box and the 'no' exercise box
+    boxes = [(width_delta + 6, height_delta * 2 + 6), (width_delta * 3 + 6, height_delta * 4 + 6),
+             (width_delta * 6 + 6, height_delta * 8 + 6)]
+    return {
+        'menu': [[key(pygame.K_n)], [key(pygame.K_s)]],
+        'input': [typed(str(trials)) + [key(pygame.K_RETURN)]],
+        'subject': [typed(first) + [key(pygame.K_DOWN)] + typed(last) + [key(pygame.K_DOWN)] + typed(eid) +
+                    [key(pygame.K_RETURN)]],
+        'physiological': [[click(pos) for pos in boxes],
+                          typed('toast') + [key(pygame.K_DOWN)] + typed('none') + [key(pygame.K_RETURN)]],
+        'buffer': [[key(pygame.K_s)]],
+        'after_session': [[key(pygame.K_n)]],
+    }
+
+
+def directory_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+    return total
+
+
+def build_report(data_dir, session_name, wall, cpu, trials):
+    session_dir = os.path.join(data_dir, session_name)
+    with open(os.path.join(session_dir, TIMING_FILE)) as f:
+        timing = json.load(f)
+    schedule = pd.read_csv(os.path.join(session_dir, SCHEDULE_FILE))
+    # Onset error of the phases that followed the schedule, the first phase of a run is rebased by design
+    error = schedule.loc[schedule['Rebased'] == 0, 'ErrorMs']
+    saved = pd.read_csv(os.path.join(session_dir, 'trials.csv')) if os.path.exists(
+        os.path.join(session_dir, 'trials.csv')) else pd.DataFrame()
+    zip_path = session_dir + '.zip'
+
+    return {
+        'trials_requested': trials,
+        'epochs_saved': len(saved),
+        'epochs_flagged': int((saved['QualityFlags'] > 0).sum()) if 'QualityFlags' in saved else 0,
+        'wall_seconds': wall,
+        'cpu_seconds': cpu,
+        'cpu_percent': 100 * cpu / wall,
+        'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'session_bytes': directory_size(session_dir),
+        'archive_bytes': os.path.getsize(zip_path) if os.path.exists(zip_path) else None,
+        'frame_interval': timing['histograms'].get('frame_interval'),
+        'render_time': timing['histograms'].get('render_time'),
+        'onset_error_ms': {
+            'count': int(error.count()),
+            'mean': float(error.mean()) if len(error) else None,
+            'p99': float(error.quantile(0.99)) if len(error) else None,
+            'max': float(error.max()) if len(error) else None,
+        },
+        'counters': timing['counters'],
+        'histograms': timing['histograms'],
+        'uploads': timing.get('uploads', []),
+    }
+
+
+def print_report(report):
+    print(f"\n{report['epochs_saved']}/{2 * report['trials_requested']} epochs saved in "
+          f"{report['wall_seconds']:.1f} s ({report['epochs_flagged']} with quality flags), "
+          f"CPU {report['cpu_percent']:.0f}%, max RSS {report['max_rss_mb']:.0f} MB")
+    print(f"Session {report['session_bytes'] / 1e6:.2f} MB on disk, archive "
+          f"{(report['archive_bytes'] or 0) / 1e6:.2f} MB")
+    for name in ('frame_interval', 'render_time'):
+        h = report[name]
+        if h and h['count']:
+            print(f"{name:<15} n={h['count']:<6} mean {h['mean'] * 1e3:7.2f} ms  p50 {h['p50'] * 1e3:7.2f} ms  "
+                  f"p99 {h['p99'] * 1e3:7.2f} ms  max {h['max'] * 1e3:7.2f} ms")
+    e = report['onset_error_ms']
+    if e['count']:
+        print(f"{'onset error':<15} n={e['count']:<6} mean {e['mean']:7.2f} ms  p99 {e['p99']:7.2f} ms  "
+              f"max {e['max']:7.2f} ms")
+    print(f"late frames: {report['counters'].get('late_frames', 0)}, "
+          f"schedule rebases: {report['counters'].get('schedule_rebases', 0)}")
+    for upload in report['uploads']:
+        seconds = f"{upload['seconds'] * 1e3:.1f} ms" if upload['seconds'] is not None else upload['status']
+        print(f"{upload['kind']} of {upload['file']}: {upload['bytes'] / 1e6:.2f} MB, {seconds}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--trials', type=int, default=10, help="Trials of each direction")
+    parser.add_argument('--time-scale', type=float, default=10, help="Run the trial phases this many times faster")
+    parser.add_argument('--board', choices=['numpy', 'brainflow'], default='numpy',
+                        help="NumPy synthetic board, or BrainFlow's synthetic board (real time only)")
+    parser.add_argument('--playback', default=None, help="Replay the raw recording of this session directory")
+    parser.add_argument('--size', default='1280x720', help="Window size, WIDTHxHEIGHT")
+    parser.add_argument('--keep', default=None, help="Keep the session data in this directory")
+    parser.add_argument('--json', default=None, help="Write the report to this file")
+    args = parser.parse_args()
+
+    if args.trials % 2:
+        parser.error("--trials has to be even")
+    if args.board == 'brainflow' and args.time_scale != 1:
+        parser.error("BrainFlow's synthetic board only streams in real time, use --time-scale 1")
+    display_size = tuple(int(v) for v in args.size.split('x'))
+
+    if args.playback:
+        source = PlaybackSource(args.playback, speed=args.time_scale, loop=True)
+    elif args.board == 'brainflow':
+        source = BrainFlowSource()
+    else:
+        source = SyntheticSource(speed=args.time_scale)
+
+    data_dir = args.keep or tempfile.mkdtemp(prefix='simulated_session_')
+    os.makedirs(data_dir, exist_ok=True)
+    data_collection_gui.DATA_DIR = data_dir
+
+    # Local stand-in for Box, holding an empty user table
+    box = LocalBoxClient(os.path.join(data_dir, 'box'))
+    table_path = os.path.join(data_dir, 'table_seed.csv')
+    pd.DataFrame(columns=TABLE_COLUMNS).to_csv(table_path, index=False)
+    box.add_file('0', table_path, 'user_table.csv', file_id=data_collection_gui.TABLE_FILE_ID)
+
+    pygame.init()
+    idle_screen = ScriptedScreen(make_script(args.trials, display_size))
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        data_collection_gui.main(source, client_factory=lambda: box, display_size=display_size,
+                                 time_scale=args.time_scale, idle_screen=idle_screen)
+    except SystemExit:
+        pass  # The after-session menu exits the application
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+
+    report = build_report(data_dir, 'Sim_User_Session1', wall, cpu, args.trials)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.keep is None:
+        shutil.rmtree(data_dir)
+
+
+if __name__ == '__main__':
+    main()
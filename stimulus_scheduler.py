@@ -0,0 +1,109 @@
+import csv
+import time
+from telemetry import metrics
+
+SCHEDULE_FILE = 'schedule.csv'
+SCHEDULE_COLUMNS = ['Trial', 'Phase', 'Planned', 'Actual', 'ErrorMs', 'Rebased']
+
+
+class StimulusScheduler:
+    """
+    Times the trial phases against absolute deadlines on the monotonic perf_counter clock.
+
+    Every phase is planned to start when the previous one was planned to end, not when it actually
+    ended, so the time spent drawing, handling events or queueing a trial is absorbed by the next
+    phase instead of accumulating over the session. A phase that starts more than max_lag seconds late
+    (e.g. after a pause) rebases the schedule on the current time instead of rushing the next phases.
+
+    begin() logs the planned and actual onset of every phase, and returns the onset as a time.time()
+    value so it can be given to the event markers and the epoch saver, which locate the onset sample
+    from the board timestamps.
+    """
+    def __init__(self, max_lag=0.5):
+        self.max_lag = max_lag
+        self.log = []
+        self.deadline = None  # perf_counter time at which the current phase ends
+        self._last_frame = None
+        # Mapping between perf_counter and time.time(), taken once so both clocks agree for the session
+        self._perf_origin = time.perf_counter()
+        self._wall_origin = time.time()
+
+    def now(self):
+        return time.perf_counter()
+
+    def to_wall_time(self, t):
+        """
+        Converts a perf_counter time into the time.time() clock of the board timestamps.
+        """
+        return self._wall_origin + (t - self._perf_origin)
+
+    def rebase(self):
+        """
+        Starts the schedule over from now, used when the trials resume after a menu or the buffer screen.
+        """
+        self.deadline = None
+
+    def begin(self, phase, duration, trial=None):
+        """
+        Starts a phase of duration seconds, call it right after the phase's first frame was flipped.
+
+        Returns the onset of the phase as a time.time() value.
+        """
+        actual = self.now()
+        planned = self.deadline
+        rebased = planned is None or actual - planned > self.max_lag
+        if rebased:
+            planned = actual
+        self.deadline = planned + duration
+        self._last_frame = actual
+        metrics.observe('onset_error', actual - planned)
+        if rebased:
+            metrics.count('schedule_rebases')
+        self.log.append([trial, phase, self.to_wall_time(planned), self.to_wall_time(actual),
+                         (actual - planned) * 1e3, int(rebased)])
+        return self.to_wall_time(actual)
+
+    def remaining(self):
+        """
+        Seconds until the current phase ends, negative once its deadline has passed.
+        """
+        if self.deadline is None:
+            return 0.0
+        return self.deadline - self.now()
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def wait_frame(self, fps=60):
+        """
+        Sleeps until the next frame or the end of the phase, whichever comes first, so the last frame
+        of a phase doesn't run past its deadline like a fixed clock.tick() would.
+
+        Like clock.tick(), the next frame is due 1 / fps after the previous one, so the time spent
+        drawing and handling events is part of the frame period instead of added to it.
+        """
+        next_frame = self.now() + 1.0 / fps if self._last_frame is None else self._last_frame + 1.0 / fps
+        if self.deadline is not None:
+            next_frame = min(next_frame, self.deadline)
+        delay = next_frame - self.now()
+        if delay > 0:
+            time.sleep(delay)
+
+        # Time between the frames of a phase, frames taking more than 1.5 frame periods are counted as late
+        now = self.now()
+        if self._last_frame is not None:
+            interval = now - self._last_frame
+            metrics.observe('frame_interval', interval)
+            if interval > 1.5 / fps:
+                metrics.count('late_frames')
+        self._last_frame = now
+
+    def save(self, path):
+        """
+        Writes the planned and actual onset of every phase as a CSV file.
+        """
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(SCHEDULE_COLUMNS)
+            for row in self.log:
+                writer.writerow([('' if v is None else repr(v) if isinstance(v, float) else v) for v in row])
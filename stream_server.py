@@ -0,0 +1,401 @@
+"""
+Streams the processed EEG of RT_preprocess.EEGProcessor to remote subscribers over TCP.
+
+Usage:
+  python stream_server.py serve [--host 0.0.0.0] [--port 5555] [--playback DIR]
+  python stream_server.py listen HOST [--port 5555]
+  python stream_server.py loopback [--seconds 5] [--speed 20]
+"""
+import argparse
+import collections
+import socket
+import struct
+import threading
+import time
+import numpy as np
+from telemetry import metrics
+
+DEFAULT_PORT = 5555
+
+# Sent once to every subscriber when it connects: magic, number of channels, sampling rate
+HELLO = struct.Struct('<4sHd')
+HELLO_MAGIC = b'EEGH'
+# Header of every frame: magic, frame sequence number, index of the first sample in the stream,
+# timestamp of the first sample, number of channels, number of samples.
+# The payload that follows is a (channels, samples) little-endian float32 array.
+FRAME_HEADER = struct.Struct('<4sQQdHI')
+FRAME_MAGIC = b'EEGF'
+PAYLOAD_DTYPE = np.dtype('<f4')
+
+
+def encode_frame(seq, first_sample, timestamp, data):
+    """
+    Packs a (n_channels, n_samples) chunk into one frame.
+    """
+    payload = np.ascontiguousarray(data, dtype=PAYLOAD_DTYPE)
+    return FRAME_HEADER.pack(FRAME_MAGIC, seq, first_sample, timestamp, data.shape[0], data.shape[1]) + \
+        payload.tobytes()
+
+
+class _Subscriber:
+    """
+    A connected client: its bounded frame queue and the thread that sends it.
+    """
+    def __init__(self, server, conn, address, queue_size):
+        self.server = server
+        self.conn = conn
+        self.address = address
+        self.queue = collections.deque(maxlen=queue_size)
+        self.ready = threading.Event()
+        self.closed = False
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self.bytes_sent = 0
+        self.max_queued = 0
+        self.thread = threading.Thread(target=self._run, name=f"StreamSubscriber-{address}", daemon=True)
+
+    def put(self, frame):
+        # A full deque discards its oldest frame on append
+        if len(self.queue) == self.queue.maxlen:
+            self.frames_dropped += 1
+            metrics.count('stream_frames_dropped')
+        self.queue.append(frame)
+        self.max_queued = max(self.max_queued, len(self.queue))
+        self.ready.set()
+
+    def _run(self):
+        try:
+            while not self.closed:
+                self.ready.wait()
+                self.ready.clear()
+                while self.queue and not self.closed:
+                    frame = self.queue.popleft()
+                    with metrics.timer('stream_send_time'):
+                        self.conn.sendall(frame)
+                    self.frames_sent += 1
+                    self.bytes_sent += len(frame)
+        except OSError:
+            pass  # The client disconnected
+        finally:
+            self.server._remove(self)
+
+    def close(self):
+        self.closed = True
+        self.ready.set()
+        try:
+            self.conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.conn.close()
+
+    def stats(self):
+        return {
+            'frames_sent': self.frames_sent,
+            'frames_dropped': self.frames_dropped,
+            'bytes_sent': self.bytes_sent,
+            'queued': len(self.queue),
+            'max_queued': self.max_queued,
+        }
+
+
+class StreamServer:
+    """
+    TCP server pushing processed chunks to any number of subscribers, e.g. an online decoder on
+    another machine of the lab network.
+
+    publish() is called from the acquisition loop with every processed chunk. Chunks are batched
+    into one frame until batch_samples samples or max_delay seconds have been collected, then the
+    frame is queued for every subscriber. Each subscriber has its own sender thread and a queue of at
+    most queue_size frames: when a client reads too slowly its oldest frames are dropped, so it can't
+    stall acquisition or the other clients. Frame sequence numbers let clients detect the drops.
+    The socket send buffer is limited to send_buffer bytes so a slow client's backlog stays in that
+    queue, where it is dropped, rather than in the kernel, where it would only add latency.
+
+    stats() reports the frames sent, dropped and queued of every subscriber.
+    """
+    def __init__(self, n_channels, sampling_rate, host='127.0.0.1', port=DEFAULT_PORT, batch_samples=None,
+                 max_delay=0.1, queue_size=64, send_buffer=64 * 1024):
+        self.n_channels = n_channels
+        self.sampling_rate = sampling_rate
+        self.batch_samples = batch_samples or max(1, int(sampling_rate * max_delay))
+        self.max_delay = max_delay
+        self.queue_size = queue_size
+        self.send_buffer = send_buffer
+
+        self.seq = 0
+        self.total_samples = 0  # Samples published, the index of the next sample
+        self._pending = []
+        self._pending_samples = 0
+        self._pending_timestamp = None
+        self._pending_since = None
+
+        self.subscribers = []
+        self._lock = threading.Lock()
+        self.disconnected = []  # Stats of the subscribers that left
+
+        self.sock = socket.create_server((host, port), reuse_port=False)
+        self.sock.settimeout(0.2)
+        self.address = self.sock.getsockname()
+        self._stop_requested = False
+        self._acceptor = threading.Thread(target=self._accept, name="StreamServer", daemon=True)
+
+    def start(self):
+        self._acceptor.start()
+        return self
+
+    def _accept(self):
+        while not self._stop_requested:
+            try:
+                conn, address = self.sock.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if self.send_buffer:
+                conn.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.send_buffer)
+            try:
+                conn.sendall(HELLO.pack(HELLO_MAGIC, self.n_channels, self.sampling_rate))
+            except OSError:
+                conn.close()
+                continue
+            subscriber = _Subscriber(self, conn, address, self.queue_size)
+            with self._lock:
+                self.subscribers.append(subscriber)
+            subscriber.thread.start()
+
+    def _remove(self, subscriber):
+        with self._lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+                self.disconnected.append({'address': subscriber.address, **subscriber.stats()})
+        subscriber.close()
+
+    def publish(self, chunk, timestamp=None):
+        """
+        Adds a (n_channels, n_samples) chunk to the current batch. timestamp is the board timestamp of
+        its first sample (time.time() clock), the current time if not given.
+        """
+        n_samples = chunk.shape[1]
+        if n_samples == 0:
+            return
+        now = time.time()
+        if not self._pending:
+            self._pending_timestamp = now if timestamp is None else timestamp
+            self._pending_since = now
+        self._pending.append(chunk.astype(PAYLOAD_DTYPE))
+        self._pending_samples += n_samples
+        if self._pending_samples >= self.batch_samples or now - self._pending_since >= self.max_delay:
+            self.flush()
+
+    def flush(self):
+        """
+        Sends the current batch now.
+        """
+        if not self._pending:
+            return
+        data = self._pending[0] if len(self._pending) == 1 else np.concatenate(self._pending, axis=1)
+        frame = encode_frame(self.seq, self.total_samples, self._pending_timestamp, data)
+        self.seq += 1
+        self.total_samples += self._pending_samples
+        self._pending = []
+        self._pending_samples = 0
+        metrics.count('stream_frames')
+        with self._lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            subscriber.put(frame)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'frames': self.seq,
+                'samples': self.total_samples,
+                'subscribers': [{'address': s.address, **s.stats()} for s in self.subscribers],
+                'disconnected': list(self.disconnected),
+            }
+
+    def close(self):
+        self.flush()
+        self._stop_requested = True
+        self.sock.close()
+        if self._acceptor.is_alive():
+            self._acceptor.join()
+        with self._lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            # Give the sender a moment to send what is queued
+            deadline = time.time() + 1.0
+            while subscriber.queue and time.time() < deadline:
+                time.sleep(0.01)
+            subscriber.close()
+            subscriber.thread.join(1.0)
+
+
+class StreamClient:
+    """
+    Receives the frames of a StreamServer.
+
+    frames() yields (seq, first_sample, timestamp, data) for every frame, data being a
+    (n_channels, n_samples) float32 array. frames_missed counts the frames the server dropped for
+    this client, from the gaps in the sequence numbers.
+    """
+    def __init__(self, host, port=DEFAULT_PORT, timeout=10.0, receive_buffer=None):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if receive_buffer:
+            # Set before connecting so the TCP window is sized for it
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, receive_buffer)
+        self.sock.settimeout(timeout)
+        self.sock.connect((host, port))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        magic, self.n_channels, self.sampling_rate = HELLO.unpack(self._recv_exact(HELLO.size))
+        if magic != HELLO_MAGIC:
+            raise ValueError(f"{host}:{port} is not an EEG stream server")
+        self.last_seq = None
+        self.frames_received = 0
+        self.frames_missed = 0
+
+    def _recv_exact(self, size):
+        buffer = bytearray(size)
+        view = memoryview(buffer)
+        received = 0
+        while received < size:
+            n = self.sock.recv_into(view[received:])
+            if n == 0:
+                raise ConnectionError("The server closed the stream")
+            received += n
+        return buffer
+
+    def recv_frame(self):
+        magic, seq, first_sample, timestamp, n_channels, n_samples = FRAME_HEADER.unpack(
+            self._recv_exact(FRAME_HEADER.size))
+        if magic != FRAME_MAGIC:
+            raise ValueError("Corrupted stream")
+        payload = self._recv_exact(n_channels * n_samples * PAYLOAD_DTYPE.itemsize)
+        data = np.frombuffer(payload, dtype=PAYLOAD_DTYPE).reshape(n_channels, n_samples)
+        if self.last_seq is not None:
+            self.frames_missed += seq - self.last_seq - 1
+        self.last_seq = seq
+        self.frames_received += 1
+        return seq, first_sample, timestamp, data
+
+    def frames(self):
+        try:
+            while True:
+                yield self.recv_frame()
+        except ConnectionError:
+            return
+
+    def close(self):
+        self.sock.close()
+
+
+def serve(processor, server, interval=0.1):
+    """
+    Runs the acquisition loop of processor, publishing to server, until interrupted.
+    """
+    processor.server = server
+    try:
+        while True:
+            start_time = time.time()
+            processor.update()
+            server.flush()
+            time.sleep(max(0, interval - (time.time() - start_time)))
+    except KeyboardInterrupt:
+        print("Stopping...")
+    finally:
+        server.close()
+        processor.stop()
+
+
+def loopback(seconds, speed, slow_delay=0.05):
+    """
+    Streams a synthetic board at speed times real time over loopback to a client reading as fast as it
+    can and to one sleeping slow_delay seconds per frame, and returns what each received and the server's stats.
+    """
+    from board_source import SyntheticSource
+    from RT_preprocess import EEGProcessor
+
+    processor = EEGProcessor(SyntheticSource(speed=speed))
+    server = StreamServer(len(processor.eeg_channels), processor.sampling_rate, port=0, queue_size=16).start()
+    processor.server = server
+    results = {}
+
+    def receive(name, delay):
+        client = StreamClient(*server.address, receive_buffer=64 * 1024)
+        latencies = []
+        samples = 0
+        for seq, first_sample, timestamp, data in client.frames():
+            latencies.append(time.time() - timestamp)
+            samples += data.shape[1]
+            if delay:
+                time.sleep(delay)
+        client.close()
+        results[name] = {'frames': client.frames_received, 'missed': client.frames_missed, 'samples': samples,
+                         'latency_ms_p50': 1e3 * float(np.median(latencies)) if latencies else None}
+
+    clients = [threading.Thread(target=receive, args=('fast', 0)),
+               threading.Thread(target=receive, args=('slow', slow_delay))]
+    for client in clients:
+        client.start()
+    while len(server.subscribers) < len(clients):
+        time.sleep(0.01)
+
+    processor.board.get_board_data()
+    end = time.time() + seconds
+    while time.time() < end:
+        processor.update()
+        time.sleep(0.01)
+    stats = server.stats()
+    server.close()
+    processor.stop()
+    for client in clients:
+        client.join()
+    return results, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve_parser = commands.add_parser('serve', help="Stream the processed EEG")
+    serve_parser.add_argument('--host', default='0.0.0.0')
+    serve_parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    serve_parser.add_argument('--playback', default=None, help="Replay the raw recording of this session directory")
+    serve_parser.add_argument('--speed', type=float, default=1.0)
+    listen_parser = commands.add_parser('listen', help="Print the frames received from a server")
+    listen_parser.add_argument('host')
+    listen_parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    loopback_parser = commands.add_parser('loopback', help="Stream a synthetic board to a fast and a slow local client")
+    loopback_parser.add_argument('--seconds', type=float, default=5)
+    loopback_parser.add_argument('--speed', type=float, default=20, help="Synthetic board speed")
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        from RT_preprocess import EEGProcessor
+        source = None
+        if args.playback:
+            from board_source import PlaybackSource
+            source = PlaybackSource(args.playback, speed=args.speed, loop=True)
+        processor = EEGProcessor(source)
+        server = StreamServer(len(processor.eeg_channels), processor.sampling_rate, args.host, args.port).start()
+        print(f"Streaming on {server.address[0]}:{server.address[1]}")
+        serve(processor, server)
+    elif args.command == 'listen':
+        client = StreamClient(args.host, args.port)
+        print(f"{client.n_channels} channels at {client.sampling_rate} Hz")
+        for seq, first_sample, timestamp, data in client.frames():
+            print(f"frame {seq}: samples {first_sample}-{first_sample + data.shape[1]}, "
+                  f"latency {1e3 * (time.time() - timestamp):.0f} ms, missed {client.frames_missed}")
+    else:
+        results, stats = loopback(args.seconds, args.speed)
+        print(f"Server: {stats['frames']} frames, {stats['samples']} samples")
+        for subscriber in stats['subscribers'] + stats['disconnected']:
+            print(f"  subscriber {subscriber['address']}: sent {subscriber['frames_sent']}, "
+                  f"dropped {subscriber['frames_dropped']}, max queued {subscriber['max_queued']}")
+        for name, result in results.items():
+            print(f"Client {name}: {result['frames']} frames, {result['missed']} missed, {result['samples']} samples, "
+                  f"median latency {result['latency_ms_p50']:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+import numpy as np
+from scipy.signal import butter, iirnotch, sosfilt, sosfilt_zi, sosfiltfilt, tf2sos
+
+
+class StreamingFilter:
+    """
+    Stateful bandpass + notch filter for streaming multi-channel EEG.
+
+    The filter coefficients are designed once, as a single second-order-sections cascade
+    (bandpass followed by notch). The filter state is kept between calls, so each call to
+    process() only filters the newly drained samples. All channels are filtered together
+    in one call along axis 1.
+    """
+    def __init__(self, n_channels, sampling_rate, lowcut=1.0, highcut=50.0, notch=60.0,
+                 order=2, notch_quality=30):
+        self.n_channels = n_channels
+        self.sampling_rate = sampling_rate
+
+        # Design the coefficients once
+        bandpass_sos = butter(order, [lowcut, highcut], btype='band', fs=sampling_rate, output='sos')
+        b, a = iirnotch(notch, notch_quality, fs=sampling_rate)
+        self.sos = np.vstack((bandpass_sos, tf2sos(b, a)))
+
+        # Steady-state response to a unit step, scaled by the first sample of each channel
+        self._zi_step = sosfilt_zi(self.sos)
+        self.zi = None
+
+    def reset(self):
+        """
+        Forgets the filter state. The next call to process() starts the filter again.
+        """
+        self.zi = None
+
+    def process(self, chunk):
+        """
+        Filters a (n_channels, n_samples) chunk of new raw samples.
+
+        Returns the filtered chunk with the same shape. The filter state is carried over
+        to the next call, so consecutive chunks are filtered as one continuous signal.
+        """
+        if chunk.shape[1] == 0:
+            return np.empty((self.n_channels, 0))
+
+        if self.zi is None:
+            # Start from the steady state of the first sample to avoid a large step transient
+            # caused by the DC offset of the electrodes
+            self.zi = self._zi_step[:, np.newaxis, :] * chunk[:, 0][np.newaxis, :, np.newaxis]
+
+        filtered, self.zi = sosfilt(self.sos, chunk, axis=1, zi=self.zi)
+        return filtered
+
+    def process_epochs(self, epochs, zero_phase=False):
+        """
+        Filters a (n_trials, n_channels, n_samples) array of epochs offline, in one call for every trial
+        and channel. Each epoch is filtered on its own, starting from the steady state of its first
+        sample like process(), and the streaming state is left untouched.
+
+        zero_phase filters forward and backward (sosfiltfilt) instead, which removes the phase delay
+        of the causal filter used online.
+        """
+        if zero_phase:
+            return sosfiltfilt(self.sos, epochs, axis=-1)
+        zi = self._zi_step[:, np.newaxis, np.newaxis, :] * epochs[np.newaxis, :, :, 0, np.newaxis]
+        filtered, _ = sosfilt(self.sos, epochs, axis=-1, zi=zi)
+        return filtered
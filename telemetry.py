@@ -0,0 +1,144 @@
+import bisect
+import json
+import threading
+import time
+
+TIMING_FILE = 'timing.json'
+
+# Histogram bucket bounds: 8 log-spaced buckets per decade from 1e-6 to 1e6, which covers durations
+# from a microsecond to minutes in seconds as well as counts such as the number of samples drained
+BUCKET_BOUNDS = [10 ** (e / 8) for e in range(-48, 49)]
+
+
+class Histogram:
+    """
+    Fixed-bucket log-scale histogram. Recording a value is a bisect and a few additions, and the
+    memory used doesn't grow with the number of values, so it can stay on for a whole session.
+    Percentiles are estimated from the buckets (within 15%), count, sum, min and max are exact.
+    Zero and negative values, e.g. empty board drains, are counted apart from the log buckets and
+    reported as 0 by percentile().
+    """
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.zeros = 0  # values <= 0
+        self.count = 0
+        self.total = 0.0
+        self.min = float('inf')
+        self.max = float('-inf')
+
+    def add(self, value):
+        if value <= 0:
+            self.zeros += 1
+        else:
+            self.buckets[bisect.bisect_right(BUCKET_BOUNDS, value)] += 1
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q):
+        if self.count == 0:
+            return None
+        rank = q / 100 * self.count
+        if self.zeros > 0 and rank <= self.zeros:
+            return min(max(0.0, self.min), self.max)
+        seen = self.zeros
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank and n > 0:
+                # Geometric middle of the bucket, clipped to the values actually seen
+                low = BUCKET_BOUNDS[i - 1] if i > 0 else self.min
+                high = BUCKET_BOUNDS[i] if i < len(BUCKET_BOUNDS) else self.max
+                return min(max((low * high) ** 0.5 if low > 0 else high, self.min), self.max)
+        return self.max
+
+    def summary(self):
+        if self.count == 0:
+            return {'count': 0}
+        return {
+            'count': self.count,
+            'zeros': self.zeros,
+            'mean': self.total / self.count,
+            'min': self.min,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'max': self.max,
+        }
+
+
+class _Timer:
+    __slots__ = ('telemetry', 'name', 'start')
+
+    def __init__(self, telemetry, name):
+        self.telemetry = telemetry
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.telemetry.observe(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class Telemetry:
+    """
+    Counters and histograms for the hot paths of a session (frames, board drains, filtering, saving,
+    uploads), cheap enough to leave on during real sessions.
+
+    count() increments a counter, observe() adds a value (durations in seconds) to a histogram and
+    timer() times a with block. report() summarizes everything and save() writes it as JSON, e.g.
+    next to the session data. reset() starts over, e.g. at the start of a session.
+    """
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counters = {}
+            self.histograms = {}
+            self.started = time.time()
+
+    def count(self, name, n=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name, value):
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.add(value)
+
+    def timer(self, name):
+        """
+        Context manager that adds the duration of its block, in seconds, to the histogram name.
+        """
+        return _Timer(self, name)
+
+    def report(self):
+        with self._lock:
+            return {
+                'started': self.started,
+                'duration': time.time() - self.started,
+                'counters': dict(self.counters),
+                'histograms': {name: h.summary() for name, h in sorted(self.histograms.items())},
+            }
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+
+# Telemetry shared by the modules of the application, see TIMING_FILE for the per-session report
+metrics = Telemetry()
@@ -0,0 +1,257 @@
+import json
+import os
+import threading
+import time
+
+# Box only accepts chunked uploads for files of at least 20 MB
+CHUNKED_UPLOAD_THRESHOLD = 20 * 1024 * 1024
+
+
+class UploadQueue(threading.Thread):
+    """
+    Background worker that uploads session artifacts to Box.
+
+    Jobs are deduplicated by (kind, target, path): a file is uploaded exactly once, and an update of an
+    existing Box file is only repeated when the local file has changed since it was last sent.
+    Failed requests are retried with exponential backoff. Large files are sent through Box chunked
+    uploads whose session ID is saved, so an interrupted upload resumes where it stopped.
+    report() gives the size, status and upload time of jobs, e.g. for the timing report of a session.
+    An update can be given an export function that writes the file right before it is sent, so the
+    latest version of e.g. a table is uploaded even if the job waited for retries or a restart.
+
+    The queue's state is written to state_path after every change and reloaded on creation, so jobs
+    that were still pending when the application closed are picked up on the next launch.
+
+    client_factory is called from the worker thread to create the Box client (e.g. authenticate),
+    which lets the queue run against local_box.LocalBoxClient in tests.
+    """
+    def __init__(self, client_factory, state_path, max_attempts=5, backoff=2.0, max_backoff=300.0,
+                 chunked_threshold=CHUNKED_UPLOAD_THRESHOLD):
+        super().__init__(name="UploadQueue", daemon=True)
+        self.client_factory = client_factory
+        self.state_path = state_path
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.chunked_threshold = chunked_threshold
+        self.client = None
+
+        self._condition = threading.Condition()
+        self._exporters = {}  # job key -> function writing the file before it is sent, not persisted
+        self._stop_requested = False
+        self.jobs = self._load_state()
+
+    # Enqueueing
+
+    def upload(self, folder_id, path):
+        """
+        Queues path to be uploaded as a new file into the Box folder folder_id.
+        """
+        return self._add('upload', folder_id, path)
+
+    def update(self, file_id, path, export=None):
+        """
+        Queues the Box file file_id to be overwritten with the contents of path.
+        If export is given, export(path) is called right before every attempt to send the file.
+        """
+        return self._add('update', file_id, path, export)
+
+    def pending_updates(self, file_id):
+        """
+        Paths of the updates of the Box file file_id that haven't been sent yet, including the ones
+        left over by the last launch.
+        """
+        with self._condition:
+            return [job['path'] for job in self.jobs.values() if job['kind'] == 'update' and
+                    job['target'] == str(file_id) and job['status'] in ('pending', 'active', 'failed')]
+
+    @staticmethod
+    def _key(kind, target, path):
+        return f"{kind}:{target}:{path}"
+
+    def _add(self, kind, target, path, export=None):
+        path = os.path.abspath(path)
+        key = self._key(kind, target, path)
+        version = self._version(path)
+        with self._condition:
+            if export is not None:
+                self._exporters[key] = export
+            job = self.jobs.get(key)
+            if job is not None and (job['status'] == 'pending' or
+                                    (job['status'] == 'done' and (kind == 'upload' or job['version'] == version))):
+                return key
+            self.jobs[key] = {
+                'kind': kind,
+                'target': str(target),
+                'path': path,
+                'version': version,
+                'status': 'pending',
+                'attempts': 0,
+                'next_attempt': 0.0,
+                'size': os.path.getsize(path),
+                'upload_session_id': None,
+                'seconds': None,
+                'result': None,
+                'error': None,
+            }
+            self._save_state()
+            self._condition.notify_all()
+        return key
+
+    # Progress
+
+    def progress(self):
+        """
+        Returns a summary of the queue for display: number of jobs per status and bytes sent so far.
+        """
+        with self._condition:
+            jobs = list(self.jobs.values())
+        summary = {'total': len(jobs), 'pending': 0, 'active': 0, 'done': 0, 'failed': 0,
+                   'bytes_done': 0, 'bytes_total': 0}
+        for job in jobs:
+            summary[job['status']] += 1
+            summary['bytes_total'] += job['size']
+            if job['status'] == 'done':
+                summary['bytes_done'] += job['size']
+        return summary
+
+    def report(self, keys):
+        """
+        Returns the kind, file name, status, size, attempts and upload time (seconds of the attempt that
+        succeeded) of the jobs with these keys, as returned by upload() and update().
+        """
+        with self._condition:
+            jobs = [self.jobs[key] for key in keys if key in self.jobs]
+            return [{'kind': job['kind'], 'file': os.path.basename(job['path']), 'status': job['status'],
+                     'bytes': job['size'], 'attempts': job['attempts'], 'seconds': job.get('seconds'),
+                     'error': job['error']} for job in jobs]
+
+    def flush(self, timeout=None):
+        """
+        Blocks until no job is pending or active, or until timeout seconds have passed.
+
+        Returns True if the queue is idle.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while any(job['status'] in ('pending', 'active') for job in self.jobs.values()):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def stop(self):
+        with self._condition:
+            self._stop_requested = True
+            self._condition.notify_all()
+        if self.is_alive():
+            self.join()
+
+    # Worker
+
+    def run(self):
+        while True:
+            with self._condition:
+                job = self._next_job()
+                while job is None and not self._stop_requested:
+                    self._condition.wait(self._time_to_next_attempt())
+                    job = self._next_job()
+                if self._stop_requested:
+                    return
+                job['status'] = 'active'
+                job['attempts'] += 1
+
+            started = time.perf_counter()
+            try:
+                if self.client is None:
+                    self.client = self.client_factory()
+                export = self._exporters.get(self._key(job['kind'], job['target'], job['path']))
+                if export is not None:
+                    export(job['path'])
+                    with self._condition:
+                        job['size'] = os.path.getsize(job['path'])
+                result = self._send(job)
+            except Exception as e:
+                with self._condition:
+                    job['error'] = str(e)
+                    if job['attempts'] >= self.max_attempts:
+                        job['status'] = 'failed'
+                        print(f"Giving up on {job['kind']} of {job['path']}: {e}")
+                    else:
+                        job['status'] = 'pending'
+                        delay = min(self.backoff * 2 ** (job['attempts'] - 1), self.max_backoff)
+                        job['next_attempt'] = time.time() + delay
+                        print(f"{job['kind']} of {job['path']} failed ({e}), retrying in {delay:.0f} s")
+                    self._save_state()
+                    self._condition.notify_all()
+            else:
+                with self._condition:
+                    job['status'] = 'done'
+                    job['seconds'] = time.perf_counter() - started
+                    job['result'] = result
+                    job['error'] = None
+                    self._save_state()
+                    self._condition.notify_all()
+
+    def _next_job(self):
+        now = time.time()
+        for job in self.jobs.values():
+            if job['status'] == 'pending' and job['next_attempt'] <= now:
+                return job
+        return None
+
+    def _time_to_next_attempt(self):
+        waiting = [job['next_attempt'] for job in self.jobs.values() if job['status'] == 'pending']
+        if not waiting:
+            return None
+        return max(0.0, min(waiting) - time.time())
+
+    def _send(self, job):
+        if job['kind'] == 'update':
+            box_file = self.client.file(job['target']).get()
+            with open(job['path'], 'rb') as f:
+                return box_file.update_contents_with_stream(f).id
+
+        if job['size'] < self.chunked_threshold:
+            return self.client.folder(job['target']).upload(job['path'], os.path.basename(job['path'])).id
+
+        # Chunked upload, keep the upload session so it can be resumed after a failure or a restart
+        if job['upload_session_id'] is not None:
+            try:
+                uploader = self.client.upload_session(job['upload_session_id']).get_chunked_uploader(job['path'])
+                return uploader.resume().id
+            except Exception as e:
+                print(f"Could not resume the upload of {job['path']} ({e}), starting over")
+        upload_session = self.client.folder(job['target']).create_upload_session(job['size'],
+                                                                                 os.path.basename(job['path']))
+        with self._condition:
+            job['upload_session_id'] = upload_session.id
+            self._save_state()
+        return upload_session.get_chunked_uploader(job['path']).start().id
+
+    # Persistence
+
+    @staticmethod
+    def _version(path):
+        stat = os.stat(path)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def _load_state(self):
+        if not os.path.exists(self.state_path):
+            return {}
+        with open(self.state_path) as f:
+            jobs = json.load(f)
+        for job in jobs.values():
+            # Jobs interrupted by the last shutdown, or that gave up, are tried again
+            if job['status'] in ('active', 'failed'):
+                job['status'] = 'pending'
+                job['attempts'] = 0
+            job['next_attempt'] = 0.0
+        return jobs
+
+    def _save_state(self):
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.jobs, f, indent=2)
+        os.replace(tmp_path, self.state_path)
@@ -0,0 +1,206 @@
+import datetime
+import hashlib
+import os
+import sqlite3
+import pandas as pd
+
+# Columns of the user table CSV stored in Box, in order
+TABLE_COLUMNS = ['ID', 'First', 'Last', 'EID', 'StimulantUse', 'CaffeineMg', 'MealSize', 'MealDesc',
+                 'Exercised', 'ExerciseDesc', 'HairProduct', 'OtherHair', 'LastTime', 'SessionNum']
+
+# Survey answers copied into the session history
+SURVEY_COLUMNS = TABLE_COLUMNS[4:12]
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+def file_sha1(path):
+    """
+    SHA-1 of the contents of a file, as Box reports it for its files.
+    """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def check_unique(table):
+    """
+    Raises ValueError if a user table has several rows with the same EID or ID, which the registry
+    could only merge by dropping participants.
+    """
+    problems = []
+    for column in ('EID', 'ID'):
+        values = table[column].dropna()
+        duplicates = values[values.duplicated()].unique()
+        if len(duplicates) > 0:
+            problems.append(f"{column} {', '.join(str(v) for v in duplicates)}")
+    if problems:
+        raise ValueError(f"The user table has duplicate {' and '.join(problems)}, fix it before importing it")
+
+
+class UserRegistry:
+    """
+    User table backed by SQLite, with a unique index on EID.
+
+    Looking up and upserting a participant are index lookups, so they don't slow down as the number
+    of participants grows. Every upsert also appends a row to the sessions table, which keeps the survey
+    answers of every session instead of only the latest ones. export_csv() writes the users table in the
+    schema of the CSV stored in Box.
+
+    A participant is identified by their EID. A session recorded under a registered EID with a different
+    name keeps the registered name, the name given is recorded in the name_conflicts table instead.
+    synced_sha1 is the SHA-1 of the CSV last imported or exported, so the table in Box only needs to be
+    downloaded again when it holds another version.
+    """
+    def __init__(self, path=':memory:'):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        columns = ', '.join(f'"{c}"' for c in TABLE_COLUMNS[1:])
+        self.connection.executescript(f'''
+            CREATE TABLE IF NOT EXISTS users (ID INTEGER PRIMARY KEY, {columns});
+            CREATE UNIQUE INDEX IF NOT EXISTS users_eid ON users (EID);
+            CREATE TABLE IF NOT EXISTS sessions (
+                EID TEXT NOT NULL, SessionNum INTEGER NOT NULL, Time TEXT NOT NULL,
+                {', '.join(f'"{c}"' for c in SURVEY_COLUMNS)}
+            );
+            CREATE INDEX IF NOT EXISTS sessions_eid ON sessions (EID);
+            CREATE TABLE IF NOT EXISTS name_conflicts (
+                EID TEXT NOT NULL, First TEXT, Last TEXT, Time TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS sync (Key TEXT PRIMARY KEY, Value TEXT);
+        ''')
+        self.connection.commit()
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM users').fetchone()[0]
+
+    @property
+    def synced_sha1(self):
+        row = self.connection.execute("SELECT Value FROM sync WHERE Key = 'sha1'").fetchone()
+        return None if row is None else row[0]
+
+    @synced_sha1.setter
+    def synced_sha1(self, sha1):
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO sync VALUES ('sha1', ?)", (sha1,))
+
+    def import_table(self, table, replace=False):
+        """
+        Merges a user table (pandas DataFrame in the Box CSV schema) into the registry, keyed by EID.
+        With replace=True the registered users are replaced by the table, the session history is kept.
+
+        Raises ValueError if the table has duplicate EIDs or IDs, see check_unique.
+        """
+        check_unique(table)
+        rows = table.reindex(columns=TABLE_COLUMNS).astype(object)
+        rows = rows.where(rows.notna(), None)
+        placeholders = ', '.join('?' for _ in TABLE_COLUMNS)
+        updates = ', '.join(f'"{c}" = excluded."{c}"' for c in TABLE_COLUMNS[1:])
+        with self.connection:
+            if replace:
+                self.connection.execute('DELETE FROM users')
+            self.connection.executemany(
+                f'INSERT INTO users VALUES ({placeholders}) ON CONFLICT (EID) DO UPDATE SET {updates}',
+                rows.itertuples(index=False, name=None))
+
+    def import_csv(self, path, replace=False):
+        self.import_table(pd.read_csv(path, dtype={'EID': str}), replace)
+        self.synced_sha1 = file_sha1(path)
+
+    def lookup(self, eid):
+        """
+        Returns the row of the participant with this EID as a dict, or None if they are not registered.
+        """
+        cursor = self.connection.execute('SELECT * FROM users WHERE EID = ?', (eid,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip([d[0] for d in cursor.description], row))
+
+    def upsert(self, first, last, eid, caffeine_mg, meal_size, meal_desc, exercised_TF, exercise_desc,
+               stim_use_TF=0, hair_product='', other_hair=''):
+        """
+        Records the survey answers of a new session, like track_user.
+
+        A new participant starts at SessionNum 1, an existing one (same EID) has their answers replaced
+        and SessionNum incremented. The answers are also appended to the session history. If the name
+        differs from the registered one, the registered name is kept and the conflict recorded.
+
+        Returns the updated row as a one-row pandas DataFrame in the user table schema.
+        """
+        now = str(datetime.datetime.now())
+        answers = {
+            'StimulantUse': stim_use_TF,
+            'CaffeineMg': caffeine_mg,
+            'MealSize': meal_size,
+            'MealDesc': meal_desc,
+            'Exercised': exercised_TF,
+            'ExerciseDesc': exercise_desc,
+            'HairProduct': hair_product,
+            'OtherHair': other_hair,
+        }
+        with self.connection:
+            existing = self.lookup(eid)
+            if existing is None:
+                next_id = self.connection.execute('SELECT COALESCE(MAX(ID), 0) + 1 FROM users').fetchone()[0]
+                row = {'ID': next_id, 'First': first, 'Last': last, 'EID': eid, **answers,
+                       'LastTime': now, 'SessionNum': 1}
+                self.connection.execute(f'INSERT INTO users VALUES ({", ".join("?" for _ in TABLE_COLUMNS)})',
+                                        [row[c] for c in TABLE_COLUMNS])
+            else:
+                if (existing['First'], existing['Last']) != (first, last):
+                    print(f"EID {eid} is registered as {existing['First']} {existing['Last']}, "
+                          f"not {first} {last}, the registered name is kept")
+                    self.connection.execute('INSERT INTO name_conflicts VALUES (?, ?, ?, ?)', (eid, first, last, now))
+                row = {**existing, **answers, 'LastTime': now, 'SessionNum': int(existing['SessionNum'] or 0) + 1}
+                assignments = ', '.join(f'"{c}" = ?' for c in TABLE_COLUMNS[1:])
+                self.connection.execute(f'UPDATE users SET {assignments} WHERE EID = ?',
+                                        [row[c] for c in TABLE_COLUMNS[1:]] + [eid])
+            self.connection.execute(
+                f'INSERT INTO sessions VALUES (?, ?, ?, {", ".join("?" for _ in SURVEY_COLUMNS)})',
+                [eid, row['SessionNum'], now] + [answers[c] for c in SURVEY_COLUMNS])
+        return pd.DataFrame([row], columns=TABLE_COLUMNS)
+
+    def needs_survey(self, eid, max_age_seconds=43200):
+        """
+        Returns 1 if the participant has to fill in the metadata part of the survey, 0 if they
+        already did it in the last max_age_seconds (12 hours by default), like check_user_table.
+        """
+        row = self.lookup(eid)
+        if row is None or row['LastTime'] is None:
+            return 1
+        last_time = datetime.datetime.strptime(row['LastTime'], TIME_FORMAT)
+        return int((datetime.datetime.now() - last_time).total_seconds() >= max_age_seconds)
+
+    def history(self, eid=None):
+        """
+        Returns the session history, of one participant if eid is given, as a pandas DataFrame.
+        """
+        if eid is None:
+            return pd.read_sql_query('SELECT * FROM sessions', self.connection)
+        return pd.read_sql_query('SELECT * FROM sessions WHERE EID = ?', self.connection, params=(eid,))
+
+    def name_conflicts(self):
+        """
+        Returns the sessions recorded under a registered EID with another name, as a pandas DataFrame.
+        """
+        return pd.read_sql_query('SELECT * FROM name_conflicts', self.connection)
+
+    def to_table(self):
+        return pd.read_sql_query('SELECT * FROM users ORDER BY ID', self.connection)[TABLE_COLUMNS]
+
+    def export_csv(self, path):
+        """
+        Writes the users table in the schema of the Box user table CSV. The file is replaced at once, so
+        an upload reading it never sees a partly written table.
+        """
+        table = self.to_table()
+        check_unique(table)
+        tmp_path = path + '.tmp'
+        table.to_csv(tmp_path, index=False)
+        os.replace(tmp_path, path)
+        self.synced_sha1 = file_sha1(path)
+
+    def close(self):
+        self.connection.close()